@@ -0,0 +1,140 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils import read_json
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+ROUTES = [
+    ('GET', re.compile(r'^/api/v1/timelines/(home|public)$'), 'timeline'),
+    ('GET', re.compile(r'^/api/v1/timelines/tag/([^/]+)$'), 'timeline'),
+    ('GET', re.compile(r'^/api/v1/notifications$'), 'notifications'),
+    ('GET', re.compile(r'^/api/v1/accounts/relationships$'), 'relationships'),
+    ('GET', re.compile(r'^/api/v1/accounts/([^/]+)/statuses$'), 'account_statuses'),
+    ('GET', re.compile(r'^/api/v1/accounts/([^/]+)/(followers|following)$'), 'account_list'),
+    ('GET', re.compile(r'^/api/v1/accounts/([^/]+)$'), 'account'),
+    ('POST', re.compile(r'^/api/v1/accounts/([^/]+)/(follow|unfollow)$'), 'follow'),
+    ('POST', re.compile(r'^/api/v1/statuses/([^/]+)/favourite$'), 'favourite'),
+]
+
+
+class MockPixelfedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out as separate writes, don't let nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                self.server.counts[name] += 1
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                body = getattr(self.server, name)(query, *match.groups())
+                return self._send(200, body)
+        self.server.counts['not_found'] += 1
+        self._send(404, {'error': 'not found'})
+
+    def _send(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-RateLimit-Limit', '300')
+        self.send_header('X-RateLimit-Remaining', '300')
+        self.send_header('X-RateLimit-Reset', '300')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockPixelfedServer(ThreadingHTTPServer):
+    '''
+    Serves the slice of the Pixelfed api the bot uses from the json fixtures.
+    Favourites and follows are remembered so later reads reflect them.
+    `latency` seconds are added to every response.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address: tuple = ('127.0.0.1', 0), latency: float = 0.0):
+        super().__init__(address, MockPixelfedHandler)
+        self.latency = latency
+        self.statuses = read_json(os.path.join(FIXTURES, 'statuses.json'))
+        self.notification_list = read_json(os.path.join(FIXTURES, 'notifications.json'))
+        self.relationship = read_json(os.path.join(FIXTURES, 'relationship.json'))
+        self.accounts = read_json(os.path.join(FIXTURES, 'accounts.json'))
+        self.counts = Counter()
+        self.favourited = set()
+        self.following = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _status(self, status: dict) -> dict:
+        return {**status, 'favourited': status['id'] in self.favourited}
+
+    def _limit(self, query: dict, default: int = 20) -> int:
+        return int(query.get('limit', [default])[0])
+
+    def timeline(self, query: dict, name: str) -> list:
+        since_id = query.get('since_id', query.get('min_id', [None]))[0]
+        statuses = [s for s in self.statuses if since_id is None or int(s['id']) > int(since_id)]
+        return [self._status(s) for s in statuses[:self._limit(query)]]
+
+    def notifications(self, query: dict) -> list:
+        return self.notification_list
+
+    def relationships(self, query: dict) -> list:
+        return [{**self.relationship, 'id': id, 'following': id in self.following} for id in query.get('id[]', [])]
+
+    def account_statuses(self, query: dict, account_id: str) -> list:
+        account = {**self.accounts[0], 'id': account_id}
+        statuses = [{**s, 'id': f'{account_id}{n:03}', 'account': account} for n, s in enumerate(self.statuses)]
+        return [self._status(s) for s in statuses[:self._limit(query)]]
+
+    def account_list(self, query: dict, account_id: str, kind: str) -> list:
+        return self.accounts[:self._limit(query, 40)]
+
+    def account(self, query: dict, account_id: str) -> dict:
+        return {**self.accounts[0], 'id': account_id}
+
+    def follow(self, query: dict, account_id: str, action: str) -> dict:
+        with self._lock:
+            if action == 'follow':
+                self.following.add(account_id)
+            else:
+                self.following.discard(account_id)
+        return {**self.relationship, 'id': account_id, 'following': action == 'follow'}
+
+    def favourite(self, query: dict, status_id: str) -> dict:
+        with self._lock:
+            self.favourited.add(status_id)
+        return {'id': status_id, 'favourited': True}
@@ -0,0 +1,195 @@
+'''
+End to end session benchmark.
+
+Runs a full bot session per timeline type against the local mock Pixelfed
+api, with pacing sleeps on a virtual clock, and reports requests, db
+queries, cpu time and peak memory per session.
+
+With --time-scale the sleeps are real but scaled (0.001: a 30 second pause
+takes 30 ms), so they overlap with requests, and wall_ms shows what the
+background prefetch of the sync engine saves; --latency adds a delay to
+every mock response.
+
+    python benchmarks/session_bench.py [-t home tag] [--engine async] [--json]
+    python benchmarks/session_bench.py --time-scale 0.001 --latency 0.05 [--no-prefetch]
+'''
+import argparse
+import asyncio  # noqa: F401 imported up front, like requests in prepare
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('APP_LOG', os.path.join(tempfile.gettempdir(), 'pixelfed_bench.log'))
+
+import cache  # noqa: E402
+import client  # noqa: E402
+import dal  # noqa: E402
+import logconfig  # noqa: E402
+import main  # noqa: E402
+import metrics  # noqa: E402
+import pacing  # noqa: E402
+import sampling  # noqa: E402
+import scoring  # noqa: E402
+from mock_server import MockPixelfedServer  # noqa: E402
+from models import map_account  # noqa: E402
+
+ACCOUNT_ID = '1'
+
+
+class VirtualClock:
+    '''stands in for time.monotonic/time.sleep so pacing costs no wall time'''
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+        self.slept += seconds
+
+
+class ScaledClock:
+    '''real time in which every pacing second lasts `scale` real seconds'''
+
+    def __init__(self, scale: float):
+        self.scale = scale
+        self.start = time.monotonic()
+        self.slept = 0.0
+
+    def __call__(self) -> float:
+        return (time.monotonic() - self.start) / self.scale
+
+    def sleep(self, seconds: float):
+        self.slept += seconds
+        time.sleep(seconds * self.scale)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement: str):
+        if dal.is_query(statement):
+            self.count += 1
+
+
+def prepare(server: MockPixelfedServer, db_path: str, likes: int, follows: int, prefetch: bool = True,
+            time_scale: float = None) -> VirtualClock:
+    settings = main.settings
+    settings.prefetch = prefetch
+    settings.base_url = server.base_url
+    settings.account_id = ACCOUNT_ID
+    settings.headers = {'Authorization': 'Bearer bench'}
+    settings.likes_per_session = likes
+    settings.follows_per_day = follows
+
+    client.close_session()
+    # requests is imported lazily, load it here so the import is not counted as session cost
+    client.get_session(settings)
+    cache.reset()
+    metrics.reset()
+    pacing.reset()
+    sampling.reset()
+    scoring.reset()
+    clock = ScaledClock(time_scale) if time_scale else VirtualClock()
+    pacing.set_pacer(settings, pacing.Pacer(
+        settings.pacing, settings.rate_limit_floor, settings.rate_limit_backoff, clock=clock, sleep=clock.sleep
+    ))
+
+    dal.close_connection()
+    dal.DB_PATH = db_path
+    dal.create_tables()
+    dal.save_accounts(map_account(account) for account in server.accounts)
+    dal.mark_relationships((account['id'] for account in server.accounts), 'followed_by')
+    cache.get_relationship_cache(settings).warm()
+    return clock
+
+
+def run_timeline(timeline_type: str, engine: str, likes: int, follows: int, workdir: str, prefetch: bool = True,
+                 latency: float = 0.0, time_scale: float = None) -> dict:
+    server = MockPixelfedServer(latency=latency).start()
+    try:
+        clock = prepare(server, os.path.join(workdir, f'{timeline_type}.db'), likes, follows, prefetch, time_scale)
+        queries = QueryCounter()
+        dal.trace_callback = queries
+        dal.close_connection()
+
+        tracemalloc.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        if engine == 'async':
+            like_count = main.run_async_session(timeline_type)
+        else:
+            like_count = main.run_session(timeline_type)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        dal.trace_callback = None
+        dal.close_connection()
+        client.close_session()
+        server.stop()
+    return {
+        'timeline': timeline_type,
+        'likes': like_count,
+        'requests': sum(server.counts.values()),
+        'requests_by_route': dict(server.counts),
+        'db_queries': queries.count,
+        'cpu_ms': round(cpu * 1000, 1),
+        'wall_ms': round(wall * 1000, 1),
+        'peak_kib': round(peak / 1024, 1),
+        'virtual_sleep_s': round(clock.slept, 1),
+    }
+
+
+def run(timeline_types: list, engine: str = 'sync', likes: int = 15, follows: int = 0, seed: int = 1,
+        prefetch: bool = True, latency: float = 0.0, time_scale: float = None) -> list:
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        return [run_timeline(t, engine, likes, follows, workdir, prefetch, latency, time_scale) for t in timeline_types]
+
+
+def render(results: list) -> str:
+    columns = ['timeline', 'likes', 'requests', 'db_queries', 'cpu_ms', 'wall_ms', 'peak_kib', 'virtual_sleep_s']
+    rows = [columns] + [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark bot sessions against a local mock Pixelfed api.')
+    parser.add_argument('-t', '--timeline_type', nargs='+', choices=main.timeline_types, default=list(main.timeline_types))
+    parser.add_argument('-e', '--engine', choices=main.engines, default='sync')
+    parser.add_argument('-l', '--likes', type=int, default=15, help='likes per session')
+    parser.add_argument('-f', '--follows', type=int, default=0, help='follows per day')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-prefetch', dest='prefetch', action='store_false', help='fetch inline in sync sessions')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every mock response')
+    parser.add_argument('--time-scale', type=float, help='sleep for real, scaled by this factor, instead of on a virtual clock')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    parser.add_argument('-v', '--verbose', action='store_true', help='keep bot logging on')
+    args = parser.parse_args()
+    if args.verbose:
+        logconfig.configure_logging(main.settings)
+    else:
+        logging.disable(logging.CRITICAL)
+    try:
+        results = run(args.timeline_type, args.engine, args.likes, args.follows, args.seed,
+                      args.prefetch, args.latency, args.time_scale)
+    finally:
+        logconfig.stop_logging()
+    print(json.dumps(results, indent=4) if args.json else render(results))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,90 @@
+'''
+Startup benchmark.
+
+Times fresh interpreter runs of the cli paths that should start fast
+(--version, --help, --report) against a bare interpreter, and lists the
+heavy modules each one still loads.
+
+    python benchmarks/startup_bench.py [-n 10] [--json]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+MAIN = os.path.join(SRC, 'main.py')
+
+COMMANDS = {
+    'python': ['-c', 'pass'],
+    'import main': ['-c', 'import main'],
+    '--version': [MAIN, '--version'],
+    '--help': [MAIN, '--help'],
+    '--report': [MAIN, '-t', 'home', '--report'],
+}
+# only the paths that talk to the api should pay for these
+HEAVY = ['requests', 'urllib3', 'asyncio']
+
+
+def environment(workdir: str) -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SRC, env.get('PYTHONPATH')]))
+    env['APP_LOG'] = os.path.join(workdir, 'pixelbot.log')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def imported_modules(args: list, workdir: str) -> list:
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=workdir, env=environment(workdir),
+                            capture_output=True, text=True)
+    return [line.rsplit('|', 1)[1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')]
+
+
+def time_command(args: list, workdir: str, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=workdir, env=environment(workdir), capture_output=True, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run(runs: int = 10, commands: dict = COMMANDS) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, args in commands.items():
+            # one untimed run so the --report database and bytecode exist before timing
+            modules = imported_modules(args, workdir)
+            timings = time_command(args, workdir, runs)
+            results.append({
+                'command': name,
+                'median_ms': round(statistics.median(timings), 1),
+                'min_ms': round(min(timings), 1),
+                'modules': len(modules),
+                'heavy': [m for m in HEAVY if m in modules],
+            })
+    return results
+
+
+def render(results: list) -> str:
+    columns = ['command', 'median_ms', 'min_ms', 'modules', 'heavy']
+    rows = [columns] + [[str(r[c]) if c != 'heavy' else ','.join(r[c]) or '-' for c in columns] for r in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Time bot startup for the cheap cli paths.')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='timed runs per command')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+    results = run(args.runs)
+    print(json.dumps(results, indent=4) if args.json else render(results))
+
+
+if __name__ == '__main__':
+    main_cli()
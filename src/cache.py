@@ -0,0 +1,138 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from config import Settings
+from dal import ignore_user, load_ignored_ids, load_relationship_records
+from models import RelationshipStatus
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    '''LRU mapping whose entries go stale after `ttl` seconds.'''
+
+    def __init__(self, ttl: float, max_size: int, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key) -> tuple:
+        '''returns (value, fresh), value is None on a miss'''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None, False
+            self._data.move_to_end(key)
+            value, stored_at = entry
+            return value, self.clock() - stored_at < self.ttl
+
+    def put(self, key, value, stale: bool = False):
+        '''store value, `stale` entries are served but flagged for revalidation'''
+        stored_at = float('-inf') if stale else self.clock()
+        with self._lock:
+            self._data[key] = (value, stored_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RelationshipCache:
+    '''
+    In memory view of the relationships and ignore_account tables.
+    Stale relationships are still returned but refreshed on a background worker.
+    '''
+
+    def __init__(self, ttl: float, max_size: int, clock: Callable[[], float] = time.monotonic):
+        self.relationships = TTLCache(ttl, max_size, clock)
+        self.ignored = set()
+        self.warmed = False
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def warm(self):
+        '''load the tables, rows from the db have unknown age so they start out stale'''
+        for relationship in load_relationship_records():
+            self.relationships.put(relationship.id, relationship, stale=True)
+        self.ignored = set(load_ignored_ids())
+        self.warmed = True
+        log.info('warmed cache with %s relationships and %s ignored accounts', len(self.relationships), len(self.ignored))
+
+    def is_ignored(self, id: str) -> bool:
+        # until warmed the set only holds ids ignored in this process, the table has the rest
+        return id in self.ignored or (not self.warmed and ignore_user(id))
+
+    def ignore(self, id: str):
+        self.ignored.add(id)
+
+    def get(self, id: str) -> tuple:
+        return self.relationships.get(id)
+
+    def put(self, relationship: RelationshipStatus, stale: bool = False):
+        self.relationships.put(relationship.id, relationship, stale=stale)
+
+    def revalidate(self, id: str, loader: Callable[[], RelationshipStatus]):
+        '''queue `loader` to refresh `id` in the background, once per id at a time'''
+        with self._lock:
+            if id in self._pending:
+                return
+            self._pending.add(id)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='relationship-revalidate', daemon=True)
+                self._worker.start()
+        # run the loader with the caller's account settings and database
+        self._queue.put((id, contextvars.copy_context(), loader))
+
+    def join(self):
+        '''block until queued revalidations are done'''
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            id, context, loader = self._queue.get()
+            try:
+                relationship = context.run(loader)
+                if relationship:
+                    self.put(relationship)
+            except Exception as ex:
+                log.warning('failed to revalidate relationship %s: %s', id, ex)
+            finally:
+                with self._lock:
+                    self._pending.discard(id)
+                self._queue.task_done()
+
+
+_relationship_caches = {}
+_relationship_caches_lock = threading.Lock()
+
+
+def get_relationship_cache(settings: Settings) -> RelationshipCache:
+    '''one cache per account'''
+    key = (settings.base_url, settings.account_id)
+    with _relationship_caches_lock:
+        if key not in _relationship_caches:
+            _relationship_caches[key] = RelationshipCache(settings.relationship_cache_ttl, settings.relationship_cache_size)
+        return _relationship_caches[key]
+
+
+def reset():
+    with _relationship_caches_lock:
+        _relationship_caches.clear()
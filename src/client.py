@@ -0,0 +1,86 @@
+import logging
+import threading
+from typing import TYPE_CHECKING
+
+from config import Settings
+from metrics import endpoint, get_metrics
+from pacing import get_pacer
+
+log = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    import requests
+
+_adapter = None
+_sessions = {}
+_lock = threading.Lock()
+
+
+def get_session(settings: Settings) -> 'requests.Session':
+    '''
+    Return the session for this account, creating it on first use.
+    Every account's session mounts the same adapter, so accounts on the same
+    instance share its keep-alive pool, while cookies stay per account.
+    '''
+    global _adapter
+    # requests is the slowest import of the bot, load it when the first request goes out
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    key = (settings.base_url, settings.account_id)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            if _adapter is None:
+                log.info('creating http connection pool, pool size: %s', settings.http_pool_size)
+                _adapter = HTTPAdapter(
+                    pool_connections=settings.http_pool_size,
+                    pool_maxsize=settings.http_pool_size,
+                    max_retries=settings.http_retries
+                )
+            session = requests.Session()
+            session.mount('https://', _adapter)
+            session.mount('http://', _adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            _sessions[key] = session
+        return session
+
+
+def close_session():
+    global _adapter
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        if _adapter is not None:
+            _adapter.close()
+            _adapter = None
+
+
+def _request(method: str, url: str, settings: Settings, params: dict = None, stream: bool = False) -> 'requests.Response':
+    session = get_session(settings)
+    metrics = get_metrics()
+    name = endpoint(url, settings)
+    status = 'error'
+    try:
+        with metrics.timed('pixelfed_http_request_seconds', method=method, endpoint=name):
+            response = session.request(method, url, headers=settings.headers, params=params, timeout=settings.http_timeout,
+                                       stream=stream)
+        status = response.status_code
+        received = response.headers.get('Content-Length')
+        # a streamed body without Content-Length is not counted, reading it here would defeat the streaming
+        if received or not stream:
+            metrics.inc('pixelfed_http_response_bytes_total', int(received) if received else len(response.content), endpoint=name)
+    finally:
+        metrics.inc('pixelfed_http_requests_total', method=method, endpoint=name, status=status)
+    get_pacer(settings).observe(response)
+    return response
+
+
+def get(url: str, settings: Settings, params: dict = None, stream: bool = False) -> 'requests.Response':
+    '''with stream=True the body is read by the caller, who has to close the response'''
+    return _request('GET', url, settings, params=params, stream=stream)
+
+
+def post(url: str, settings: Settings) -> 'requests.Response':
+    return _request('POST', url, settings)
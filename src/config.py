@@ -1,4 +1,6 @@
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 from dotenv import load_dotenv
 
@@ -8,20 +10,153 @@ load_dotenv(dotenv_path)
 
 class Settings:
     def __init__(self):
+        # profile name, and the database it uses, for multi account runs (see runner.py)
+        self.name = 'default'
+        self.db_path = None
         self.token = os.getenv('TOKEN')
         self.app_log = os.getenv('APP_LOG')
         self.account_id = os.getenv('ACCOUNT_ID')
         self.likes_per_session = 15
+        # a session ends short of likes_per_session after this many passes in a row (a follower
+        # and a timeline batch) without a new like, once the marks, seen index and cooldown run dry
+        self.session_idle_passes = 5
         self.follows_per_day = 0
+        # follow only accounts with at least follower_count_min followers that follow
+        # between following_count_min and following_count_max accounts
         self.following_count_max = 200
+        self.following_count_min = 10
         self.follower_count_min = 25
         self.tags = ['runnersofmastodon', 'WindowFriday', 'minimalism', 'streetphotography', 'pnw', 'snow', 'birdwatching']
         self.base_url = 'https://pixelfed.social/'
         self.api_version = 'api/v1/'
+        self.http_pool_size = 10
+        self.http_retries = 2
+        # (connect, read) timeouts in seconds
+        self.http_timeout = (5, 30)
+        self.relationship_cache_ttl = 24 * 60 * 60
+        self.relationship_cache_size = 10000
+        # max concurrent reads for the async engine
+        self.concurrency = 8
+        # accounts per page when syncing followers/following
+        self.page_limit = 40
+        # stored account stats younger than this (seconds) are used instead of calling accounts/{id}
+        self.account_max_age = 7 * 24 * 60 * 60
+        # follower sampling: skip followers liked within the cooldown (seconds), reload the
+        # cached follower arrays after follower_sample_refresh seconds
+        self.follower_cooldown = 3 * 24 * 60 * 60
+        self.follower_sample_refresh = 60 * 60
+        self.follower_idle_cap_days = 30
+        self.follower_recent_bonus = 10
+        # follow candidate scoring: follow back rates per account bucket are pulled toward the overall
+        # rate by score_prior_weight pseudo follows (score_default_rate before any outcome is known),
+        # a candidate's score halves every score_half_life seconds and it is dropped after score_max_age
+        self.score_prior_weight = 10
+        self.score_default_rate = 0.1
+        self.score_half_life = 6 * 60 * 60
+        self.score_max_age = 24 * 60 * 60
+        self.score_pool_size = 500
+        self.score_refresh = 60 * 60
+        # accounts that just favourited one of our posts are likelier to follow back
+        self.score_source_weights = {'notifications': 2.0}
+        # decode status and account pages item by item from the response stream, and stop reading
+        # a timeline once enough posts to like are found
+        self.stream_timelines = True
+        self.stream_chunk_size = 16 * 1024
+        # sync sessions fetch the next follower and timeline batches in the background while
+        # sleeping between likes, keeping prefetch_depth batches each, dropped after prefetch_max_age seconds
+        self.prefetch = True
+        self.prefetch_depth = 1
+        self.prefetch_max_age = 10 * 60
+        # account ids per accounts/relationships request
+        self.relationship_chunk_size = 40
+        # per action class token bucket (rate per second, burst) and jitter distribution
+        self.pacing = {
+            'read': {'rate': 1.0, 'burst': 5, 'jitter': 'uniform', 'low': 0.5, 'high': 3},
+            'favourite': {'rate': 1 / 20, 'burst': 2, 'jitter': 'lognormal', 'mu': 2.7, 'sigma': 0.6, 'max': 120},
+            'follow': {'rate': 1 / 120, 'burst': 1, 'jitter': 'uniform', 'low': 30, 'high': 120},
+        }
+        # keep this many requests of the server's rate limit in reserve
+        self.rate_limit_floor = 5
+        self.rate_limit_backoff = 60
+        # ids per seen index bloom generation and its target false positive rate
+        self.seen_index_capacity = 1_000_000
+        self.seen_index_error_rate = 0.001
+        # --daemon: interval in minutes and daily (start, end) window per timeline type
+        self.daemon_schedule = {
+            'home': {'interval': 180, 'window': ('08:00', '22:00')},
+            'notifications': {'interval': 240, 'window': ('09:00', '21:00')},
+            'tag': {'interval': 300, 'window': ('10:00', '20:00')},
+        }
+        # logging: LOG_FORMAT=json for json lines, records go through a queue to a background
+        # listener unless LOG_QUEUE=0. log_sampling keeps that fraction of a logger's info/debug
+        # records, log_levels sets logger levels, e.g. {'dal': 'WARNING'}
+        self.log_format = os.getenv('LOG_FORMAT', 'text')
+        self.log_queue = os.getenv('LOG_QUEUE', '1') != '0'
+        self.log_sampling = {'dal': 1.0}
+        self.log_levels = {}
+        # session end exports, a Prometheus textfile and a json summary, skipped when unset
+        self.metrics_textfile = os.getenv('METRICS_TEXTFILE')
+        self.metrics_json = os.getenv('METRICS_JSON')
         self.headers = {
             "Authorization": f"Bearer {self.token}"
         }
 
+    @classmethod
+    def from_profile(cls, profile: dict) -> 'Settings':
+        '''defaults overridden by the profile's keys, the database defaults to <name>.db'''
+        settings = cls()
+        for key, value in profile.items():
+            if not hasattr(settings, key) or key == 'headers':
+                raise PixelFedBotException(f'unknown profile setting: {key}')
+            setattr(settings, key, value)
+        if 'name' not in profile:
+            raise PixelFedBotException('profile is missing a name')
+        settings.db_path = settings.db_path or f'{settings.name}.db'
+        settings.headers = {
+            "Authorization": f"Bearer {settings.token}"
+        }
+        return settings
+
+
+_active = ContextVar('settings', default=None)
+
+
+def active_settings() -> Settings:
+    '''the account settings bound to the current context, None outside `use_settings`'''
+    return _active.get()
+
+
+@contextmanager
+def use_settings(settings: Settings):
+    token = _active.set(settings)
+    try:
+        yield settings
+    finally:
+        _active.reset(token)
+
+
+class SettingsProxy:
+    '''
+    Stands in for a module level Settings instance. Attribute access goes to
+    the settings bound with `use_settings` in the current context, or to the
+    default instance, so code written against one global serves every account.
+    '''
+
+    def __init__(self, default: Settings):
+        object.__setattr__(self, '_default', default)
+
+    def _target(self) -> Settings:
+        return _active.get() or object.__getattribute__(self, '_default')
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._target(), name)
+
 
 class PixelFedBotException(Exception):
     pass
@@ -0,0 +1,113 @@
+import logging
+import signal
+import threading
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Callable
+
+log = logging.getLogger(__name__)
+
+
+class ShutdownRequested(Exception):
+    pass
+
+
+@dataclass
+class Schedule:
+    timeline_type: str
+    interval: timedelta
+    window_start: time
+    window_end: time
+    engine: str = 'sync'
+    next_run: datetime = None
+
+    def in_window(self, when: datetime) -> bool:
+        current = when.time()
+        if self.window_start <= self.window_end:
+            return self.window_start <= current <= self.window_end
+        # window wraps past midnight, e.g. 22:00-02:00
+        return current >= self.window_start or current <= self.window_end
+
+    def next_window_start(self, when: datetime) -> datetime:
+        start = datetime.combine(when.date(), self.window_start)
+        return start if start > when else start + timedelta(days=1)
+
+    def schedule_from(self, when: datetime):
+        '''first run at or after `when` that falls inside the daily window'''
+        self.next_run = when if self.in_window(when) else self.next_window_start(when)
+
+
+def parse_schedule(config: dict, now: datetime) -> list:
+    '''
+    config maps timeline type to {'interval': minutes, 'window': ('HH:MM', 'HH:MM'), 'engine': 'sync'}
+    '''
+    schedules = []
+    for timeline_type, entry in config.items():
+        start, end = entry.get('window', ('00:00', '23:59'))
+        schedule = Schedule(
+            timeline_type=timeline_type,
+            interval=timedelta(minutes=entry['interval']),
+            window_start=time.fromisoformat(start),
+            window_end=time.fromisoformat(end),
+            engine=entry.get('engine', 'sync')
+        )
+        schedule.schedule_from(now)
+        schedules.append(schedule)
+    return schedules
+
+
+class SessionScheduler:
+    '''
+    Runs sessions in one long lived process. Each timeline type runs every
+    `interval` inside its daily window, SIGTERM/SIGINT stop the loop and cut
+    short any pacing sleep in progress.
+    '''
+
+    def __init__(self, schedules: list, run_session: Callable[[str, str], int],
+                 now: Callable[[], datetime] = datetime.now):
+        self.schedules = schedules
+        self.run_session = run_session
+        self.now = now
+        self.stopping = threading.Event()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        log.info('received signal %s, shutting down after the current action', signum)
+        self.stop()
+
+    def stop(self):
+        self.stopping.set()
+
+    def sleep(self, seconds: float):
+        '''pacing sleep that wakes up and aborts the session on shutdown'''
+        if self.stopping.wait(seconds):
+            raise ShutdownRequested()
+
+    def next_due(self) -> Schedule:
+        return min(self.schedules, key=lambda s: s.next_run)
+
+    def run(self) -> int:
+        '''returns the number of sessions run'''
+        sessions = 0
+        while not self.stopping.is_set():
+            schedule = self.next_due()
+            delay = (schedule.next_run - self.now()).total_seconds()
+            if delay > 0:
+                log.info('next session %s at %s', schedule.timeline_type, schedule.next_run.strftime('%Y-%m-%d %H:%M'))
+                if self.stopping.wait(delay):
+                    break
+            log.info('starting %s session', schedule.timeline_type)
+            try:
+                self.run_session(schedule.timeline_type, schedule.engine)
+                sessions += 1
+            except ShutdownRequested:
+                log.info('%s session interrupted by shutdown', schedule.timeline_type)
+                break
+            except Exception as ex:
+                log.error('%s session failed: %s', schedule.timeline_type, ex, exc_info=True)
+            schedule.schedule_from(self.now() + schedule.interval)
+        log.info('daemon stopped after %s sessions', sessions)
+        return sessions
@@ -1,14 +1,20 @@
 import logging
 import sqlite3
-from contextlib import contextmanager
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from datetime import datetime
+from typing import Iterable
+from metrics import get_metrics
+from migrations import apply_migrations
 from models import RelationshipStatus, Account, map_account
 
 log = logging.getLogger(__name__)
 
 
 def create_tables():
-    with create_connection() as cursor:
+    with create_connection('create_tables') as cursor:
         log.info('creating tables if not exists')
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS ignore_account (
@@ -57,67 +63,206 @@ def create_tables():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS seen_status (
+                id TEXT PRIMARY KEY,
+                seen_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                last_updated DATETIME default current_timestamp
+            )
+        ''')
+        version = apply_migrations(cursor)
+        log.info('schema version: %s', version)
+
+
+DB_PATH = 'pixelfed.db'
+MMAP_SIZE = 64 * 1024 * 1024
+CACHED_STATEMENTS = 256
+BUSY_TIMEOUT = 30
+# optional callback handed every sqlite statement, on top of the query counter
+trace_callback = None
+
+_local = threading.local()
+# per account database for multi account runs, falls back to DB_PATH
+_db_path = ContextVar('db_path', default=None)
+
+
+def current_db_path() -> str:
+    return _db_path.get() or DB_PATH
 
 
 @contextmanager
-def create_connection():
-    conn = sqlite3.connect('pixelfed.db')
-    cursor = conn.cursor()
+def use_database(path: str):
+    '''route every dal call in the current context to the database at `path`'''
+    token = _db_path.set(path)
     try:
-        yield cursor
+        yield path
     finally:
-        conn.commit()
+        _db_path.reset(token)
+
+
+# transaction control and connection setup, not counted as queries
+_NOT_QUERIES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA')
+
+
+def is_query(statement: str) -> bool:
+    return not statement.lstrip().upper().startswith(_NOT_QUERIES)
+
+
+def _trace(statement: str):
+    if is_query(statement):
+        get_metrics().inc('pixelfed_db_queries_total')
+    if trace_callback is not None:
+        trace_callback(statement)
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the long lived connection to the current database for the current thread, opening it on first use.
+    Connections run in autocommit mode, transactions are opened explicitly by `transaction`.
+    """
+    path = current_db_path()
+    connections = _connections()
+    conn = connections.get(path)
+    if conn is not None:
+        return conn
+    log.info('opening database %s', path)
+    conn = sqlite3.connect(path, isolation_level=None, cached_statements=CACHED_STATEMENTS, timeout=BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.set_trace_callback(_trace)
+    connections[path] = conn
+    _local.depth[path] = 0
+    return conn
+
+
+def _connections() -> dict:
+    if not hasattr(_local, 'connections'):
+        _local.connections = {}
+        _local.depth = {}
+    return _local.connections
+
+
+def close_connection():
+    '''close every connection the current thread opened'''
+    connections = _connections()
+    for conn in connections.values():
         conn.close()
+    connections.clear()
+    _local.depth.clear()
+
+
+@contextmanager
+def transaction():
+    """
+    Unit of work: everything executed inside the block, including nested
+    `create_connection` calls, is committed once at the end or rolled back on error.
+    """
+    path = current_db_path()
+    conn = get_connection()
+    if _local.depth[path]:
+        _local.depth[path] += 1
+        try:
+            yield conn
+        finally:
+            _local.depth[path] -= 1
+        return
+    # take the write lock up front, a deferred read transaction that later writes
+    # fails with SQLITE_BUSY instead of waiting when another thread wrote in between
+    conn.execute('BEGIN IMMEDIATE')
+    _local.depth[path] = 1
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        _local.depth[path] = 0
+
+
+@contextmanager
+def create_connection(caller: str = 'other', write: bool = True):
+    """
+    Cursor for one dal call, timed under `caller`. Writes run as a unit of
+    work holding the write lock, reads run in autocommit (or inside the
+    caller's transaction) so they only take a WAL snapshot and never queue
+    behind other threads' writes.
+    """
+    with get_metrics().timed('pixelfed_db_transaction_seconds', caller=caller):
+        with transaction() if write else nullcontext(get_connection()) as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
 
 
 def count_todays_records() -> int:
-    """Count how many records were created in the following table today"""
-    with create_connection() as cursor:
+    """Count the accounts we followed over the last week, rows written by list syncs have no followed_at"""
+    with create_connection('count_todays_records', write=False) as cursor:
+        # compare followed_at itself, not DATE(followed_at), so idx_relationships_followed_at applies
         cursor.execute("""
             SELECT COUNT(*) FROM relationships r
-            WHERE r."following" = 1 AND
-            DATE(created_at) BETWEEN DATE('now', '-7 days') AND DATE('now')
+            WHERE followed_at >= DATE('now', '-7 days') AND followed_at < DATE('now', '+1 day')
         """)
         count = cursor.fetchone()[0]
-    log.info(f'today\'s follow count: {count}')
+    log.info('today\'s follow count: %s', count)
     return count
 
 
-def save_relationship(relationship: RelationshipStatus):
-    log.info(f'Saving relationship record {relationship.id}')
-    with create_connection() as cursor:
-        cursor.execute("SELECT id FROM account WHERE id = ?", (relationship.id,))
-        exists = cursor.fetchone()
-
-        if exists:
-            cursor.execute("""
-            UPDATE relationships SET
-                following = ?,
-                followed_by = ?,
-                blocking = ?,
-                muting = ?,
-                muting_notifications = ?,
-                requested = ?,
-                domain_blocking = ?,
-                showing_reblogs = ?,
-                endorsed = ?
-            WHERE id = ?
-            """, (
-                int(relationship.following),
-                int(relationship.followed_by),
-                int(relationship.blocking),
-                int(relationship.muting),
-                int(relationship.muting_notifications) or None,
-                int(relationship.requested),
-                int(relationship.domain_blocking) or None,
-                int(relationship.showing_reblogs) or None,
-                int(relationship.endorsed),
-                relationship.id
-            ))
-            log.info(f'Successfully updated relationship record {relationship.id}')
-        else:
-            log.info(f'Inserting new account {relationship.id}')
-            cursor.execute("""
+def _optional_int(value) -> int:
+    return None if value is None else int(value)
+
+
+def _upsert(cursor, table: str, sql: str, rows: list, chunk_size: int = 500) -> tuple:
+    """
+    run an executemany upsert and work out how many rows were new vs updated,
+    rows are keyed by their first value, which existing ids are looked up by
+    """
+    ids = [row[0] for row in rows]
+    updated = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        updated += cursor.fetchone()[0]
+    cursor.executemany(sql, rows)
+    return len(rows) - updated, updated
+
+
+def save_relationships(relationships: Iterable[RelationshipStatus]) -> tuple:
+    """
+    Insert or update many relationship records in a single transaction.
+    Args:
+        relationships: iterable of RelationshipStatus, the last record wins for duplicate ids
+    Returns:
+        (inserted, updated) counts
+    """
+    rows = {
+        r.id: (
+            r.id,
+            int(r.following),
+            int(r.followed_by),
+            int(r.blocking),
+            int(r.muting),
+            _optional_int(r.muting_notifications),
+            int(r.requested),
+            _optional_int(r.domain_blocking),
+            _optional_int(r.showing_reblogs),
+            int(r.endorsed)
+        ) for r in relationships
+    }
+    if not rows:
+        return 0, 0
+    with create_connection('save_relationships') as cursor:
+        inserted, updated = _upsert(cursor, 'relationships', """
             INSERT INTO relationships (
                 id,
                 following,
@@ -130,19 +275,29 @@ def save_relationship(relationship: RelationshipStatus):
                 showing_reblogs,
                 endorsed
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                relationship.id,
-                int(relationship.following),
-                int(relationship.followed_by),
-                int(relationship.blocking),
-                int(relationship.muting),
-                int(relationship.muting_notifications) or None,
-                int(relationship.requested),
-                int(relationship.domain_blocking) or None,
-                int(relationship.showing_reblogs) or None,
-                int(relationship.endorsed)
-            ))
-            log.info(f'Successfully inserted new relationship record {relationship.id}')        
+            ON CONFLICT (id) DO UPDATE SET
+                following = excluded.following,
+                followed_by = excluded.followed_by,
+                blocking = excluded.blocking,
+                muting = excluded.muting,
+                muting_notifications = excluded.muting_notifications,
+                requested = excluded.requested,
+                domain_blocking = excluded.domain_blocking,
+                showing_reblogs = excluded.showing_reblogs,
+                endorsed = excluded.endorsed
+            """, list(rows.values()))
+    log.info('Saved relationship records, inserted: %s updated: %s', inserted, updated)
+    return inserted, updated
+
+
+def save_relationship(relationship: RelationshipStatus):
+    log.info('Saving relationship record %s', relationship.id)
+    save_relationships([relationship])
+
+
+def mark_followed(id: str):
+    with create_connection('mark_followed') as cursor:
+        cursor.execute('UPDATE relationships SET followed_at = current_timestamp WHERE id = ?', (id,))
 
 
 def get_relationship_record(relationship_id: str) -> RelationshipStatus:
@@ -153,8 +308,8 @@ def get_relationship_record(relationship_id: str) -> RelationshipStatus:
     Returns:
         RelationshipStatus object if found, None if not found
     """
-    log.info(f'Retrieving relationship record {relationship_id}')
-    with create_connection() as cursor:
+    log.info('Retrieving relationship record %s', relationship_id)
+    with create_connection('get_relationship_record', write=False) as cursor:
         cursor.execute("""
         SELECT
             id, following, followed_by, blocking, muting,
@@ -167,130 +322,339 @@ def get_relationship_record(relationship_id: str) -> RelationshipStatus:
         if not row:
             return None
 
-        return RelationshipStatus(
-            id=row[0],
-            following=bool(row[1]),
-            followed_by=bool(row[2]),
-            blocking=bool(row[3]),
-            muting=bool(row[4]),
-            muting_notifications=bool(row[5]) if row[5] is not None else None,
-            requested=bool(row[6]),
-            domain_blocking=bool(row[7]) if row[7] is not None else None,
-            showing_reblogs=bool(row[8]) if row[8] is not None else None,
-            endorsed=bool(row[9])
-        )
+        return _map_relationship_row(row)
 
 
-def migrate():
-    log.info('migrating db to new versions')
-    with create_connection() as cursor:
-        log.info('inserting following to new account table')
-        cursor.execute('''
-            INSERT OR REPLACE INTO account
-            (id, username, acct, display_name, followers_count, following_count, created_at, last_updated)
-            SELECT id, username, acct, display_name, followers_count, following_count, created_at, last_updated
-            FROM FOLLOWING;
-        ''')
-        log.info(f'successfully inserted {cursor.rowcount} records')
-        log.info('inserting followers to new account table')
-        cursor.execute('''
-            INSERT OR REPLACE INTO account
-            (id, username, acct, display_name, followers_count, following_count, created_at, last_updated)
-            SELECT id, username, '', '', 0, 0, last_updated , last_updated FROM followers;
-        ''')
-        log.info(f'successfully inserted {cursor.rowcount} records')
-        log.info('inserting following to relationship table')
-        cursor.execute('''
-            INSERT OR REPLACE INTO relationships
-            (id, "following", followed_by, blocking, muting, muting_notifications, requested, domain_blocking, showing_reblogs, endorsed, created_at)
-            SELECT id, 1, 0, 0, 0, 0, 0, 0, 0, 0, last_updated FROM following f
-        ''')
-        log.info('inserting followers to relationship table')
-        cursor.execute('''
-            INSERT OR REPLACE INTO relationships
-            (id, "following", followed_by, blocking, muting, muting_notifications, requested, domain_blocking, showing_reblogs, endorsed, created_at)
-            SELECT id, 0, 1, 0, 0, 0, 0, 0, 0, 0, last_updated FROM followers f
-        ''')
-        log.info(f'successfully inserted {cursor.rowcount} records')
+def load_relationship_records() -> list:
+    ''' returns every stored relationship '''
+    with create_connection('load_relationship_records', write=False) as cursor:
+        cursor.execute("""
+        SELECT
+            id, following, followed_by, blocking, muting,
+            muting_notifications, requested, domain_blocking,
+            showing_reblogs, endorsed
+        FROM relationships
+        """)
+        return [_map_relationship_row(row) for row in cursor.fetchall()]
+
+
+def _map_relationship_row(row) -> RelationshipStatus:
+    return RelationshipStatus(
+        id=row[0],
+        following=bool(row[1]),
+        followed_by=bool(row[2]),
+        blocking=bool(row[3]),
+        muting=bool(row[4]),
+        muting_notifications=bool(row[5]) if row[5] is not None else None,
+        requested=bool(row[6]),
+        domain_blocking=bool(row[7]) if row[7] is not None else None,
+        showing_reblogs=bool(row[8]) if row[8] is not None else None,
+        endorsed=bool(row[9])
+    )
 
 
 def ignore_user(id: str) -> bool:
     log.info('checking if user id is in ignore table')
-    with create_connection() as cursor:
+    with create_connection('ignore_user', write=False) as cursor:
         cursor.execute("""
             select id from ignore_account where id = ?
             """, (id,))
-        result = cursor.rowcount > 0
-        log.info(f'user found: {result}')
+        result = cursor.fetchone() is not None
+        log.info('user found: %s', result)
         return result
 
 
+def load_ignored_ids() -> list:
+    with create_connection('load_ignored_ids', write=False) as cursor:
+        cursor.execute('SELECT id FROM ignore_account')
+        return [row[0] for row in cursor.fetchall()]
+
+
 def add_to_ignore(id: str):
-    with create_connection() as cursor:
+    with create_connection('add_to_ignore') as cursor:
         cursor.execute("""
             INSERT INTO ignore_account ( id ) VALUES (?)
             """, (id,))
-        log.info(f'added {id} to ignore_account successfully!')
+        log.info('added %s to ignore_account successfully!', id)
 
 
-def save_following(json_data: dict):
-    log.info('saving account')
-    account = map_account(json_data)
-    with create_connection() as cursor:
-        cursor.execute("SELECT id FROM account WHERE id = ?", (account.id,))
-        exists = cursor.fetchone()
-
-        if exists:
-            cursor.execute("""
-            UPDATE account SET
-                username = ?,
-                acct = ?,
-                display_name = ?,
-                followers_count = ?,
-                following_count = ?,
-                statuses_count = ?,
-                last_updated = ?
-            WHERE id = ?
-            """, (
-                account.username,
-                account.acct,
-                account.display_name,
-                account.followers_count,
-                account.following_count,
-                account.statuses_count,
-                account.last_updated,
-                account.id
-            ))
-            log.info(f'Updated {account.id}|{account.username} successfully!')
-        else:
-            cursor.execute("""
+def save_accounts(accounts: Iterable[Account]) -> tuple:
+    """
+    Insert or update many accounts in a single transaction.
+    Args:
+        accounts: iterable of Account, the last record wins for duplicate ids
+    Returns:
+        (inserted, updated) counts
+    """
+    rows = {
+        a.id: (
+            a.id,
+            a.username,
+            a.acct,
+            a.display_name,
+            a.followers_count,
+            a.following_count,
+            a.statuses_count,
+            a.created_at,
+            a.last_updated
+        ) for a in accounts
+    }
+    if not rows:
+        return 0, 0
+    with create_connection('save_accounts') as cursor:
+        inserted, updated = _upsert(cursor, 'account', """
             INSERT INTO account (
                 id, username, acct, display_name,
                 followers_count, following_count, statuses_count,
                 created_at, last_updated
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                account.id,
-                account.username,
-                account.acct,
-                account.display_name,
-                account.followers_count,
-                account.following_count,
-                account.statuses_count,
-                account.created_at,
-                account.last_updated
-            ))
-            log.info(f'Inserted {account.id}|{account.username} successfully!')
+            ON CONFLICT (id) DO UPDATE SET
+                username = excluded.username,
+                acct = excluded.acct,
+                display_name = excluded.display_name,
+                followers_count = excluded.followers_count,
+                following_count = excluded.following_count,
+                statuses_count = excluded.statuses_count,
+                last_updated = excluded.last_updated
+            """, list(rows.values()))
+    log.info('Saved accounts, inserted: %s updated: %s', inserted, updated)
+    return inserted, updated
+
+
+def load_accounts(ids: Iterable[str], chunk_size: int = 500) -> dict:
+    """
+    Look up many accounts at once.
+    Returns:
+        dict of account id to Account for the ids that are stored
+    """
+    ids = list(dict.fromkeys(ids))
+    accounts = {}
+    with create_connection('load_accounts', write=False) as cursor:
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            cursor.execute(f"""
+                SELECT id, username, acct, display_name, followers_count, following_count,
+                    statuses_count, created_at, last_updated
+                FROM account WHERE id IN ({', '.join('?' * len(chunk))})
+                """, chunk)
+            for row in cursor.fetchall():
+                accounts[row[0]] = Account(
+                    id=row[0],
+                    username=row[1],
+                    acct=row[2],
+                    display_name=row[3],
+                    followers_count=row[4],
+                    following_count=row[5],
+                    statuses_count=row[6],
+                    created_at=_parse_datetime(row[7]),
+                    last_updated=_parse_datetime(row[8])
+                )
+    return accounts
+
+
+def _parse_datetime(value) -> datetime:
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def save_following(json_data: dict):
+    log.info('saving account')
+    save_accounts([map_account(json_data)])
+
+
+def load_follower_weights() -> list:
+    ''' returns (id, username, followed at epoch, last interacted epoch or None) for sampling '''
+    with create_connection('load_follower_weights', write=False) as cursor:
+        cursor.execute('''
+            SELECT r.id, a.username, CAST(strftime('%s', r.created_at) AS REAL), r.last_interacted_at
+            FROM relationships r
+                JOIN account a ON a.id = r.id
+            WHERE r.followed_by = 1
+            AND NOT EXISTS (SELECT 1 FROM ignore_account i WHERE i.id = r.id);
+        ''')
+        return cursor.fetchall()
+
+
+def record_interaction(id: str, at: float):
+    with create_connection('record_interaction') as cursor:
+        cursor.execute('UPDATE relationships SET last_interacted_at = ? WHERE id = ?', (at, id))
 
 
 def load_followers() -> list:
     ''' returns list of follower ids '''
-    with create_connection() as cursor:
+    with create_connection('load_followers', write=False) as cursor:
         cursor.execute('''
             SELECT r.id, a.username FROM relationships r
                 JOIN account a ON a.id = r.id
-            WHERE followed_by = 1
-            AND a.id NOT IN (select id from ignore_account);
+            WHERE r.followed_by = 1
+            AND NOT EXISTS (SELECT 1 FROM ignore_account i WHERE i.id = r.id);
         ''')
         data = cursor.fetchall()
         return [id for id in data]
+
+
+def mark_relationships(ids: Iterable[str], column: str) -> tuple:
+    """
+    Flag accounts as followed by us or following us, creating relationship rows as needed.
+    Args:
+        ids: account ids
+        column: 'following' or 'followed_by'
+    Returns:
+        (inserted, updated) counts
+    """
+    if column not in ('following', 'followed_by'):
+        raise ValueError(f'unknown relationship column {column}')
+    following, followed_by = (1, 0) if column == 'following' else (0, 1)
+    rows = [(id, following, followed_by) for id in dict.fromkeys(ids)]
+    if not rows:
+        return 0, 0
+    with create_connection('mark_relationships') as cursor:
+        return _upsert(cursor, 'relationships', f"""
+            INSERT INTO relationships (
+                id, following, followed_by, blocking, muting, requested, endorsed
+            ) VALUES (?, ?, ?, 0, 0, 0, 0)
+            ON CONFLICT (id) DO UPDATE SET {column} = 1
+            """, rows)
+
+
+def record_sync_seen(kind: str, ids: Iterable[str]):
+    ''' remember the accounts a followers or following sync has listed so far, across resumes '''
+    with create_connection('record_sync_seen') as cursor:
+        cursor.executemany('INSERT OR IGNORE INTO sync_seen (kind, id) VALUES (?, ?)', [(kind, id) for id in dict.fromkeys(ids)])
+
+
+def clear_sync_seen(kind: str):
+    with create_connection('clear_sync_seen') as cursor:
+        cursor.execute('DELETE FROM sync_seen WHERE kind = ?', (kind,))
+
+
+def unmark_unseen_relationships(kind: str, column: str) -> int:
+    """
+    After a complete sync, clear the flag on accounts the list no longer has.
+    Args:
+        kind: 'followers' or 'following', the list synced
+        column: 'following' or 'followed_by'
+    Returns:
+        number of accounts unmarked
+    """
+    if column not in ('following', 'followed_by'):
+        raise ValueError(f'unknown relationship column {column}')
+    with create_connection('unmark_unseen_relationships') as cursor:
+        cursor.execute(f"""
+            UPDATE relationships SET {column} = 0
+            WHERE {column} = 1 AND id NOT IN (SELECT id FROM sync_seen WHERE kind = ?)
+            """, (kind,))
+        return cursor.rowcount
+
+
+def get_sync_state(key: str) -> str:
+    with create_connection('get_sync_state', write=False) as cursor:
+        cursor.execute('SELECT value FROM sync_state WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def save_sync_state(key: str, value: str):
+    with create_connection('save_sync_state') as cursor:
+        cursor.execute("""
+            INSERT INTO sync_state (key, value, last_updated) VALUES (?, ?, current_timestamp)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, last_updated = excluded.last_updated
+            """, (key, value))
+
+
+def clear_sync_state(key: str):
+    with create_connection('clear_sync_state') as cursor:
+        cursor.execute('DELETE FROM sync_state WHERE key = ?', (key,))
+
+
+def find_seen_status(ids: list) -> set:
+    ''' returns the subset of ids recorded in seen_status '''
+    with create_connection('find_seen_status', write=False) as cursor:
+        cursor.execute(f"SELECT id FROM seen_status WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def save_seen_status(ids: list):
+    seen_at = time.time()
+    with create_connection('save_seen_status') as cursor:
+        cursor.executemany("""
+            INSERT INTO seen_status (id, seen_at) VALUES (?, ?)
+            ON CONFLICT (id) DO UPDATE SET seen_at = excluded.seen_at
+            """, [(id, seen_at) for id in ids])
+
+
+def prune_seen_status(before: float) -> int:
+    with create_connection('prune_seen_status') as cursor:
+        cursor.execute('DELETE FROM seen_status WHERE seen_at < ?', (before,))
+        log.info('pruned %s seen statuses', cursor.rowcount)
+        return cursor.rowcount
+
+
+def bump_daily_stat(metric: str, dimension: str = '', count: int = 1):
+    ''' add to today's (UTC, like the relationship triggers) counter in daily_stats '''
+    with create_connection('bump_daily_stat') as cursor:
+        cursor.execute("""
+            INSERT INTO daily_stats (day, metric, dimension, count) VALUES (date('now'), ?, ?, ?)
+            ON CONFLICT (day, metric, dimension) DO UPDATE SET count = count + excluded.count
+            """, (metric, dimension, count))
+
+
+def load_daily_stats(since: str, until: str) -> list:
+    ''' returns (day, metric, dimension, count) rows for days in [since, until], read off the primary key '''
+    with create_connection('load_daily_stats', write=False) as cursor:
+        cursor.execute("""
+            SELECT day, metric, dimension, count FROM daily_stats
+            WHERE day >= ? AND day <= ?
+            ORDER BY day
+            """, (since, until))
+        return cursor.fetchall()
+
+
+def sum_daily_stats(before: str) -> dict:
+    ''' returns metric totals over every day before `before`, e.g. the follower count a report starts from '''
+    with create_connection('sum_daily_stats', write=False) as cursor:
+        cursor.execute('SELECT metric, SUM(count) FROM daily_stats WHERE day < ? GROUP BY metric', (before,))
+        return dict(cursor.fetchall())
+
+
+def load_unbucketed_follows() -> list:
+    ''' returns (id, followers_count, following_count, followed_by) of followed accounts not yet counted in follow_outcomes '''
+    with create_connection('load_unbucketed_follows', write=False) as cursor:
+        cursor.execute('''
+            SELECT r.id, a.followers_count, a.following_count, r.followed_by FROM relationships r
+                JOIN account a ON a.id = r.id
+            WHERE r.following = 1 AND r.score_bucket IS NULL
+        ''')
+        return cursor.fetchall()
+
+
+def record_follows(rows: Iterable[tuple]):
+    '''
+    Count follows in follow_outcomes, rows are (id, bucket). Each account is
+    counted once, in the bucket it had when first counted, and credited with
+    a follow back right away if it already follows us.
+    '''
+    with create_connection('record_follows') as cursor:
+        for id, bucket in rows:
+            cursor.execute('SELECT followed_by FROM relationships WHERE id = ? AND score_bucket IS NULL', (id,))
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            cursor.execute('UPDATE relationships SET score_bucket = ? WHERE id = ?', (bucket, id))
+            cursor.execute('''
+                INSERT INTO follow_outcomes (bucket, follows, follow_backs) VALUES (?, 1, ?)
+                ON CONFLICT (bucket) DO UPDATE SET
+                    follows = follows + 1,
+                    follow_backs = follow_backs + excluded.follow_backs
+            ''', (bucket, row[0]))
+
+
+def load_follow_outcomes() -> dict:
+    ''' returns bucket to (follows, follow_backs) '''
+    with create_connection('load_follow_outcomes', write=False) as cursor:
+        cursor.execute('SELECT bucket, follows, follow_backs FROM follow_outcomes')
+        return {bucket: (follows, follow_backs) for bucket, follows, follow_backs in cursor.fetchall()}
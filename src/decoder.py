@@ -0,0 +1,133 @@
+import codecs
+import json
+import logging
+from typing import Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+# the only fields the session logic reads, everything else in a payload is dropped right after parsing
+ACCOUNT_FIELDS = ('id', 'username', 'acct', 'display_name', 'followers_count', 'following_count', 'statuses_count')
+STATUS_FIELDS = ('id', 'favourited')
+NOTIFICATION_FIELDS = ('id', 'type')
+WHITESPACE = ' \t\r\n'
+
+_raw_decode = json.JSONDecoder().raw_decode
+
+
+def loads(data: bytes):
+    '''orjson when it is installed, the stdlib otherwise'''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _pick(item: dict, fields: tuple) -> dict:
+    return {field: item[field] for field in fields if field in item}
+
+
+def compact_account(account: dict) -> dict:
+    return _pick(account, ACCOUNT_FIELDS)
+
+
+def compact_status(status: dict) -> dict:
+    compact = _pick(status, STATUS_FIELDS)
+    if isinstance(status.get('account'), dict):
+        compact['account'] = compact_account(status['account'])
+    return compact
+
+
+def compact_notification(notification: dict) -> dict:
+    compact = _pick(notification, NOTIFICATION_FIELDS)
+    if isinstance(notification.get('account'), dict):
+        compact['account'] = compact_account(notification['account'])
+    if isinstance(notification.get('status'), dict):
+        compact['status'] = compact_status(notification['status'])
+    return compact
+
+
+# how to trim a payload by timeline type, statuses unless listed, None keeps the payload as is
+COMPACTORS = {
+    'notifications': compact_notification,
+    'account': compact_account,
+    'followers': compact_account,
+    'following': compact_account,
+    'relationship': None,
+    'relationships': None,
+}
+
+
+def compact(payload, kind: str = 'statuses'):
+    '''trim a decoded list (or single object) down to the fields used for `kind`'''
+    compactor = COMPACTORS.get(kind, compact_status)
+    if compactor is None:
+        return payload
+    if isinstance(payload, list):
+        return [compactor(item) if isinstance(item, dict) else item for item in payload]
+    if isinstance(payload, dict) and kind in COMPACTORS:
+        return compactor(payload)
+    return payload
+
+
+def decode(response, kind: str = 'statuses'):
+    '''parse the response body and trim it, in place of response.json()'''
+    return compact(loads(response.content), kind)
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator:
+    '''
+    Yield the elements of a top level json array while its bytes arrive, so
+    only one element is decoded and held at a time. Anything that is not an
+    array (an error body) yields nothing. The stdlib decoder does the work,
+    orjson has no incremental mode.
+    '''
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, pos, started, done = '', 0, False, False
+    while True:
+        while pos < len(buffer) and (buffer[pos] in WHITESPACE or (started and buffer[pos] == ',')):
+            pos += 1
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != '[':
+                    log.info('response body is not a json array, nothing to stream')
+                    return
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = _raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if done:
+                    raise
+            else:
+                # a number cut off by the chunk boundary (12|34, 1.|5) decodes early, wait for its delimiter
+                number = isinstance(item, (int, float)) and not isinstance(item, bool)
+                if done or not number or (end < len(buffer) and buffer[end] in WHITESPACE + ',]'):
+                    yield item
+                    pos = end
+                    continue
+        elif done:
+            if started:
+                raise ValueError('json array ended before its closing bracket')
+            return
+        chunk = next(chunks, None)
+        if chunk is None:
+            done = True
+            buffer = buffer[pos:] + text.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + text.decode(chunk)
+        pos = 0
+
+
+def iter_items(response, kind: str = 'statuses', chunk_size: int = 16 * 1024) -> Iterator:
+    '''stream the trimmed items of a json array response opened with stream=True'''
+    compactor = COMPACTORS.get(kind, compact_status)
+    for item in iter_json_array(response.iter_content(chunk_size)):
+        yield compactor(item) if compactor is not None and isinstance(item, dict) else item
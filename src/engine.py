@@ -0,0 +1,29 @@
+import logging
+from typing import Callable, Iterable
+
+log = logging.getLogger(__name__)
+
+# asyncio is imported inside the functions, the sync engine and cli paths never load it
+
+
+async def gather_bounded(func: Callable, items: Iterable, limit: int) -> list:
+    '''
+    Run blocking `func(item)` for every item on worker threads with at most
+    `limit` calls in flight. Results come back in the order of `items`.
+    '''
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await asyncio.to_thread(func, item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+def run_bounded(func: Callable, items: Iterable, limit: int) -> list:
+    '''sync entry point for gather_bounded'''
+    import asyncio
+
+    return asyncio.run(gather_bounded(func, items, limit))
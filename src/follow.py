@@ -1,83 +1,228 @@
 import logging
-import random
+from datetime import datetime, timedelta
 
-from config import Settings
+from cache import get_relationship_cache
+from config import PixelFedBotException, Settings
 from dal import (
     add_to_ignore,
+    bump_daily_stat,
+    clear_sync_seen,
+    clear_sync_state,
     count_todays_records,
-    ignore_user,
     get_relationship_record,
-    load_followers,
-    save_following,
-    save_relationship
+    get_sync_state,
+    load_accounts,
+    mark_followed,
+    mark_relationships,
+    record_sync_seen,
+    save_accounts,
+    save_relationship,
+    save_relationships,
+    save_sync_state,
+    transaction,
+    unmark_unseen_relationships
 )
-from models import RelationshipStatus, Account, map_account
-from timelines import get_timeline_url, get_timeline, post_timeline
-from utils import random_time
+from engine import run_bounded
+from metrics import get_metrics
+from models import RelationshipStatus, Account, map_account, map_relationship
+from sampling import get_follower_sampler
+from scoring import get_follow_scorer
+from timelines import get_timeline_url, get_timeline, paginate, post_timeline
 
 
 log = logging.getLogger(__name__)
 
 
-def get_random_followers() -> list:
+def get_random_followers(settings: Settings, k: int = 10) -> list:
     log.info('getting random follower list. ')
-    followers = load_followers()
-    log.info(f'follower count {len(followers)}')
-    random.shuffle(followers)
-    return followers[:10]
+    followers = get_follower_sampler(settings).sample(k)
+    log.info('sampled %s followers', len(followers))
+    return followers
 
 
-def get_account_details(id: str, settings: Settings):
+def is_account_fresh(account: Account, settings: Settings) -> bool:
+    if account.last_updated is None or account.followers_count is None or account.following_count is None:
+        return False
+    return datetime.now() - account.last_updated < timedelta(seconds=settings.account_max_age)
+
+
+def fetch_account_details(id: str, settings: Settings, pace: bool = True) -> Account:
     url_args = get_timeline_url('account', settings, id)
-    account_response = get_timeline(url_args[0], settings, url_args[1])
-    account = map_account(account_response)
+    account_response = get_timeline(url_args[0], settings, url_args[1], pace=pace)
+    if not account_response:
+        return None
+    return map_account(account_response)
+
+
+def get_account_details(id: str, settings: Settings):
+    ''' read through the account table, only stats older than account_max_age hit the api '''
+    account = load_accounts([id]).get(id)
+    if account and is_account_fresh(account, settings):
+        log.info('using stored account stats for %s, updated %s', id, account.last_updated)
+        return account
+    account = fetch_account_details(id, settings)
+    if account:
+        save_accounts([account])
     return account
 
 
+def prefetch_accounts(ids: list, settings: Settings, pace: bool = True) -> dict:
+    '''
+    Make sure fresh stats exist for all ids: one query for the stored ones,
+    concurrent fetches for the missing or stale ones, saved in one transaction.
+    '''
+    accounts = {id: a for id, a in load_accounts(ids).items() if is_account_fresh(a, settings)}
+    missing = [id for id in dict.fromkeys(ids) if id not in accounts]
+    log.info('prefetching accounts, %s fresh in db, fetching %s', len(accounts), len(missing))
+    fetched = [a for a in run_bounded(lambda id: fetch_account_details(id, settings, pace), missing, settings.concurrency) if a]
+    save_accounts(fetched)
+    accounts.update((a.id, a) for a in fetched)
+    return accounts
+
+
 def unfollow_user(id: str, settings: Settings):
     url_args = get_timeline_url('unfollow', settings, id)
-    log.info(f'unfollowing user id: {id}')
+    log.info('unfollowing user id: %s', id)
     response = post_timeline(url_args[0], settings, url_args[1])
-    log.info(f'response.status_code: {response.status_code}')
+    log.info('response.status_code: %s', response.status_code)
     if response.status_code == 200:
-        relationship = RelationshipStatus(**response.json())
+        relationship = map_relationship(response.json())
         log.info('unfollowed successfully')
-        add_to_ignore(relationship.id)
-        save_relationship(relationship)
+        with transaction():
+            add_to_ignore(relationship.id)
+            save_relationship(relationship)
+        relationships = get_relationship_cache(settings)
+        relationships.ignore(relationship.id)
+        relationships.put(relationship)
+
+
+def check_follow_counts(followers_count: int, following_count: int, settings: Settings) -> bool:
+    ''' the follower/following count rules an account has to pass before we follow it '''
+    log.info('Follower count: %s Following count: %s', followers_count, following_count)
+    if followers_count is None or following_count is None:
+        log.info('account counts unknown, skipping.')
+        return False
+    if followers_count < settings.follower_count_min:
+        log.info('followers_count: %s below %s, skipping.', followers_count, settings.follower_count_min)
+        return False
+    if following_count < settings.following_count_min or following_count > settings.following_count_max:
+        log.info('following_count: %s outside %s-%s, skipping.', following_count,
+                 settings.following_count_min, settings.following_count_max)
+        return False
+    return True
+
+
+def find_embedded_account(id: str, payload) -> dict:
+    '''
+    The account object a status, notification or account payload (or a list
+    of them) already carries for `id`, if it has both counts. None otherwise.
+    '''
+    items = payload if isinstance(payload, list) else [payload]
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        for account in (item.get('account'), item):
+            if (isinstance(account, dict) and str(account.get('id')) == str(id)
+                    and account.get('followers_count') is not None and account.get('following_count') is not None):
+                return account
+    return None
+
+
+def is_follow_candidate(id: str, settings: Settings, payload=None) -> bool:
+    '''
+    Zero request prefilter: the ignore list, then the count rules on the
+    account embedded in `payload`. An account the payload does not carry
+    passes, the network checks in follow_user decide on it.
+    '''
+    return prefilter(id, settings, payload) in ('passed', 'unknown')
+
+
+def prefilter(id: str, settings: Settings, payload=None) -> str:
+    ''' 'ignored', 'counts' (rejected on the embedded counts), 'passed' or 'unknown' (not embedded) '''
+    if get_relationship_cache(settings).is_ignored(id):
+        log.info('Account id %s found in ignore table, keep calm and carry on...', id)
+        return 'ignored'
+    account = find_embedded_account(id, payload)
+    if account is None:
+        return 'unknown'
+    return 'passed' if check_follow_counts(account['followers_count'], account['following_count'], settings) else 'counts'
+
+
+def follow_candidates(ids: list, settings: Settings, payload=None) -> list:
+    ''' the ids worth a relationships request, `payload` is the timeline or notifications page they came from '''
+    result = []
+    for id in dict.fromkeys(ids):
+        outcome = prefilter(id, settings, payload)
+        get_metrics().inc('pixelfed_follow_prefilter_total', result=outcome)
+        if outcome in ('passed', 'unknown'):
+            result.append(id)
+    log.info('%s of %s follow candidates passed the prefilter', len(result), len(dict.fromkeys(ids)))
+    return result
+
+
+def embedded_account_details(id: str, payload) -> Account:
+    account = find_embedded_account(id, payload)
+    if account is None:
+        return None
+    try:
+        return map_account(account)
+    except PixelFedBotException:
+        return None
 
 
 def follow_user(id: str, settings: Settings, server_response):
+    if not is_follow_candidate(id, settings, server_response):
+        return
     relationship = get_relationship(settings, id)
     if relationship.following:
         log.info('already following user..')
         return
-    if ignore_user(id):
-        log.info('Account id found in ignore table, keep calm and carry on...')
+    # counts embedded in the statuses are as fresh as an accounts/{id} fetch
+    account = embedded_account_details(id, server_response) or get_account_details(id, settings)
+    if account is None:
+        log.info('no account details for %s, skipping.', id)
         return
-    account = get_account_details(id, settings)
-    # TODO save account and check here
-    # TODO move check logic to function
-    log.info(f'Follower count: {account.followers_count} Following count: {account.following_count}')
-    log.info(f'settings.follower_count_min: {settings.follower_count_min} settings.following_count_max: {settings.following_count_max}')
-    if account.followers_count < settings.follower_count_min:
-        log.info(f'account.followers_count: {account.followers_count} too low, skipping.')
-        return
-    if account.following_count < 10 or account.following_count > settings.following_count_max:
-        log.info(f'account.following_count: {account.following_count} too high, skipping.')
+    if not check_follow_counts(account.followers_count, account.following_count, settings):
         return
     url_args = get_timeline_url('follow', settings, id)
-    log.info(f'following user id: {id}')
+    log.info('following user id: %s', id)
     response = post_timeline(url_args[0], settings, url_args[1])
-    log.info(f'response.status_code: {response.status_code}')
+    log.info('response.status_code: %s', response.status_code)
     if response.status_code == 200:
         log.info('posted successfully')
-        save_following(server_response[0]['account'])
+        relationship = map_relationship(response.json())
+        with transaction():
+            save_accounts([account])
+            save_relationship(relationship)
+            # followed_at counts the follow in count_todays_records and marks a later follow back as ours
+            mark_followed(id)
+            bump_daily_stat('follows')
+            get_follow_scorer(settings).record_follow(id, account.followers_count, account.following_count)
+        get_relationship_cache(settings).put(relationship)
     return response
 
 
+def follow_top_candidates(settings: Settings, limit: int = 1) -> int:
+    '''
+    Spend up to `limit` follows of the daily budget on the best scored
+    candidates offered so far, from any timeline. Returns the follows made.
+    '''
+    followed = 0
+    for candidate in get_follow_scorer(settings).take(min(limit, remaining_follows(settings))):
+        log.info('following candidate %s from %s', candidate.id, candidate.source)
+        response = follow_user(candidate.id, settings, [candidate.account])
+        if response is not None and response.status_code == 200:
+            followed += 1
+    return followed
+
+
+def remaining_follows(settings: Settings) -> int:
+    return max(settings.follows_per_day - count_todays_records(), 0)
+
+
 def check_follow_count(settings: Settings) -> bool:
     todays_follow_count = count_todays_records()
-    log.info(f'follow users? {settings.follows_per_day > todays_follow_count}')
+    log.info('follow users? %s', settings.follows_per_day > todays_follow_count)
     return settings.follows_per_day > todays_follow_count
 
 
@@ -101,27 +246,101 @@ def check_follow_count(settings: Settings) -> bool:
 
 
 def get_relationship(settings: Settings, id: str):
-    relationship = get_relationship_record(id)
-    if relationship:
-        return relationship
+    relationships = get_relationship_cache(settings)
+    relationship, fresh = relationships.get(id)
+    if relationship is None:
+        relationship = get_relationship_record(id)
+        if relationship is None:
+            return fetch_relationship(settings, id)
+        relationships.put(relationship, stale=True)
+        fresh = False
+    if not fresh:
+        log.info('relationship %s is stale, revalidating in background', id)
+        relationships.revalidate(id, lambda: fetch_relationship(settings, id))
+    return relationship
+
+
+def fetch_relationship(settings: Settings, id: str) -> RelationshipStatus:
     url_args = get_timeline_url('relationships', settings, id)
-    random_time()
     server_response = get_timeline(url=url_args[0], settings=settings, timeline_type='relationship')
     # log.info(f'getting server response from id: {server_response}')
-    relationship = RelationshipStatus(**server_response[0])
+    relationship = map_relationship(server_response[0])
     save_relationship(relationship)
+    get_relationship_cache(settings).put(relationship)
     return relationship
 
 
-def get_follower_list(settings: Settings):
-    url_args = get_timeline_url('followers', settings)
-    server_response = get_timeline(url=url_args[0], settings=settings)
-    log.info(f'Getting current follower count: {len(server_response)}')
-    # save_followers(server_response)
+def resolve_relationships(ids: list, settings: Settings, pace: bool = True) -> dict:
+    '''
+    Resolve relationships for a batch of candidates: fresh cache entries are
+    used as is, the rest are fetched with multi id requests of
+    relationship_chunk_size and saved in one transaction.
+    Returns:
+        dict of account id to RelationshipStatus
+    '''
+    relationships = get_relationship_cache(settings)
+    resolved = {}
+    pending = []
+    for id in dict.fromkeys(ids):
+        relationship, fresh = relationships.get(id)
+        if fresh:
+            resolved[id] = relationship
+        else:
+            pending.append(id)
+    log.info('resolving relationships, %s cached, fetching %s', len(resolved), len(pending))
+    fetched = []
+    for start in range(0, len(pending), settings.relationship_chunk_size):
+        url_args = get_timeline_url('relationships', settings, pending[start:start + settings.relationship_chunk_size])
+        server_response = get_timeline(url=url_args[0], settings=settings, timeline_type='relationship', pace=pace)
+        fetched.extend(map_relationship(r) for r in server_response or [])
+    save_relationships(fetched)
+    for relationship in fetched:
+        relationships.put(relationship)
+        resolved[relationship.id] = relationship
+    return resolved
+
+
+def sync_relationship_list(settings: Settings, timeline_type: str) -> int:
+    """
+    Stream every page of our followers or following list into the db.
+    The next page cursor is saved with each page so an interrupted sync resumes there.
+    Once the last page is in, accounts the list no longer has are unmarked.
+    """
+    key = f'sync:{timeline_type}'
+    max_id = get_sync_state(key)
+    if max_id:
+        log.info('resuming %s sync from max_id: %s', timeline_type, max_id)
+    else:
+        clear_sync_seen(timeline_type)
+    column = 'followed_by' if timeline_type == 'followers' else 'following'
+    url_args = get_timeline_url(timeline_type, settings)
+    total = 0
+    for page, next_max_id in paginate(url_args[0], settings, max_id=max_id, limit=settings.page_limit, kind=timeline_type):
+        with transaction():
+            save_accounts(map(map_account, page))
+            mark_relationships((account['id'] for account in page), column)
+            record_sync_seen(timeline_type, (account['id'] for account in page))
+            if next_max_id:
+                save_sync_state(key, next_max_id)
+        total += len(page)
+        log.info('synced %s %s accounts', total, timeline_type)
+    with transaction():
+        unmarked = unmark_unseen_relationships(timeline_type, column)
+        clear_sync_seen(timeline_type)
+        clear_sync_state(key)
+        # from now on followers appearing in syncs or lookups count as gained in daily_stats
+        save_sync_state(f'synced:{timeline_type}', datetime.now().isoformat())
+    log.info('unmarked %s accounts no longer in %s', unmarked, timeline_type)
+    return total
+
+
+def get_follower_list(settings: Settings) -> int:
+    count = sync_relationship_list(settings, 'followers')
+    log.info('Getting current follower count: %s', count)
+    return count
 
 
-def get_following_list(settings: Settings):
-    url_args = get_timeline_url('following', settings)
-    server_response = get_timeline(url=url_args[0], settings=settings)
-    log.info(f'Getting current following count: {len(server_response)}')
-    save_following(server_response)
+def get_following_list(settings: Settings) -> int:
+    count = sync_relationship_list(settings, 'following')
+    log.info('Getting current following count: %s', count)
+    return count
@@ -0,0 +1,168 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from config import Settings, active_settings
+
+TEXT_FORMAT = '%(asctime)s | %(levelname)s | %(filename)s:%(lineno)d | %(message)s'
+
+session_id = ContextVar('session_id', default=None)
+action_id = ContextVar('action_id', default=None)
+action_name = ContextVar('action_name', default=None)
+
+_listener = None
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def session_scope(timeline_type: str):
+    '''tag every record logged inside a session with its id'''
+    token = session_id.set(f'{timeline_type}-{new_id()}')
+    try:
+        yield session_id.get()
+    finally:
+        session_id.reset(token)
+
+
+@contextmanager
+def action_scope(name: str):
+    '''tag every record logged inside one bot action (a fetch, a like, a follow) with its id'''
+    id_token = action_id.set(new_id())
+    name_token = action_name.set(name)
+    try:
+        yield
+    finally:
+        action_name.reset(name_token)
+        action_id.reset(id_token)
+
+
+class ContextFilter(logging.Filter):
+    '''copies the account name, session and action ids onto the record, in the thread that logged it'''
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        account = active_settings()
+        record.account = account.name if account else None
+        record.session = session_id.get()
+        record.action = action_id.get()
+        record.action_name = action_name.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Keeps only a fraction of the INFO and DEBUG records of chatty loggers,
+    e.g. {'dal': 0.1}. Warnings and errors always pass.
+    '''
+
+    def __init__(self, rates: dict, rand=random.random):
+        super().__init__()
+        self.rates = rates
+        self.rand = rand
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name.split('.', 1)[0])
+        return rate is None or self.rand() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    '''one json object per line'''
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'location': f'{record.filename}:{record.lineno}',
+            'thread': record.threadName,
+            'account': getattr(record, 'account', None),
+            'session': getattr(record, 'session', None),
+            'action': getattr(record, 'action', None),
+            'action_name': getattr(record, 'action_name', None),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _queue_handler(records: queue.SimpleQueue) -> logging.Handler:
+    from logging.handlers import QueueHandler
+
+    class DeferredQueueHandler(QueueHandler):
+        '''
+        Enqueues a copy of the record as logged. The stdlib prepare() formats
+        the message and traceback in the calling thread, this leaves both to
+        the listener's handlers, so JsonFormatter still sees exc_info.
+        '''
+
+        def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+            return copy.copy(record)
+
+    return DeferredQueueHandler(records)
+
+
+def configure_logging(settings: Settings, stream: bool = True):
+    '''
+    Route all logging through a QueueHandler, so the request path only
+    enqueues records and a background listener does the formatting and file
+    I/O. settings.log_format picks text or json lines. The listener is
+    stopped at exit, so records queued before a sys.exit still reach the file.
+    '''
+    global _listener
+    from logging.handlers import QueueListener, RotatingFileHandler
+
+    stop_logging()
+    formatter = JsonFormatter() if settings.log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()] if stream else []
+    if settings.app_log:
+        handlers.append(RotatingFileHandler(settings.app_log, mode='a', maxBytes=5 * 1024 * 1024, backupCount=5))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    filters = [ContextFilter()]
+    if settings.log_sampling:
+        filters.append(SamplingFilter(settings.log_sampling))
+    if settings.log_queue:
+        front = [_queue_handler(queue.SimpleQueue())]
+        _listener = QueueListener(front[0].queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # the listener thread is a daemon, without this queued records are lost on exit
+        atexit.unregister(stop_logging)
+        atexit.register(stop_logging)
+    else:
+        front = handlers
+    for handler in front:
+        for f in filters:
+            handler.addFilter(f)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    for handler in front:
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    for name, level in settings.log_levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def stop_logging():
+    '''drain the queue and stop the listener thread'''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
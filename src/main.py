@@ -1,59 +1,121 @@
 import argparse
 import random
-import requests
 import logging as log
-from logging.handlers import RotatingFileHandler
 import sys
-
-from config import Settings, PixelFedBotException
-from dal import create_tables, migrate
+from datetime import datetime
+from typing import Callable, Iterable
+
+import client
+from cache import get_relationship_cache
+from config import Settings, SettingsProxy, PixelFedBotException
+from daemon import SessionScheduler, parse_schedule
+from dal import bump_daily_stat, close_connection, create_tables
+from decoder import decode
+from engine import gather_bounded
+from logconfig import configure_logging, session_scope, stop_logging
+from metrics import get_metrics, instrument
 from follow import (
-    follow_user,
+    follow_candidates,
+    follow_top_candidates,
+    prefetch_accounts,
+    resolve_relationships,
+    sync_relationship_list,
     unfollow_user,
     get_random_followers,
     check_follow_count
 )
-from timelines import get_timeline_url, get_timeline
-from utils import random_time
-
-settings = Settings()
-handlers = [
-    log.StreamHandler(),
-    RotatingFileHandler(
-        settings.app_log,
-        mode='a', maxBytes=5 * 1024 * 1024,
-        backupCount=5, encoding=None, delay=0
-    )
-]
-log.basicConfig(format='%(asctime)s | %(levelname)s | %(filename)s:%(lineno)d | %(message)s', handlers=handlers, level=log.INFO)
+from timelines import (
+    advance_high_water_mark,
+    fetch_new_timeline,
+    get_new_timeline,
+    get_timeline,
+    get_timeline_url,
+    stream_new_timeline
+)
+from pacing import get_pacer, throttle
+from prefetch import Prefetcher
+from report import FORMATS, build_report, render
+from runner import load_profiles, run_accounts
+from sampling import get_follower_sampler
+from scoring import get_follow_scorer
+from seen import get_seen_index
+
+# resolves to the account bound by runner.use_settings, or the .env account
+settings = SettingsProxy(Settings())
 
 timeline_types = ['home', 'public', 'notifications', 'global', 'tag']
+engines = ['sync', 'async']
 verify_cred_endpoint = 'accounts/verify_credentials'
 
 
+def is_muted_or_ignored(account_id: str) -> bool:
+    relationships = get_relationship_cache(settings)
+    if relationships.is_ignored(account_id):
+        return True
+    relationship, _ = relationships.get(account_id)
+    return relationship is not None and (relationship.muting or relationship.blocking)
+
+
+def is_favorite_candidate(status: dict) -> bool:
+    # filter only unfavorited status and ignore your own id and muted or ignored accounts.
+    return (not status['favourited'] and status['account']['id'] != settings.account_id
+            and not is_muted_or_ignored(status['account']['id']))
+
+
 def parse_timeline_for_favorites(data: list, limit: int = None) -> list:
-    # filter only unfavorited status and ignore your own id.
-    result = [d for d in data if not d['favourited'] and d['account']['id'] != settings.account_id]
+    # drop statuses already looked at on an earlier pass before any other filtering
+    seen = get_seen_index(settings)
+    unseen = [d for d in data if not seen.is_seen(d.get('id'))]
+    if len(unseen) < len(data):
+        log.info('skipping %s already seen posts', len(data) - len(unseen))
+    result = [d for d in unseen if is_favorite_candidate(d)]
+    candidate_ids = {d.get('id') for d in result}
     if not result:
-        log.info(f'No posts found: {len(result)}')
+        log.info('No posts found: %s', len(result))
+        seen.mark_seen(d.get('id') for d in unseen)
         return []
-    log.info(f'found {len(result)} posts to favorite from list of {len(data)}')
+    log.info('found %s posts to favorite from list of %s', len(result), len(data))
     if limit is not None and limit > 0:
         result = result[:limit]
-        log.info(f'Limiting results to {limit} posts')
+        log.info('Limiting results to %s posts', limit)
+    # rejected posts and the ones about to be liked don't need another look, the rest stay eligible
+    seen.mark_seen([d.get('id') for d in unseen if d.get('id') not in candidate_ids] + [d.get('id') for d in result])
     return result
 
 
+def take_favorites(statuses: Iterable, limit: int) -> list:
+    '''
+    Streaming counterpart of parse_timeline_for_favorites: stops pulling from
+    `statuses` once `limit` posts to like are found, the rest is never read.
+    '''
+    seen = get_seen_index(settings)
+    result, rejected, read = [], [], 0
+    for status in statuses:
+        read += 1
+        if seen.is_seen(status.get('id')):
+            continue
+        if not is_favorite_candidate(status):
+            rejected.append(status.get('id'))
+            continue
+        result.append(status)
+        if len(result) >= limit:
+            break
+    seen.mark_seen(rejected + [status.get('id') for status in result])
+    log.info('found %s posts to favorite after reading %s', len(result), read)
+    return result
+
+
+@instrument
 def fave_post(status_id) -> int:
     url = f'{settings.base_url}{settings.api_version}statuses/{status_id}/favourite'
-    response = requests.post(url, headers=settings.headers)
+    response = client.post(url, settings)
 
     if response.status_code == 200:
-        log.info(f'fave id: {status_id} request successful!')
-        log.debug(f'Response: {response.json()}')
+        log.info('fave id: %s request successful!', status_id)
+        log.debug('Response: %s', response.text)
         return 1
     else:
-        log.info(f'Request failed with status code {response.status_code}')
+        log.info('Request failed with status code %s', response.status_code)
         return 0
 
 
@@ -81,71 +143,302 @@ def filter_notification_faves(data: list, limit: int = 5) -> list:
     return list(unique_account_ids)[:limit]
 
 
-def get_status_by_id(id: str, limit: int = 6, follower: str = None) -> dict:
+@instrument
+def get_status_by_id(id: str, limit: int = 6, follower: str = None, pace: bool = True) -> dict:
     url = f'{settings.base_url}{settings.api_version}accounts/{id}/statuses'
     param = {'limit': str(limit)}
-    log.info(f'getting timeline {follower or id} @ {url}')
-    response = requests.get(url, headers=settings.headers, params=param)
-    return response.json()
+    log.info('getting timeline %s @ %s', follower or id, url)
+    if pace:
+        throttle(settings, 'read')
+    response = client.get(url, settings, params=param)
+    return decode(response)
+
 
+def fave_unfaved(server_response: dict, limit: int = 6, source: str = 'unknown'):
+    return like_posts(parse_timeline_for_favorites(server_response, limit=limit), source)
 
-def fave_unfaved(server_response: dict, limit: int = 6):
-    unfaved = parse_timeline_for_favorites(server_response, limit=limit)
+
+def like_posts(posts: list, source: str = 'unknown') -> int:
+    ''' `source` is the timeline type the posts came from, likes are counted per source for --report '''
     liked_count = 0
-    for post in unfaved:
-        random_time()
-        liked_count = liked_count + fave_post(post['id'])
+    try:
+        for post in posts:
+            throttle(settings, 'favourite')
+            liked_count = liked_count + fave_post(post['id'])
+    finally:
+        if liked_count:
+            bump_daily_stat('likes', source, liked_count)
     return liked_count
 
 
+def like_source(url_args: tuple) -> str:
+    # tag timelines carry the tag name in url_args[1]
+    return 'tag' if '/timelines/tag/' in url_args[0] else url_args[1]
+
+
 def is_like_per_session_fulfilled(like_count: int) -> bool:
     return like_count >= settings.likes_per_session
 
 
-def process_notification_timeline(url_args: tuple, follow_users: bool, like_count: int = 0) -> int:
-    server_response = get_timeline(url=url_args[0], settings=settings, timeline_type=url_args[1])
+def process_notification_timeline(url_args: tuple, follow_users: bool, like_count: int = 0,
+                                  server_response: list = None, statuses: dict = None) -> int:
+    """ returns the number of new likes, `statuses` holds prefetched account statuses by account id """
+    if server_response is None:
+        server_response = get_new_timeline(url_args, settings)
+    statuses = statuses or {}
     id_list = filter_notification_faves(server_response)
+    if follow_users:
+        # the notifications embed each account, rejected candidates cost no request
+        candidates = follow_candidates(id_list, settings, server_response)
+        if candidates:
+            resolve_relationships(candidates, settings)
+        offer_candidates(server_response, candidates, 'notifications')
+        follow_top_candidates(settings, limit=len(id_list))
+    new_likes = 0
     for id in id_list:
-        status_response = get_status_by_id(id, limit=6)
-        if follow_users:
-            follow_user(id, settings, status_response)
-        random_time()
-        like_count += fave_unfaved(status_response)
+        status_response = statuses[id] if id in statuses else get_status_by_id(id, limit=6)
+        new_likes += fave_unfaved(status_response, source='notifications')
+        if is_like_per_session_fulfilled(like_count + new_likes):
+            return new_likes
+    return new_likes
+
+
+def offer_candidates(server_response: list, ids: list, source: str):
+    ''' hand the embedded accounts of prefiltered `ids` to the follow scorer '''
+    ids = set(ids)
+    accounts = {item['account']['id']: item['account'] for item in server_response
+                if isinstance(item.get('account'), dict) and item['account'].get('id') in ids}
+    get_follow_scorer(settings).offer(accounts.values(), source)
+
+
+def process_timeline(url_args: tuple, follow_users: bool, server_response: list = None, statuses: dict = None) -> int:
+    if server_response is None and not follow_users and settings.stream_timelines:
+        # no follow candidate to pick from the whole page, read only as far as the likes need.
+        # the stream is closed before the first paced like, not held open through the sleeps
+        stream = stream_new_timeline(url_args, settings)
+        try:
+            posts = take_favorites(stream, settings.likes_per_session)
+        finally:
+            stream.close()
+        return like_posts(posts, like_source(url_args))
+    if server_response is None:
+        server_response = get_new_timeline(url_args, settings)
+    if follow_users and server_response:
+        # the embedded accounts stand in for status and account fetches, the scorer picks the best one seen so far
+        candidates = follow_candidates([sr['account']['id'] for sr in server_response], settings, server_response)
+        offer_candidates(server_response, candidates, like_source(url_args))
+        follow_top_candidates(settings, limit=1)
+    return fave_unfaved(server_response, limit=settings.likes_per_session, source=like_source(url_args))
+
+
+def process_follower_timeline(follower: tuple = None, server_response: list = None) -> int:
+    if follower is None:
+        log.info('Getting follower for timeline processing')
+        followers = get_random_followers(settings, k=1)
+        if not followers:
+            log.info('no follower outside the cooldown, skipping follower timeline')
+            return 0
+        follower = followers[0]
+    if server_response is None:
+        server_response = get_status_by_id(follower[0], limit=5, follower=follower[1])
+    new_likes = fave_unfaved(server_response, limit=settings.likes_per_session, source='follower')
+    get_follower_sampler(settings).record_interaction(follower[0])
+    return new_likes
+
+
+def handle_timeline(url_args: tuple, follow_users: bool, like_count: int = 0,
+                    server_response: list = None, statuses: dict = None):
+    match url_args[1]:
+        case 'notifications':
+            return process_notification_timeline(url_args, follow_users, like_count, server_response, statuses)
+        case _:
+            return process_timeline(url_args, follow_users, server_response, statuses)
+
+
+def run_session(timeline_type: str):
+    with session_scope(timeline_type):
+        with get_metrics().timed('pixelfed_session_seconds', account=settings.name, timeline=timeline_type):
+            like_count = _run_session(timeline_type)
+        get_metrics().export(settings)
+    return like_count
+
+
+def random_timeline_url() -> tuple:
+    random.shuffle(timeline_types)
+    return get_timeline_url(timeline_types[0], settings)
+
+
+def _run_session(timeline_type: str) -> int:
+    if not settings.prefetch:
+        # follower and timeline batches are fetched inline by the process_* functions
+        return _session_loop(timeline_type, lambda: (None, None), lambda: (random_timeline_url(), None, None))
+    handed_out = set()
+
+    def fetch_follower() -> tuple:
+        # the previous pick may not be recorded as interacted with yet, don't hand it out twice
+        followers = [f for f in get_random_followers(settings, k=3) if f[0] not in handed_out]
+        if not followers:
+            return None, None
+        handed_out.add(followers[0][0])
+        return followers[0], get_status_by_id(followers[0][0], limit=5, follower=followers[0][1], pace=False)
+
+    def fetch_timeline() -> tuple:
+        # the high-water mark moves when the session uses the batch, a batch dropped as stale
+        # or left over at the end of the session is fetched again next time
+        url_args = random_timeline_url()
+        return (url_args, *fetch_new_timeline(url_args, settings, pace=False))
+
+    def pace():
+        throttle(settings, 'read')
+
+    prefetchers = [
+        Prefetcher('follower', fetch_follower, pace, settings.prefetch_depth, settings.prefetch_max_age).start(),
+        Prefetcher('timeline', fetch_timeline, pace, settings.prefetch_depth, settings.prefetch_max_age).start(),
+    ]
+    try:
+        return _session_loop(timeline_type, prefetchers[0].get, prefetchers[1].get)
+    finally:
+        for prefetcher in prefetchers:
+            prefetcher.close()
+
+
+def _session_loop(timeline_type: str, next_follower: Callable[[], tuple], next_timeline: Callable[[], tuple]) -> int:
+    '''
+    `next_follower` returns (follower, statuses) and `next_timeline` (url_args, server_response, mark),
+    a None response is fetched inline, a prefetched one moves the high-water mark once handled.
+    Ends at likes_per_session, or after settings.session_idle_passes passes in a row without a like
+    '''
+    url_args = get_timeline_url(timeline_type, settings)
+    follow_users = check_follow_count(settings)
+    like_count = handle_timeline(url_args, follow_users)
+    log.info('first pass count: %s', like_count)
+    idle_passes = 0
+    while not is_like_per_session_fulfilled(like_count):
+        if idle_passes >= settings.session_idle_passes:
+            log.info('no new likes in %s passes, ending the session early', idle_passes)
+            break
+        log.info('Like count: %s, per session value: %s', like_count, settings.likes_per_session)
+        pass_start = like_count
+        new_likes = process_follower_timeline(*next_follower())
+        like_count += new_likes
+        log.info('Liked %s posts from follower timeline. Total likes: %s', new_likes, like_count)
         if is_like_per_session_fulfilled(like_count):
-            return like_count
+            break
         follow_users = check_follow_count(settings)
+        url_args, server_response, mark = next_timeline()
+        new_likes = handle_timeline(url_args, follow_users, like_count, server_response)
+        if mark:
+            advance_high_water_mark(*mark)
+        like_count += new_likes
+        log.info('Liked %s posts from %s timeline. Total likes: %s', new_likes, url_args[1], like_count)
+        idle_passes = idle_passes + 1 if like_count == pass_start else 0
+    log.info('Session finished with like count: %s of %s', like_count, settings.likes_per_session)
+    log.info('pacing summary: %s', get_pacer(settings).summary())
     return like_count
 
 
-def process_timeline(url_args: tuple, follow_users: bool) -> int:
-    server_response = get_timeline(url=url_args[0], settings=settings, timeline_type=url_args[1])
+async def prefetch_session(timeline_type: str, follow_users: bool = False) -> tuple:
+    """
+    Fetch every timeline, then the statuses of notification and follower
+    candidates (and their account stats when following), concurrently and without pacing.
+    Returns (timelines, statuses, followers) where timelines is a list of
+    (url_args, server_response, mark) starting with `timeline_type`. The
+    high-water marks are left alone, advance a timeline's mark once it is handled.
+    """
+    import asyncio
+
+    others = [t for t in timeline_types if t != timeline_type]
+    url_args_list = [get_timeline_url(t, settings) for t in [timeline_type] + random.sample(others, len(others))]
+    responses = await gather_bounded(
+        lambda url_args: fetch_new_timeline(url_args, settings, pace=False),
+        url_args_list, settings.concurrency
+    )
+    timelines = [(url_args, *response) for url_args, response in zip(url_args_list, responses)]
+
+    candidate_ids, notifications = [], []
+    for url_args, server_response, _ in timelines:
+        if url_args[1] == 'notifications':
+            candidate_ids.extend(filter_notification_faves(server_response))
+            notifications = server_response
+    followers = get_random_followers(settings)
+    lookups = [(id, 6, None) for id in dict.fromkeys(candidate_ids)] + [(id, 5, username) for id, username in followers]
+    log.info('prefetching %s account statuses', len(lookups))
+    status_fetch = gather_bounded(
+        lambda lookup: get_status_by_id(lookup[0], limit=lookup[1], follower=lookup[2], pace=False),
+        lookups, settings.concurrency
+    )
     if follow_users:
-        random_id = random.choice([sr['account']['id'] for sr in server_response])
-        status_response = get_status_by_id(random_id, limit=1)
-        follow_user(random_id, settings, status_response)
-    return fave_unfaved(server_response, limit=settings.likes_per_session)
+        candidates = follow_candidates(candidate_ids, settings, notifications)
+        results, _, _ = await asyncio.gather(
+            status_fetch,
+            asyncio.to_thread(prefetch_accounts, candidates, settings, False),
+            asyncio.to_thread(resolve_relationships, candidates, settings, False)
+        )
+    else:
+        results = await status_fetch
+    statuses = {lookup[0]: result for lookup, result in zip(lookups, results)}
+    return timelines, statuses, followers
 
 
-def process_follower_timeline() -> int:
-    log.info('Getting follower for timeline processing')
-    followers = get_random_followers()
-    server_response = get_status_by_id(followers[0][0], limit=5, follower=followers[0][1])
-    random_time()
-    return fave_unfaved(server_response, limit=settings.likes_per_session)
+def run_async_session(timeline_type: str) -> int:
+    """ async engine: reads are prefetched concurrently, only likes and follows are paced """
+    with session_scope(timeline_type):
+        with get_metrics().timed('pixelfed_session_seconds', account=settings.name, timeline=timeline_type):
+            like_count = _run_async_session(timeline_type)
+        get_metrics().export(settings)
+    return like_count
 
 
-def handle_timeline(url_args: tuple, follow_users: bool, like_count: int = 0):
-    match url_args[1]:
-        case 'notifications':
-            return process_notification_timeline(url_args, follow_users, like_count)
-        case _:
-            return process_timeline(url_args, follow_users)
+def _run_async_session(timeline_type: str) -> int:
+    follow_users = check_follow_count(settings)
+    import asyncio
+
+    timelines, statuses, followers = asyncio.run(prefetch_session(timeline_type, follow_users))
+    like_count = 0
+    followers = iter(followers)
+    for url_args, server_response, mark in timelines:
+        new_likes = handle_timeline(url_args, follow_users, like_count, server_response, statuses)
+        # timelines the session stops short of keep their mark, their posts are fetched again next time
+        advance_high_water_mark(*mark)
+        like_count += new_likes
+        log.info('Liked %s posts from %s timeline. Total likes: %s', new_likes, url_args[1], like_count)
+        if is_like_per_session_fulfilled(like_count):
+            break
+        follower = next(followers, None)
+        if follower is not None:
+            new_likes = process_follower_timeline(follower, statuses[follower[0]])
+            like_count += new_likes
+            log.info('Liked %s posts from follower timeline. Total likes: %s', new_likes, like_count)
+            if is_like_per_session_fulfilled(like_count):
+                break
+        follow_users = check_follow_count(settings)
+    log.info('Async session finished with like count: %s of %s', like_count, settings.likes_per_session)
+    log.info('pacing summary: %s', get_pacer(settings).summary())
+    return like_count
+
+
+def run_daemon() -> int:
+    """ keeps the http pool, db connection and caches warm between scheduled sessions """
+    create_tables()
+    get_relationship_cache(settings).warm()
+    scheduler = SessionScheduler(parse_schedule(settings.daemon_schedule, datetime.now()), run_scheduled_session)
+    scheduler.install_signal_handlers()
+    get_pacer(settings).sleep = scheduler.sleep
+    return scheduler.run()
+
+
+def run_scheduled_session(timeline_type: str, engine: str = 'sync') -> int:
+    if engine == 'async':
+        return run_async_session(timeline_type)
+    return run_session(timeline_type)
 
 
 def main():
     try:
         pre_parser = argparse.ArgumentParser(add_help=False)
         pre_parser.add_argument('--unfollow', type=str, help='Unfollow specific user')
+        pre_parser.add_argument('--sync', type=str, choices=['followers', 'following'], help='sync follower or following list to db')
+        pre_parser.add_argument('--daemon', action='store_true', help='run scheduled sessions until SIGTERM')
         args, _ = pre_parser.parse_known_args()
 
         parser = argparse.ArgumentParser(
@@ -155,46 +448,59 @@ def main():
         )
         parser.add_argument('-t', '--timeline_type', type=str, choices=(timeline_types), help='timeline type', required=True)
         parser.add_argument('-l', '--limit', type=int, help='override session like limit', required=False)
-        parser.add_argument('--report', action='store_true', help='print out db data')
-        parser.add_argument('--migrate', action='store_true', help='run migrations, manual flag')
+        parser.add_argument('-e', '--engine', type=str, choices=engines, default='sync', help='sync or concurrent async reads')
+        parser.add_argument('--report', nargs='?', const='text', choices=FORMATS,
+                            help='print activity from the daily summary table as a text table (default) or json')
+        parser.add_argument('--days', type=int, default=7, help='days covered by --report')
+        parser.add_argument('--daemon', action='store_true', help='run scheduled sessions until SIGTERM, see Settings.daemon_schedule')
+        parser.add_argument('--migrate', action='store_true', help='apply pending schema migrations and exit')
+        parser.add_argument('--accounts', type=str, help='json file of account profiles to run concurrently, see runner.py')
         parser.add_argument('--version', action='version', version='%(prog)s 1.8')
+        if not (args.unfollow or args.sync or args.daemon):
+            # --help, --version and usage errors exit here, before logging opens its file
+            # parse into the pre-parser's namespace so args.unfollow and args.sync stay defined
+            args = parser.parse_args(namespace=args)
+        configure_logging(settings)
         log.info('starting pixelfed bot')
 
         if args.unfollow:
             unfollow_user(args.unfollow, settings)
             sys.exit(0)
-        args = parser.parse_args()
+        if args.sync:
+            create_tables()
+            sync_relationship_list(settings, args.sync)
+            sys.exit(0)
+        if args.daemon:
+            run_daemon()
+            sys.exit(0)
+        if args.accounts:
+            profiles = load_profiles(args.accounts)
+            for profile in profiles:
+                profile.likes_per_session = args.limit or profile.likes_per_session
+            run_accounts(profiles, run_scheduled_session, args.timeline_type, args.engine)
+            get_metrics().export(settings)
+            return
         create_tables()
         settings.likes_per_session = args.limit or settings.likes_per_session
         if args.migrate:
-            log.info('testing functions')
+            # create_tables already brought the schema up to date
             return
         if args.report:
             check_follow_count(settings)
-            # TODO add type for a simple report
+            print(render(build_report(args.days), args.report))
             return
-        url_args = get_timeline_url(args.timeline_type, settings)
-        follow_users = check_follow_count(settings)
-        like_count = handle_timeline(url_args, follow_users)
-        log.info(f'first pass count: {like_count}')
-        while not is_like_per_session_fulfilled(like_count):
-            log.info(f'Like count: {like_count}, per session value: {settings.likes_per_session}')
-            random_time()
-            new_likes = process_follower_timeline()
-            like_count += new_likes
-            log.info(f'Liked {new_likes} posts from follower timeline. Total likes: {like_count}')
-            if is_like_per_session_fulfilled(like_count):
-                break
-            random.shuffle(timeline_types)
-            follow_users = check_follow_count(settings)
-            new_likes = handle_timeline(get_timeline_url(timeline_types[0], settings), follow_users, like_count)
-            like_count += new_likes
-            log.info(f'Liked {new_likes} posts from {timeline_types[0]} timeline. Total likes: {like_count}')
-        log.info(f'Reached total like count: {like_count} exceeding {settings.likes_per_session}')
+        get_relationship_cache(settings).warm()
+        run_scheduled_session(args.timeline_type, args.engine)
     except PixelFedBotException as ex:
         log.error(ex, exc_info=True)
 
 
 if __name__ == '__main__':
-    main()
-    log.info('closing shop...')
+    try:
+        main()
+    finally:
+        # --unfollow, --sync and --daemon leave main() through sys.exit
+        client.close_session()
+        close_connection()
+        log.info('closing shop...')
+        stop_logging()
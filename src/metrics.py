@@ -0,0 +1,221 @@
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+from config import Settings
+from logconfig import action_scope
+
+log = logging.getLogger(__name__)
+
+# seconds, shared by every latency histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HELP = {
+    'pixelfed_http_requests_total': ('counter', 'api requests by method, endpoint and status code'),
+    'pixelfed_http_response_bytes_total': ('counter', 'response bytes received by endpoint'),
+    'pixelfed_http_request_seconds': ('histogram', 'api request latency by method and endpoint'),
+    'pixelfed_operation_seconds': ('histogram', 'time spent in instrumented bot operations, pacing included'),
+    'pixelfed_db_queries_total': ('counter', 'sqlite statements executed'),
+    'pixelfed_db_transaction_seconds': ('histogram', 'time spent in a database unit of work by caller'),
+    'pixelfed_follow_prefilter_total': ('counter', 'follow candidates by zero request prefilter outcome'),
+    'pixelfed_prefetch_total': ('counter', 'prefetched batches by source and whether they were ready, waited for or stale'),
+    'pixelfed_pacing_sleep_seconds_total': ('counter', 'seconds slept by the pacer by action class and sleeper, session or prefetch'),
+    'pixelfed_session_seconds': ('histogram', 'wall time per session by account and timeline type'),
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> list:
+        total, result = 0, []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+# set while runner.run_accounts runs account sessions, every account shares one registry and export paths
+_export_deferred = ContextVar('export_deferred', default=False)
+
+
+@contextmanager
+def deferred_export():
+    '''skip session end exports in this context, the caller exports once when all sessions are done'''
+    token = _export_deferred.set(True)
+    try:
+        yield
+    finally:
+        _export_deferred.reset(token)
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class Metrics:
+    '''
+    In process counters and latency histograms for one bot process.
+    Exported at session end as a Prometheus textfile (for node_exporter's
+    textfile collector) and as a json summary.
+    '''
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self.clock = clock
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timed(self, name: str, **labels):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.observe(name, self.clock() - start, **labels)
+
+    def counter_total(self, name: str, **labels) -> float:
+        '''sum of the series of `name` carrying all of `labels`'''
+        wanted = set(_labels(labels))
+        with self._lock:
+            return sum(value for (n, series), value in self.counters.items() if n == name and wanted <= set(series))
+
+    def summary(self) -> dict:
+        with self._lock:
+            counters, histograms = {}, {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, {})[_format_labels(labels) or 'total'] = round(value, 6)
+            for (name, labels), h in sorted(self.histograms.items()):
+                histograms.setdefault(name, {})[_format_labels(labels) or 'total'] = {
+                    'count': h.count,
+                    'sum': round(h.sum, 6),
+                    'mean': round(h.sum / h.count, 6) if h.count else 0,
+                    'max': round(h.max, 6),
+                }
+            session = sum(h.sum for (n, _), h in self.histograms.items() if n == 'pixelfed_session_seconds')
+        # prefetch workers sleep while the session does, only the session's own sleeps split its time
+        sleeping = self.counter_total('pixelfed_pacing_sleep_seconds_total', sleeper='session')
+        return {
+            'time': {'session': round(session, 3), 'sleeping': round(sleeping, 3), 'working': round(max(session - sleeping, 0), 3)},
+            'counters': counters,
+            'histograms': histograms,
+        }
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            names = sorted({n for n, _ in self.counters} | {n for n, _ in self.histograms})
+            for name in names:
+                kind, text = HELP.get(name, ('untyped', name))
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(h.buckets, h.cumulative()):
+                        lines.append(f'{name}_bucket{_format_labels(labels, (("le", str(bound)),))} {count}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, (("le", "+Inf"),))} {h.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {h.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str):
+        # write then rename so the collector never reads a half written file
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+    def write_json(self, path: str):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+        os.replace(tmp, path)
+
+    def export(self, settings: Settings):
+        if _export_deferred.get():
+            return
+        if settings.metrics_textfile:
+            self.write_textfile(settings.metrics_textfile)
+        if settings.metrics_json:
+            self.write_json(settings.metrics_json)
+        log.info('session time: %s', self.summary()['time'])
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def reset():
+    global _metrics
+    _metrics = Metrics()
+
+
+def instrument(func: Callable) -> Callable:
+    '''
+    records the wall time of every call as pixelfed_operation_seconds{operation=<function name>}
+    and tags the records logged during the call with a fresh action id
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with action_scope(func.__name__), get_metrics().timed('pixelfed_operation_seconds', operation=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint(url: str, settings: Settings) -> str:
+    '''api path with numeric ids collapsed, e.g. accounts/{id}/statuses'''
+    path = url.split('?', 1)[0]
+    prefix = f'{settings.base_url}{settings.api_version}'
+    if path.startswith(prefix):
+        path = '/' + path[len(prefix):]
+    return _ID_SEGMENT.sub('/{id}', path).lstrip('/')
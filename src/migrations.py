@@ -0,0 +1,226 @@
+import logging
+import sqlite3
+
+log = logging.getLogger(__name__)
+
+
+def table_exists(cursor: sqlite3.Cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def copy_legacy_tables(cursor: sqlite3.Cursor):
+    '''
+    One time copy of the old following/followers tables, skipped on databases
+    that never had them. Runs on the first start after an upgrade, so rows
+    already in account and relationships are current and are kept as they are.
+    '''
+    if not (table_exists(cursor, 'following') and table_exists(cursor, 'followers')):
+        log.info('no legacy following/followers tables, nothing to copy')
+        return
+    log.info('inserting following and followers to new account table')
+    cursor.execute('''
+        INSERT OR IGNORE INTO account
+        (id, username, acct, display_name, followers_count, following_count, created_at, last_updated)
+        SELECT id, username, acct, display_name, followers_count, following_count, created_at, last_updated
+        FROM FOLLOWING;
+    ''')
+    inserted = cursor.rowcount
+    cursor.execute('''
+        INSERT OR IGNORE INTO account
+        (id, username, acct, display_name, followers_count, following_count, created_at, last_updated)
+        SELECT id, username, '', '', 0, 0, last_updated , last_updated FROM followers;
+    ''')
+    log.info('successfully inserted %s records', inserted + cursor.rowcount)
+    log.info('inserting following and followers to relationship table')
+    # one row per account, so a mutual follow keeps both flags
+    cursor.execute('''
+        INSERT OR IGNORE INTO relationships
+        (id, "following", followed_by, blocking, muting, muting_notifications, requested, domain_blocking, showing_reblogs, endorsed, created_at)
+        SELECT id, MAX(is_following), MAX(is_follower), 0, 0, 0, 0, 0, 0, 0, MIN(last_updated) FROM (
+            SELECT id, 1 AS is_following, 0 AS is_follower, last_updated FROM following
+            UNION ALL
+            SELECT id, 0, 1, last_updated FROM followers
+        )
+        GROUP BY id
+    ''')
+    log.info('successfully inserted %s records', cursor.rowcount)
+
+
+# adds one to every metric the SELECT yields for today, used by the relationship triggers
+_BUMP = '''
+    INSERT INTO daily_stats (day, metric, dimension, count)
+    SELECT date('now'), metric, '', 1 FROM ({}) WHERE true
+    ON CONFLICT (day, metric, dimension) DO UPDATE SET count = count + 1;
+'''
+
+
+def create_daily_stats(cursor: sqlite3.Cursor):
+    '''
+    daily_stats holds per day counters (likes by timeline type, follows,
+    follow backs, unfollows, follower gains and losses) so reports read a
+    few rows per day instead of scanning relationships. Relationship changes
+    are counted by triggers, likes by dal.bump_daily_stat. Existing rows are
+    backfilled once by the day they were created: followers as found rather
+    than gained, and follows not at all, since nothing recorded which rows
+    were our own follows.
+    '''
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            dimension TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric, dimension)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS relationships_daily_stats_insert AFTER INSERT ON relationships
+        BEGIN {_BUMP.format("""
+            SELECT 'follows' AS metric WHERE NEW.following = 1
+            UNION ALL SELECT 'followers_gained' WHERE NEW.followed_by = 1
+        """)} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS relationships_daily_stats_update AFTER UPDATE OF following, followed_by ON relationships
+        WHEN OLD.following IS NOT NEW.following OR OLD.followed_by IS NOT NEW.followed_by
+        BEGIN {_BUMP.format("""
+            SELECT 'follows' AS metric WHERE OLD.following = 0 AND NEW.following = 1
+            UNION ALL SELECT 'unfollows' WHERE OLD.following = 1 AND NEW.following = 0
+            UNION ALL SELECT 'followers_gained' WHERE OLD.followed_by = 0 AND NEW.followed_by = 1
+            UNION ALL SELECT 'follow_backs' WHERE OLD.followed_by = 0 AND NEW.followed_by = 1 AND NEW.following = 1
+            UNION ALL SELECT 'followers_lost' WHERE OLD.followed_by = 1 AND NEW.followed_by = 0
+        """)} END
+    ''')
+    log.info('backfilling daily stats from existing relationships')
+    cursor.execute('''
+        INSERT INTO daily_stats (day, metric, dimension, count)
+        SELECT day, metric, '', COUNT(*) FROM (
+            SELECT date(created_at) AS day, 'followers_found' AS metric FROM relationships WHERE followed_by = 1
+            UNION ALL
+            SELECT date(i.last_updated), 'unfollows' FROM ignore_account i
+                JOIN relationships r ON r.id = i.id
+            WHERE r.following = 0
+        )
+        WHERE day IS NOT NULL
+        GROUP BY day, metric
+    ''')
+    log.info('backfilled %s daily stats', cursor.rowcount)
+
+
+# a follower appearing before any full followers sync is found, not gained
+_FOLLOWER_METRIC = '''
+    CASE WHEN EXISTS (SELECT 1 FROM sync_state WHERE key = 'synced:followers')
+    THEN 'followers_gained' ELSE 'followers_found' END
+'''
+
+
+def recount_relationship_changes(cursor: sqlite3.Cursor):
+    '''
+    Replace the migration 4 triggers, which counted list syncs and lookups
+    as follows, follow backs and follower growth. Follows are now counted by
+    follow_user, follow backs only for accounts we followed (followed_at is
+    set), and followers seen before the first complete followers sync as
+    followers_found. Counts already in daily_stats are left as they are.
+    '''
+    cursor.execute('DROP TRIGGER IF EXISTS relationships_daily_stats_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS relationships_daily_stats_update')
+    cursor.execute(f'''
+        CREATE TRIGGER relationships_daily_stats_insert AFTER INSERT ON relationships
+        WHEN NEW.followed_by = 1
+        BEGIN {_BUMP.format(f"SELECT {_FOLLOWER_METRIC} AS metric")} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER relationships_daily_stats_update AFTER UPDATE OF following, followed_by ON relationships
+        WHEN OLD.following IS NOT NEW.following OR OLD.followed_by IS NOT NEW.followed_by
+        BEGIN {_BUMP.format(f"""
+            SELECT 'unfollows' AS metric WHERE OLD.following = 1 AND NEW.following = 0
+            UNION ALL SELECT {_FOLLOWER_METRIC} WHERE OLD.followed_by = 0 AND NEW.followed_by = 1
+            UNION ALL SELECT 'follow_backs' WHERE OLD.followed_by = 0 AND NEW.followed_by = 1
+                AND NEW.following = 1 AND NEW.followed_at IS NOT NULL
+            UNION ALL SELECT 'followers_lost' WHERE OLD.followed_by = 1 AND NEW.followed_by = 0
+        """)} END
+    ''')
+
+
+# (version, description, list of sql statements or a callable taking the cursor)
+MIGRATIONS = [
+    (1, 'copy legacy following/followers tables', copy_legacy_tables),
+    (2, 'index relationships for follow counts and follower lookups', [
+        'CREATE INDEX IF NOT EXISTS idx_relationships_following_created_at ON relationships (following, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_relationships_followed_by ON relationships (followed_by)',
+    ]),
+    (3, 'track when we last interacted with an account', [
+        'ALTER TABLE relationships ADD COLUMN last_interacted_at REAL',
+    ]),
+    (4, 'daily summary table kept up to date by relationship triggers', create_daily_stats),
+    (5, 'follow back outcomes per account bucket for candidate scoring', [
+        'ALTER TABLE relationships ADD COLUMN score_bucket TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS follow_outcomes (
+            bucket TEXT PRIMARY KEY,
+            follows INTEGER NOT NULL DEFAULT 0,
+            follow_backs INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        # score_bucket is set when we follow, a later follow back is credited to that bucket
+        '''
+        CREATE TRIGGER IF NOT EXISTS relationships_follow_outcomes AFTER UPDATE OF followed_by ON relationships
+        WHEN OLD.followed_by = 0 AND NEW.followed_by = 1 AND NEW.following = 1 AND NEW.score_bucket IS NOT NULL
+        BEGIN
+            UPDATE follow_outcomes SET follow_backs = follow_backs + 1 WHERE bucket = NEW.score_bucket;
+        END
+        ''',
+    ]),
+    (6, 'record when we followed an account, list syncs leave it empty', [
+        'ALTER TABLE relationships ADD COLUMN followed_at TIMESTAMP',
+        'CREATE INDEX IF NOT EXISTS idx_relationships_followed_at ON relationships (followed_at)',
+        # synced rows can't be told apart from our own follows, keep the last week counted toward follows_per_day
+        "UPDATE relationships SET followed_at = created_at WHERE following = 1 AND created_at >= DATE('now', '-7 days')",
+    ]),
+    (7, 'count only our own follows and their follow backs in daily stats', recount_relationship_changes),
+    (8, 'accounts listed so far by a followers or following sync', [
+        '''
+        CREATE TABLE IF NOT EXISTS sync_seen (
+            kind TEXT NOT NULL,
+            id TEXT NOT NULL,
+            PRIMARY KEY (kind, id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (9, 'drop the follow count index, follows are counted on followed_at since migration 6', [
+        'DROP INDEX IF EXISTS idx_relationships_following_created_at',
+    ]),
+]
+
+
+def current_version(cursor: sqlite3.Cursor) -> int:
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def apply_migrations(cursor: sqlite3.Cursor, migrations: list = MIGRATIONS) -> int:
+    '''
+    Apply every migration newer than the recorded schema version, in order,
+    inside the caller's transaction. Returns the resulting version.
+    '''
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME default current_timestamp
+        )
+    ''')
+    version = current_version(cursor)
+    for number, description, steps in migrations:
+        if number <= version:
+            continue
+        log.info('applying migration %s: %s', number, description)
+        if callable(steps):
+            steps(cursor)
+        else:
+            for statement in steps:
+                cursor.execute(statement)
+        cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (number, description))
+        version = number
+    return version
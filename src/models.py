@@ -2,8 +2,10 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
+from config import PixelFedBotException
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class RelationshipStatus:
     id: str
     following: bool
@@ -17,7 +19,7 @@ class RelationshipStatus:
     endorsed: bool
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Account:
     id: str
     username: str
@@ -30,9 +32,10 @@ class Account:
     last_updated: Optional[datetime] = None
 
 
-def map_account(account_response) -> Account:
+def map_account(account_response: dict) -> Account:
     try:
-        account = Account(
+        now = datetime.now()
+        return Account(
             id=account_response['id'],
             username=account_response['username'],
             acct=account_response['acct'],
@@ -40,10 +43,23 @@ def map_account(account_response) -> Account:
             followers_count=account_response['followers_count'],
             following_count=account_response['following_count'],
             statuses_count=account_response['statuses_count'],
-            created_at=datetime.now(),
-            last_updated=datetime.now()
+            created_at=now,
+            last_updated=now
         )
-    except Exception:
-        account = {}
-    finally:
-        return account
+    except (KeyError, TypeError) as ex:
+        raise PixelFedBotException(f'malformed account payload, missing {ex}') from ex
+
+
+def map_relationship(relationship_response: dict) -> RelationshipStatus:
+    return RelationshipStatus(
+        id=relationship_response['id'],
+        following=relationship_response['following'],
+        followed_by=relationship_response['followed_by'],
+        blocking=relationship_response['blocking'],
+        muting=relationship_response['muting'],
+        muting_notifications=relationship_response.get('muting_notifications'),
+        requested=relationship_response['requested'],
+        domain_blocking=relationship_response.get('domain_blocking'),
+        showing_reblogs=relationship_response.get('showing_reblogs'),
+        endorsed=relationship_response['endorsed']
+    )
@@ -0,0 +1,189 @@
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+from config import Settings
+from metrics import get_metrics
+
+log = logging.getLogger(__name__)
+
+# whose time a pacing sleep takes, a prefetch worker's sleeps overlap the session's
+sleeper = ContextVar('sleeper', default='session')
+
+
+@dataclass
+class PacingDecision:
+    action: str
+    delay: float
+    reason: str
+    bucket_wait: float
+    rate_limit_wait: float
+    jitter: float
+
+
+def jitter_none(profile: dict) -> float:
+    return 0.0
+
+
+def jitter_uniform(profile: dict) -> float:
+    return random.uniform(profile['low'], profile['high'])
+
+
+def jitter_lognormal(profile: dict) -> float:
+    return min(random.lognormvariate(profile['mu'], profile['sigma']), profile.get('max', math.inf))
+
+
+JITTER = {
+    'none': jitter_none,
+    'uniform': jitter_uniform,
+    'lognormal': jitter_lognormal,
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def reserve(self) -> float:
+        '''take a token, returns seconds to wait before it is actually available'''
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class Pacer:
+    '''
+    Decides how long to wait before each action. Every action class (read,
+    favourite, follow) has its own token bucket and jitter distribution, and
+    all of them back off when the server's X-RateLimit headers run low.
+    '''
+
+    def __init__(self, profiles: dict, rate_limit_floor: int = 5, rate_limit_backoff: float = 60,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                 history: int = 500):
+        self.profiles = profiles
+        self.rate_limit_floor = rate_limit_floor
+        self.rate_limit_backoff = rate_limit_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = {action: TokenBucket(p['rate'], p['burst'], clock) for action, p in profiles.items()}
+        self.remaining = None
+        self.reset_at = None
+        self.decisions = deque(maxlen=history)
+        self.totals = {action: [0, 0.0] for action in profiles}
+        self._lock = threading.Lock()
+
+    def observe(self, response):
+        '''update the rate limit budget from a response's headers'''
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        with self._lock:
+            self.remaining = int(remaining)
+            self.reset_at = self._parse_reset(response.headers.get('X-RateLimit-Reset'))
+
+    def _parse_reset(self, value: str) -> float:
+        '''X-RateLimit-Reset is either an ISO timestamp, an epoch or seconds from now'''
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+            if seconds > 1e9:
+                seconds = seconds - time.time()
+        except ValueError:
+            try:
+                reset = datetime.fromisoformat(value)
+            except ValueError:
+                log.info('unparsable X-RateLimit-Reset: %s', value)
+                return None
+            if reset.tzinfo is None:
+                reset = reset.replace(tzinfo=timezone.utc)
+            seconds = (reset - datetime.now(timezone.utc)).total_seconds()
+        return self.clock() + max(seconds, 0.0)
+
+    def _rate_limit_wait(self) -> tuple:
+        if self.remaining is None:
+            return 0.0, ''
+        until_reset = max(self.reset_at - self.clock(), 0.0) if self.reset_at is not None else None
+        if self.remaining <= self.rate_limit_floor:
+            if until_reset is None:
+                return self.rate_limit_backoff, f'rate limit remaining {self.remaining}, backing off'
+            return until_reset, f'rate limit remaining {self.remaining}, waiting for reset'
+        if until_reset is None:
+            return 0.0, ''
+        # spread what is left of the window evenly over the remaining budget
+        wait = until_reset / (self.remaining - self.rate_limit_floor)
+        self.remaining -= 1
+        return wait, 'spreading rate limit budget'
+
+    def decide(self, action: str) -> PacingDecision:
+        profile = self.profiles[action]
+        with self._lock:
+            bucket_wait = self.buckets[action].reserve()
+            rate_limit_wait, rate_limit_reason = self._rate_limit_wait()
+        jitter = JITTER[profile.get('jitter', 'none')](profile)
+        delay, reason = max(
+            (jitter, 'jitter'),
+            (bucket_wait, 'token bucket'),
+            (rate_limit_wait, rate_limit_reason or 'rate limit'),
+        )
+        return PacingDecision(action, delay, reason, bucket_wait, rate_limit_wait, jitter)
+
+    def wait(self, action: str) -> PacingDecision:
+        decision = self.decide(action)
+        with self._lock:
+            self.decisions.append(decision)
+            self.totals[action][0] += 1
+            self.totals[action][1] += decision.delay
+        if decision.delay > 0:
+            log.info('%s: sleeping for %.1f seconds (%s)...', action, decision.delay, decision.reason)
+            get_metrics().inc('pixelfed_pacing_sleep_seconds_total', decision.delay, action=action, sleeper=sleeper.get())
+            self.sleep(decision.delay)
+        return decision
+
+    def summary(self) -> dict:
+        '''count and total seconds slept per action class'''
+        with self._lock:
+            return {action: {'count': count, 'slept': round(slept, 3)} for action, (count, slept) in self.totals.items()}
+
+
+_pacers = {}
+_pacers_lock = threading.Lock()
+
+
+def get_pacer(settings: Settings) -> Pacer:
+    key = (settings.base_url, settings.account_id)
+    with _pacers_lock:
+        if key not in _pacers:
+            _pacers[key] = Pacer(settings.pacing, settings.rate_limit_floor, settings.rate_limit_backoff)
+        return _pacers[key]
+
+
+def set_pacer(settings: Settings, pacer: Pacer):
+    '''install a custom pacer, e.g. one running on a virtual clock'''
+    with _pacers_lock:
+        _pacers[(settings.base_url, settings.account_id)] = pacer
+
+
+def throttle(settings: Settings, action: str) -> PacingDecision:
+    return get_pacer(settings).wait(action)
+
+
+def reset():
+    with _pacers_lock:
+        _pacers.clear()
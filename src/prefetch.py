@@ -0,0 +1,98 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+
+from dal import close_connection
+from metrics import get_metrics
+from pacing import sleeper
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    '''
+    Keeps up to `depth` results of `fetch` ready in a bounded queue, produced
+    by a background thread while the session thread is busy, mostly sleeping
+    between likes. `pace` runs in the worker before each fetch, so read
+    pacing and request latency overlap those sleeps instead of adding to
+    them. Results older than `max_age` seconds are dropped on get and the
+    worker fetches fresh ones.
+    '''
+
+    def __init__(self, name: str, fetch: Callable[[], object], pace: Callable[[], object] = None, depth: int = 1,
+                 max_age: float = 600, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.fetch = fetch
+        self.pace = pace
+        self.max_age = max_age
+        self.clock = clock
+        self._queue = queue.Queue(maxsize=max(depth, 1))
+        # a slot is taken before pacing and fetching, so at most `depth` batches are ever fetched ahead
+        self._slots = threading.Semaphore(max(depth, 1))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'Prefetcher':
+        # the worker sees the session's settings, database and log context
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._produce,), name=f'prefetch-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def _produce(self):
+        # pacing sleeps here overlap the session's, keep them out of its sleeping time
+        sleeper.set('prefetch')
+        try:
+            while not self._stop.is_set():
+                self._slots.acquire()
+                if self._stop.is_set():
+                    return
+                try:
+                    if self.pace is not None:
+                        self.pace()
+                    if self._stop.is_set():
+                        return
+                    item = (self.clock(), self.fetch(), None)
+                except Exception as ex:
+                    # e.g. the daemon's ShutdownRequested from a pacing sleep, raised again in the session thread
+                    item = (self.clock(), None, ex)
+                self._queue.put(item)
+                if item[2] is not None:
+                    return
+        finally:
+            close_connection()
+
+    def get(self, timeout: float = None):
+        '''the next fresh result, waits for the worker if none is ready yet'''
+        while True:
+            ready = not self._queue.empty()
+            fetched_at, result, error = self._queue.get(timeout=timeout)
+            self._slots.release()
+            if error is not None:
+                raise error
+            age = self.clock() - fetched_at
+            if age > self.max_age:
+                log.info('dropping %s prefetched %.0f seconds ago', self.name, age)
+                get_metrics().inc('pixelfed_prefetch_total', source=self.name, outcome='stale')
+                continue
+            get_metrics().inc('pixelfed_prefetch_total', source=self.name, outcome='ready' if ready else 'waited')
+            return result
+
+    def close(self, timeout: float = 0):
+        '''
+        stop the worker, without waiting for it by default: a worker inside a
+        pacing sleep exits when it wakes, without fetching
+        '''
+        self._stop.set()
+        # wake a worker waiting for a free slot
+        self._slots.release()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if self._thread is not None and timeout:
+            self._thread.join(timeout)
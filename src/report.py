@@ -0,0 +1,87 @@
+import json
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from dal import load_daily_stats, sum_daily_stats
+
+log = logging.getLogger(__name__)
+
+FORMATS = ['text', 'json']
+# daily_stats metrics besides likes, in report column order. followers_found are followers first seen
+# before a complete followers sync, they count toward the follower total but not toward growth
+RELATIONSHIP_METRICS = ['follows', 'follow_backs', 'unfollows', 'followers_gained', 'followers_lost', 'followers_found']
+
+
+def today() -> date:
+    # daily_stats days are UTC, sqlite's date('now')
+    return datetime.now(timezone.utc).date()
+
+
+def build_report(days: int = 7, until: date = None) -> dict:
+    '''
+    Activity for the `days` days up to `until` (today by default), read from
+    the daily_stats summary table only. Days without activity are included
+    so follower growth reads as a continuous series.
+    '''
+    until = until or today()
+    since = until - timedelta(days=max(days, 1) - 1)
+    before = sum_daily_stats(since.isoformat())
+    followers = before.get('followers_gained', 0) + before.get('followers_found', 0) - before.get('followers_lost', 0)
+
+    rows = {}
+    for day, metric, dimension, count in load_daily_stats(since.isoformat(), until.isoformat()):
+        row = rows.setdefault(day, {'likes': {}})
+        if metric == 'likes':
+            row['likes'][dimension] = row['likes'].get(dimension, 0) + count
+        else:
+            row[metric] = row.get(metric, 0) + count
+
+    result, totals = [], {'likes': {}, **{metric: 0 for metric in RELATIONSHIP_METRICS}}
+    for offset in range((until - since).days + 1):
+        day = (since + timedelta(days=offset)).isoformat()
+        row = rows.get(day, {'likes': {}})
+        entry = {'day': day, 'likes': row['likes'], 'likes_total': sum(row['likes'].values())}
+        for metric in RELATIONSHIP_METRICS:
+            entry[metric] = row.get(metric, 0)
+            totals[metric] += entry[metric]
+        for timeline, count in row['likes'].items():
+            totals['likes'][timeline] = totals['likes'].get(timeline, 0) + count
+        entry['follower_net'] = entry['followers_gained'] - entry['followers_lost']
+        followers += entry['follower_net'] + entry['followers_found']
+        entry['followers'] = followers
+        result.append(entry)
+
+    totals['likes_total'] = sum(totals['likes'].values())
+    totals['follower_net'] = totals['followers_gained'] - totals['followers_lost']
+    totals['follow_back_rate'] = round(totals['follow_backs'] / totals['follows'], 3) if totals['follows'] else None
+    return {'since': since.isoformat(), 'until': until.isoformat(), 'followers': followers, 'days': result, 'totals': totals}
+
+
+def render_json(report: dict) -> str:
+    return json.dumps(report, indent=4)
+
+
+def render_text(report: dict) -> str:
+    timelines = sorted(report['totals']['likes'])
+    columns = ['day', 'likes'] + [f'likes:{t}' for t in timelines] + \
+        ['follows', 'follow_backs', 'unfollows', '+followers', '-followers', 'net', 'found', 'followers']
+
+    def cells(entry: dict, first: str, followers) -> list:
+        return [first, entry['likes_total']] + [entry['likes'].get(t, 0) for t in timelines] + [
+            entry['follows'], entry['follow_backs'], entry['unfollows'],
+            entry['followers_gained'], entry['followers_lost'], entry['follower_net'], entry['followers_found'], followers
+        ]
+
+    rows = [columns] + [cells(entry, entry['day'], entry['followers']) for entry in report['days']]
+    rows.append(cells(report['totals'], 'total', report['followers']))
+    rows = [[str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    lines = ['  '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows]
+    rate = report['totals']['follow_back_rate']
+    lines.insert(len(lines) - 1, '-' * len(lines[0]))
+    lines.append(f"follow back rate: {'-' if rate is None else f'{rate:.1%}'}")
+    return '\n'.join(lines)
+
+
+def render(report: dict, format: str = 'text') -> str:
+    return render_json(report) if format == 'json' else render_text(report)
@@ -0,0 +1,68 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from cache import get_relationship_cache
+from config import Settings, PixelFedBotException, use_settings
+from dal import close_connection, create_tables, use_database
+from metrics import deferred_export
+from utils import read_json
+
+log = logging.getLogger(__name__)
+
+
+def load_profiles(path: str) -> list:
+    '''
+    profiles file: a json list of objects, each one overriding Settings
+    attributes for one account, e.g.
+    [{"name": "runner", "token": "...", "account_id": "1", "base_url": "https://pixelfed.social/"}]
+    '''
+    profiles = [Settings.from_profile(profile) for profile in read_json(path)]
+    if not profiles:
+        raise PixelFedBotException(f'no profiles in {path}')
+    names = [profile.name for profile in profiles]
+    if len(set(names)) != len(names):
+        raise PixelFedBotException(f'duplicate profile names in {path}')
+    databases = [profile.db_path for profile in profiles]
+    if len(set(databases)) != len(databases):
+        raise PixelFedBotException(f'profiles in {path} share a database')
+    return profiles
+
+
+def run_account(settings: Settings, run_session: Callable[[str, str], int], timeline_type: str, engine: str) -> int:
+    '''
+    run one session with `settings` and its database bound to the current
+    context, metrics are exported by the caller once every account is done
+    '''
+    with use_settings(settings), use_database(settings.db_path), deferred_export():
+        try:
+            create_tables()
+            get_relationship_cache(settings).warm()
+            return run_session(timeline_type, engine)
+        finally:
+            close_connection()
+
+
+def run_accounts(profiles: list, run_session: Callable[[str, str], int], timeline_type: str,
+                 engine: str = 'sync') -> dict:
+    '''
+    Run a session for every profile concurrently, one thread per account.
+    Accounts keep their own database, caches, pacing and quotas, http
+    connections to the same instance come from one shared pool.
+    Returns like counts by profile name, None for a failed account.
+    '''
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(profiles), thread_name_prefix='account') as pool:
+        futures = {
+            settings.name: pool.submit(contextvars.copy_context().run, run_account, settings, run_session, timeline_type, engine)
+            for settings in profiles
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as ex:
+                log.error('%s session failed: %s', name, ex, exc_info=True)
+                results[name] = None
+    log.info('account sessions finished: %s', results)
+    return results
@@ -0,0 +1,94 @@
+import logging
+import math
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Callable
+
+from config import Settings
+from dal import load_follower_weights, record_interaction
+
+log = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+
+class FollowerSampler:
+    '''
+    Weighted follower picks without reloading or shuffling the follower table.
+    Ids and cumulative weights are cached in compact arrays, a draw is a
+    bisect, so picking k followers costs O(k log n). The weight grows with the
+    days since we last interacted (capped) and gets a bonus for recent
+    follow-backs, anyone interacted with inside the cooldown is skipped.
+    '''
+
+    def __init__(self, settings: Settings, clock: Callable[[], float] = time.time):
+        self.cooldown = settings.follower_cooldown
+        self.refresh_after = settings.follower_sample_refresh
+        self.idle_cap_days = settings.follower_idle_cap_days
+        self.recent_bonus = settings.follower_recent_bonus
+        self.clock = clock
+        self.ids = []
+        self.usernames = []
+        self.cumulative = array('d')
+        self.last_interacted = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def weight(self, followed_at: float, last_interacted_at: float, now: float) -> float:
+        idle_days = (now - (last_interacted_at or followed_at or now)) / DAY
+        follow_age_days = (now - (followed_at or now)) / DAY
+        return 1.0 + min(max(idle_days, 0.0), self.idle_cap_days) + self.recent_bonus * math.exp(-max(follow_age_days, 0.0) / 30)
+
+    def load(self):
+        now = self.clock()
+        rows = load_follower_weights()
+        self.ids = [row[0] for row in rows]
+        self.usernames = [row[1] for row in rows]
+        self.cumulative = array('d', accumulate(self.weight(row[2], row[3], now) for row in rows))
+        self.last_interacted = {row[0]: row[3] for row in rows if row[3]}
+        self.loaded_at = now
+        log.info('loaded %s followers for sampling', len(self.ids))
+
+    def sample(self, k: int) -> list:
+        '''returns up to k distinct (id, username) tuples outside the cooldown'''
+        with self._lock:
+            if self.loaded_at is None or self.clock() - self.loaded_at > self.refresh_after:
+                self.load()
+            if not self.ids:
+                return []
+            now = self.clock()
+            total = self.cumulative[-1]
+            picked = {}
+            for _ in range(k * 10):
+                if len(picked) == k:
+                    break
+                index = min(bisect_right(self.cumulative, random.random() * total), len(self.ids) - 1)
+                id = self.ids[index]
+                if id in picked or now - self.last_interacted.get(id, -math.inf) < self.cooldown:
+                    continue
+                picked[id] = (id, self.usernames[index])
+            return list(picked.values())
+
+    def record_interaction(self, id: str):
+        now = self.clock()
+        with self._lock:
+            self.last_interacted[id] = now
+        record_interaction(id, now)
+
+
+_samplers = {}
+
+
+def get_follower_sampler(settings: Settings) -> FollowerSampler:
+    key = (settings.base_url, settings.account_id)
+    if key not in _samplers:
+        _samplers[key] = FollowerSampler(settings)
+    return _samplers[key]
+
+
+def reset():
+    _samplers.clear()
@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from cache import get_relationship_cache
+from config import Settings
+from dal import load_follow_outcomes, load_unbucketed_follows, record_follows
+
+log = logging.getLogger(__name__)
+
+# following/followers ratio and follower count bounds of the account buckets
+RATIO_BOUNDS = (0.5, 1.0, 2.0)
+SIZE_BOUNDS = (100, 500, 2000)
+
+
+def bucket(followers_count: int, following_count: int) -> str:
+    '''e.g. "r2:s0": follows 1-2x as many accounts as follow it, under 100 followers'''
+    if followers_count is None or following_count is None:
+        return 'unknown'
+    ratio = following_count / max(followers_count, 1)
+    r = sum(ratio >= bound for bound in RATIO_BOUNDS)
+    s = sum(followers_count >= bound for bound in SIZE_BOUNDS)
+    return f'r{r}:s{s}'
+
+
+@dataclass(slots=True)
+class Candidate:
+    id: str
+    account: dict
+    source: str
+    seen_at: float
+
+
+class FollowScorer:
+    '''
+    Ranks follow candidates from every timeline by expected follow backs
+    per api call. The follow back rate of the candidate's bucket comes from
+    follow_outcomes (kept current by a relationships trigger as follow backs
+    are synced), pulled toward the overall rate so thin buckets don't swing.
+    It is weighted by source and decays with the time since the candidate
+    was seen, then divided by the requests a follow would still cost.
+    '''
+
+    def __init__(self, settings: Settings, clock: Callable[[], float] = time.time):
+        self.settings = settings
+        self.prior_weight = settings.score_prior_weight
+        self.default_rate = settings.score_default_rate
+        self.half_life = settings.score_half_life
+        self.max_age = settings.score_max_age
+        self.pool_size = settings.score_pool_size
+        self.refresh_after = settings.score_refresh
+        self.source_weights = settings.score_source_weights
+        self.clock = clock
+        self.outcomes = {}
+        self.overall_rate = self.default_rate
+        self.pool = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''count follows made before scoring existed once, then read the per bucket outcomes'''
+        backlog = load_unbucketed_follows()
+        if backlog:
+            record_follows((id, bucket(followers, following)) for id, followers, following, _ in backlog)
+            log.info('counted %s earlier follows into follow outcomes', len(backlog))
+        self.outcomes = load_follow_outcomes()
+        follows = sum(f for f, _ in self.outcomes.values())
+        follow_backs = sum(b for _, b in self.outcomes.values())
+        self.overall_rate = (follow_backs + self.default_rate * self.prior_weight) / (follows + self.prior_weight)
+        self.loaded_at = self.clock()
+        log.info('loaded follow outcomes for %s buckets, overall follow back rate %.3f', len(self.outcomes), self.overall_rate)
+
+    def follow_back_rate(self, key: str) -> float:
+        follows, follow_backs = self.outcomes.get(key, (0, 0))
+        return (follow_backs + self.overall_rate * self.prior_weight) / (follows + self.prior_weight)
+
+    def api_calls(self, candidate: Candidate) -> int:
+        ''' the follow itself, plus the relationship and account lookups follow_user can't skip '''
+        calls = 1
+        if not get_relationship_cache(self.settings).get(candidate.id)[1]:
+            calls += 1
+        if candidate.account.get('followers_count') is None or candidate.account.get('following_count') is None:
+            calls += 1
+        return calls
+
+    def score(self, candidate: Candidate, now: float) -> float:
+        rate = self.follow_back_rate(bucket(candidate.account.get('followers_count'), candidate.account.get('following_count')))
+        decay = 0.5 ** (max(now - candidate.seen_at, 0.0) / self.half_life)
+        return rate * self.source_weights.get(candidate.source, 1.0) * decay / self.api_calls(candidate)
+
+    def offer(self, accounts: Iterable[dict], source: str):
+        '''add (or refresh) candidates, `accounts` are the account objects embedded in a page'''
+        now = self.clock()
+        with self._lock:
+            for account in accounts:
+                id = str(account['id'])
+                previous = self.pool.get(id)
+                # keep the higher weighted source this account was offered from
+                best = source
+                if previous and self.source_weights.get(previous.source, 1.0) > self.source_weights.get(source, 1.0):
+                    best = previous.source
+                self.pool[id] = Candidate(id, account, best, now)
+            if len(self.pool) > self.pool_size:
+                # keep the newest pool_size candidates
+                newest = sorted(self.pool.values(), key=lambda c: c.seen_at, reverse=True)[:self.pool_size]
+                self.pool = {c.id: c for c in newest}
+
+    def take(self, n: int = 1) -> list:
+        '''remove and return the n best candidates, best first'''
+        with self._lock:
+            now = self.clock()
+            if self.loaded_at is None or now - self.loaded_at > self.refresh_after:
+                self.load()
+            relationships = get_relationship_cache(self.settings)
+            for id, candidate in list(self.pool.items()):
+                relationship, _ = relationships.get(id)
+                if now - candidate.seen_at > self.max_age or relationships.is_ignored(id) or (relationship and relationship.following):
+                    del self.pool[id]
+            ranked = sorted(self.pool.values(), key=lambda c: self.score(c, now), reverse=True)[:max(n, 0)]
+            for candidate in ranked:
+                del self.pool[candidate.id]
+            return ranked
+
+    def record_follow(self, id: str, followers_count: int, following_count: int):
+        key = bucket(followers_count, following_count)
+        record_follows([(id, key)])
+        with self._lock:
+            follows, follow_backs = self.outcomes.get(key, (0, 0))
+            self.outcomes[key] = (follows + 1, follow_backs)
+
+
+_scorers = {}
+
+
+def get_follow_scorer(settings: Settings) -> FollowScorer:
+    key = (settings.base_url, settings.account_id)
+    if key not in _scorers:
+        _scorers[key] = FollowScorer(settings)
+    return _scorers[key]
+
+
+def reset():
+    _scorers.clear()
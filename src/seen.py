@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterable
+
+import dal
+from config import Settings
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<4sHHQQd')
+MAGIC = b'PFBF'
+VERSION = 1
+
+
+class BloomFilter:
+    '''
+    Bloom filter kept in a memory mapped file, so lookups touch only the
+    pages they need and nothing is loaded up front.
+    Header: magic, version, hash count, bit count, items added, created epoch.
+    '''
+
+    def __init__(self, path: str, capacity: int, error_rate: float):
+        self.path = path
+        if not os.path.exists(path):
+            self._create(path, capacity, error_rate)
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, self.hashes, self.bits, _, self.created = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a bloom filter file')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _create(path: str, capacity: int, error_rate: float):
+        bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, hashes, bits, 0, time.time()))
+            f.truncate(HEADER.size + math.ceil(bits / 8))
+
+    @property
+    def count(self) -> int:
+        return HEADER.unpack_from(self._map, 0)[4]
+
+    def _positions(self, key: str) -> list:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        data = self._map
+        offset = HEADER.size
+        return all(data[offset + (p >> 3)] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key: str) -> bool:
+        '''returns True if the key was not in the filter yet'''
+        offset = HEADER.size
+        added = False
+        with self._lock:
+            for p in self._positions(key):
+                index = offset + (p >> 3)
+                bit = 1 << (p & 7)
+                if not self._map[index] & bit:
+                    self._map[index] |= bit
+                    added = True
+            # count every insert, a key that collided still uses up capacity
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.hashes, self.bits, self.count + 1, self.created)
+        return added
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class SeenIndex:
+    '''
+    Remembers which status ids were already looked at.
+    Two bloom generations answer "definitely not seen" straight from the mmap,
+    a maybe is confirmed against the seen_status table. Once the current
+    generation holds `capacity` ids it becomes the previous one, the old
+    previous generation is dropped together with its rows, which keeps the
+    false positive rate and the table size bounded.
+    '''
+
+    def __init__(self, directory: str, capacity: int, error_rate: float):
+        self.directory = directory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        os.makedirs(directory, exist_ok=True)
+        self.current = self._open('current.bloom')
+        previous = os.path.join(directory, 'previous.bloom')
+        self.previous = BloomFilter(previous, capacity, error_rate) if os.path.exists(previous) else None
+        self._lock = threading.Lock()
+
+    def _open(self, name: str) -> BloomFilter:
+        return BloomFilter(os.path.join(self.directory, name), self.capacity, self.error_rate)
+
+    def might_contain(self, id: str) -> bool:
+        return id in self.current or (self.previous is not None and id in self.previous)
+
+    def is_seen(self, id) -> bool:
+        if id is None:
+            return False
+        id = str(id)
+        if not self.might_contain(id):
+            return False
+        return bool(dal.find_seen_status([id]))
+
+    def mark_seen(self, ids: Iterable):
+        ids = [str(id) for id in ids if id is not None]
+        if not ids:
+            return
+        dal.save_seen_status(ids)
+        with self._lock:
+            for id in ids:
+                self.current.add(id)
+            self.current.flush()
+            if self.current.count >= self.capacity:
+                self.rotate()
+
+    def rotate(self):
+        log.info('rotating seen index after %s ids', self.current.count)
+        if self.previous is not None:
+            # rows from before the current generation only lived in the dropped one
+            dal.prune_seen_status(self.current.created)
+            self.previous.close()
+        self.current.close()
+        os.replace(os.path.join(self.directory, 'current.bloom'), os.path.join(self.directory, 'previous.bloom'))
+        self.previous = self._open('previous.bloom')
+        self.current = self._open('current.bloom')
+
+    def close(self):
+        self.current.close()
+        if self.previous is not None:
+            self.previous.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_seen_index(settings: Settings) -> SeenIndex:
+    '''one index per database, stored next to it'''
+    directory = f'{os.path.splitext(dal.current_db_path())[0]}.seen'
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = SeenIndex(directory, settings.seen_index_capacity, settings.seen_index_error_rate)
+        return _indexes[directory]
+
+
+def reset():
+    with _indexes_lock:
+        for index in _indexes.values():
+            index.close()
+        _indexes.clear()
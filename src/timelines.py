@@ -1,23 +1,29 @@
 import logging
-import requests
 import random
+from typing import Iterator
+from urllib.parse import parse_qs, urlparse
 
-from config import Settings
-from utils import random_time
+import client
+from config import PixelFedBotException, Settings
+from dal import get_sync_state, save_sync_state
+from decoder import decode, iter_items
+from metrics import instrument
+from pacing import throttle
 
 log = logging.getLogger(__name__)
 
 
-def get_timeline_url(timeline_type: str, settings: Settings, id: str = None) -> tuple:
+def get_timeline_url(timeline_type: str, settings: Settings, id: str | list = None) -> tuple:
     timeline_base = f'{settings.base_url}{settings.api_version}timelines'
     if timeline_type == 'account':
         return (f'{settings.base_url}{settings.api_version}accounts/{id}', timeline_type)
     if timeline_type == 'global':
-        return (f'{timeline_base}/public?min_id=1&limit=6&_pe=1&remote=true', timeline_type)
+        return (f'{timeline_base}/public?limit=6&_pe=1&remote=true', timeline_type)
     if timeline_type == 'notifications':
         return (f'{settings.base_url}{settings.api_version}{timeline_type}', timeline_type)
     if timeline_type == 'relationships':
-        return (f'{settings.base_url}{settings.api_version}accounts/{timeline_type}?id[]={id}', timeline_type)
+        ids = '&'.join(f'id[]={i}' for i in ([id] if isinstance(id, str) else id))
+        return (f'{settings.base_url}{settings.api_version}accounts/{timeline_type}?{ids}', timeline_type)
     if timeline_type == 'follow':
         return (f'{settings.base_url}{settings.api_version}accounts/{id}/{timeline_type}', timeline_type)
     if timeline_type == 'unfollow':
@@ -25,30 +31,170 @@ def get_timeline_url(timeline_type: str, settings: Settings, id: str = None) ->
     if timeline_type == 'followers':
         return (f'{settings.base_url}{settings.api_version}accounts/{settings.account_id}/{timeline_type}', timeline_type)
     if timeline_type == 'following':
-        return (f'{settings.base_url}{settings.api_version}accounts/{settings.account_id}/{timeline_type}?limit=50', timeline_type)
+        return (f'{settings.base_url}{settings.api_version}accounts/{settings.account_id}/{timeline_type}', timeline_type)
     if timeline_type == 'tag':
         random.shuffle(settings.tags)
         return (f'{timeline_base}/{timeline_type}/{settings.tags[0]}', settings.tags[0])
     return (f'{timeline_base}/{timeline_type}', timeline_type)
 
 
-def get_timeline(url: str, settings: Settings, timeline_type: str = 'home', limit: int = 10) -> dict:
-    log.info(f'getting timeline {timeline_type} @ {url}')
+def timeline_params(url: str, timeline_type: str, limit: int, params: dict = None) -> dict:
     limit = 50 if 'tag' in url or timeline_type in ['followers', 'following'] else limit
-    params = {
+    return {
         "limit": limit,
+        **(params or {})
     }
-    random_time()
-    response = requests.get(url, headers=settings.headers, params=params)
+
+
+@instrument
+def get_timeline(url: str, settings: Settings, timeline_type: str = 'home', limit: int = 10, pace: bool = True,
+                 params: dict = None) -> dict:
+    log.info('getting timeline %s @ %s', timeline_type, url)
+    params = timeline_params(url, timeline_type, limit, params)
+    if pace:
+        throttle(settings, 'read')
+    response = client.get(url, settings, params=params)
     if response.status_code == 200:
         log.info('Response successful')
-        return response.json()
+        return decode(response, timeline_type)
     else:
-        log.info(f"Failed to fetch data. Status code: {response.status_code}")
+        log.info('Failed to fetch data. Status code: %s', response.status_code)
+        return {}
+
+
+def stream_timeline(url: str, settings: Settings, timeline_type: str = 'home', limit: int = 10, pace: bool = True,
+                    params: dict = None) -> Iterator[dict]:
+    """
+    Like get_timeline, but yields the trimmed items one at a time while the
+    body is still arriving. Closing the generator early stops reading and
+    drops the connection instead of downloading the rest of the page.
+    """
+    log.info('streaming timeline %s @ %s', timeline_type, url)
+    params = timeline_params(url, timeline_type, limit, params)
+    if pace:
+        throttle(settings, 'read')
+    response = client.get(url, settings, params=params, stream=True)
+    try:
+        if response.status_code != 200:
+            log.info('Failed to fetch data. Status code: %s', response.status_code)
+            return
+        yield from iter_items(response, timeline_type, settings.stream_chunk_size)
+    finally:
+        response.close()
+
+
+def high_water_mark_key(url_args: tuple) -> str:
+    if '/timelines/tag/' in url_args[0]:
+        return f'since:tag:{url_args[1]}'
+    return f'since:{url_args[1]}'
+
+
+def newest_id(items: list) -> str:
+    # ids are snowflake style numeric strings, longer means newer
+    ids = [str(item['id']) for item in items if 'id' in item]
+    return max(ids, key=lambda id: (len(id), id)) if ids else None
+
+
+def get_new_timeline(url_args: tuple, settings: Settings, pace: bool = True) -> list:
+    """
+    Fetch only what arrived since the last call for this timeline (or tag),
+    using the high-water mark kept in sync_state as since_id (min_id for global).
+    """
+    server_response, mark = fetch_new_timeline(url_args, settings, pace)
+    advance_high_water_mark(*mark)
+    return server_response
+
+
+def fetch_new_timeline(url_args: tuple, settings: Settings, pace: bool = True) -> tuple:
+    """
+    get_new_timeline without moving the high-water mark. Returns (server_response, mark),
+    pass mark to advance_high_water_mark once the batch has been used.
+    """
+    key = high_water_mark_key(url_args)
+    since_id = get_sync_state(key)
+    server_response = get_timeline(url=url_args[0], settings=settings, timeline_type=url_args[1], pace=pace,
+                                   params=since_params(url_args, since_id))
+    log.info('%s new items on %s since %s', len(server_response), url_args[1], since_id)
+    return server_response, (key, since_id, newest_id(server_response) if server_response else None)
+
+
+def stream_new_timeline(url_args: tuple, settings: Settings, pace: bool = True) -> Iterator[dict]:
+    """
+    Streaming get_new_timeline. The high-water mark moves to the newest item
+    actually read, when the stream is exhausted or closed.
+    """
+    key = high_water_mark_key(url_args)
+    since_id = get_sync_state(key)
+    latest, count = None, 0
+    try:
+        for item in stream_timeline(url_args[0], settings, timeline_type=url_args[1], pace=pace,
+                                    params=since_params(url_args, since_id)):
+            count += 1
+            latest = newest_id([item] + ([{'id': latest}] if latest else []))
+            yield item
+    finally:
+        advance_high_water_mark(key, since_id, latest)
+        log.info('read %s new items on %s since %s', count, url_args[1], since_id)
+
+
+def since_params(url_args: tuple, since_id: str) -> dict:
+    if not since_id:
         return {}
+    return {'min_id' if url_args[1] == 'global' else 'since_id': since_id}
 
 
+def advance_high_water_mark(key: str, since_id: str, latest: str):
+    if latest and (since_id is None or newest_id([{'id': since_id}, {'id': latest}]) == latest):
+        save_sync_state(key, latest)
+
+
+@instrument
 def post_timeline(url: str, settings: Settings, timeline_type: str) -> dict:
-    log.info(f'posting timeline {timeline_type} @ {url}')
-    random_time()
-    return requests.post(url, headers=settings.headers)
+    log.info('posting timeline %s @ %s', timeline_type, url)
+    throttle(settings, 'follow')
+    return client.post(url, settings)
+
+
+def paginate(url: str, settings: Settings, max_id: str = None, limit: int = 40, pace: bool = True,
+             kind: str = 'followers') -> Iterator[tuple]:
+    """
+    Walk a paginated endpoint one page at a time.
+    Follows the Link rel="next" header and falls back to the last item id as max_id.
+    `kind` picks how items are trimmed, see decoder.COMPACTORS.
+    Yields:
+        (page, next_max_id) where next_max_id is None on the last page
+    Raises:
+        PixelFedBotException on a failed page, so a caller can't mistake it for the last one
+    """
+    while True:
+        params = {"limit": limit}
+        if max_id:
+            params["max_id"] = max_id
+        log.info('getting page @ %s max_id: %s', url, max_id)
+        if pace:
+            throttle(settings, 'read')
+        response = client.get(url, settings, params=params, stream=True)
+        try:
+            if response.status_code != 200:
+                raise PixelFedBotException(f'failed to fetch page @ {url} max_id: {max_id}, status code: {response.status_code}')
+            # items are trimmed as they are decoded, the raw page body is never held in full
+            page = list(iter_items(response, kind, settings.stream_chunk_size))
+        finally:
+            response.close()
+        if not page:
+            return
+        max_id = next_page_max_id(response, page)
+        yield page, max_id
+        if max_id is None:
+            return
+
+
+def next_page_max_id(response, page: list) -> str:
+    next_link = response.links.get('next')
+    if next_link:
+        query = parse_qs(urlparse(next_link['url']).query)
+        return query.get('max_id', [None])[0]
+    if 'link' in response.headers:
+        # server paginates with Link headers and sent no next page
+        return None
+    return page[-1].get('id')
@@ -1,7 +1,71 @@
+import gzip
+import json
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from main import settings  # Import settings from main
 from config import Settings  # Import Settings from config
+import cache
+import dal
+import metrics
+import pacing
+import sampling
+import scoring
+import seen
+from models import Account, RelationshipStatus
+
+
+class FakeClock:
+    '''a clock the test moves by hand, usable as both clock and sleep'''
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def account_json(id="2", followers_count=10, following_count=20, **fields):
+    return {
+        "id": id, "username": f"user{id}", "acct": f"user{id}", "display_name": f"User {id}",
+        "followers_count": followers_count, "following_count": following_count, "statuses_count": 3, **fields
+    }
+
+
+def make_account(id, followers_count=10):
+    return Account(
+        id=id, username=f'user{id}', acct=f'user{id}', display_name=f'User {id}',
+        followers_count=followers_count, following_count=5, statuses_count=1,
+        created_at=datetime.now(), last_updated=datetime.now()
+    )
+
+
+def make_relationship(id, following=False, followed_by=False):
+    return RelationshipStatus(
+        id=id, following=following, followed_by=followed_by, blocking=False,
+        muting=False, muting_notifications=None, requested=False,
+        domain_blocking=None, showing_reblogs=True, endorsed=False
+    )
+
+
+def page_response(page, next_max_id=None, prev_only=False):
+    response = Mock()
+    response.status_code = 200
+    response.content = json.dumps(page).encode()
+    response.iter_content = lambda chunk_size: iter([response.content])
+    response.links = {}
+    response.headers = {"link": '<https://example.com/v1/accounts/4/followers?min_id=10>; rel="prev"'} if prev_only else {}
+    if next_max_id:
+        next_url = f"https://example.com/v1/accounts/4/followers?max_id={next_max_id}"
+        response.links = {"next": {"url": next_url, "rel": "next"}}
+        response.headers = {"link": f'<{next_url}>; rel="next"'}
+    return response
 
 
 @pytest.fixture
@@ -19,6 +83,20 @@ def mock_settings(monkeypatch):
     return mock_settings  # Return the mock_settings object
 
 
+@pytest.fixture(autouse=True)
+def test_db(tmp_path, monkeypatch):
+    # Keep every test on its own throwaway database
+    monkeypatch.setattr("dal.DB_PATH", str(tmp_path / "pixelfed.db"))
+    yield dal.DB_PATH
+    cache.reset()
+    metrics.reset()
+    pacing.reset()
+    sampling.reset()
+    scoring.reset()
+    seen.reset()
+    dal.close_connection()
+
+
 # Mock the `headers` attribute within `settings`
 @pytest.fixture
 def mock_headers(mock_settings):
@@ -69,3 +147,39 @@ def notification_sample_data():
         {'type': 'favourite', 'account': {'id': 9, 'name': 'user9'}},
         {'type': 'favourite', 'account': {'id': 10, 'name': 'user10'}},
     ]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self):
+        self.server.requests.append((self.command, self.path, self.client_address[1], dict(self.headers)))
+        body = json.dumps(self.server.payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    """Local http server recording (method, path, client port, headers) per request."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.payload = [{"id": "1", "favourited": False, "account": {"id": "2"}}]
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
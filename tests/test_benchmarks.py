@@ -0,0 +1,54 @@
+import threading
+
+import client
+import main
+import session_bench
+import startup_bench
+from config import Settings
+from mock_server import MockPixelfedServer
+
+
+def test_session_bench_reports_per_timeline(monkeypatch):
+    monkeypatch.setattr("main.settings", Settings())
+
+    results = session_bench.run(['home', 'notifications'], likes=3)
+
+    assert [r['timeline'] for r in results] == ['home', 'notifications']
+    for result in results:
+        assert result['likes'] >= 3
+        assert result['requests'] == sum(result['requests_by_route'].values())
+        assert result['requests_by_route']['favourite'] == result['likes']
+        assert result['db_queries'] > 0
+        assert result['peak_kib'] > 0
+        assert result['virtual_sleep_s'] > 0
+    assert main.settings.base_url.startswith('http://127.0.0.1')
+
+
+def test_sessions_on_one_db_end_once_nothing_is_left_to_like(monkeypatch, tmp_path):
+    monkeypatch.setattr("main.settings", Settings())
+    server = MockPixelfedServer().start()
+    try:
+        session_bench.prepare(server, str(tmp_path / "bench.db"), likes=15, follows=0)
+        likes = []
+        for _ in range(8):
+            # the marks, seen index and follower cooldown run dry after a few sessions
+            session = threading.Thread(target=lambda: likes.append(main.run_session('home')), daemon=True)
+            session.start()
+            session.join(timeout=10)
+            assert not session.is_alive(), f'session {len(likes)} did not end'
+    finally:
+        client.close_session()
+        server.stop()
+
+    assert likes[0] >= 15
+    assert likes[-1] == 0
+    assert server.counts['timeline'] < 100
+
+
+def test_startup_bench_cli_paths_skip_heavy_imports():
+    results = startup_bench.run(runs=1)
+
+    assert [r['command'] for r in results] == list(startup_bench.COMMANDS)
+    for result in results:
+        assert result['heavy'] == [], result['command']
+        assert result['median_ms'] > 0
@@ -0,0 +1,75 @@
+import threading
+
+import dal
+from cache import RelationshipCache, TTLCache
+from conftest import FakeClock, make_relationship
+
+
+def test_ttl_cache_marks_entries_stale():
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, max_size=5, clock=clock)
+    cache.put('a', 1)
+    assert cache.get('a') == (1, True)
+    clock.now = 11
+    assert cache.get('a') == (1, False)
+    assert cache.get('missing') == (None, False)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(ttl=10, max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_warm_loads_relationships_and_ignore_list(test_db):
+    dal.create_tables()
+    dal.save_relationships([make_relationship('1', following=True), make_relationship('2')])
+    dal.add_to_ignore('3')
+
+    cache = RelationshipCache(ttl=60, max_size=10)
+    cache.warm()
+
+    relationship, fresh = cache.get('1')
+    assert relationship.following is True
+    assert fresh is False
+    assert cache.is_ignored('3')
+    assert not cache.is_ignored('1')
+
+
+def test_ignore_list_falls_back_to_the_table_until_warmed(test_db):
+    dal.create_tables()
+    dal.add_to_ignore('3')
+    cache = RelationshipCache(ttl=60, max_size=10)
+    cache.ignore('4')
+
+    assert cache.is_ignored('3')
+    assert cache.is_ignored('4')
+    assert not cache.is_ignored('5')
+
+
+def test_revalidate_refreshes_in_background():
+    cache = RelationshipCache(ttl=60, max_size=10)
+    cache.put(make_relationship('1'), stale=True)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        release.wait(1)
+        calls.append('1')
+        return make_relationship('1', following=True)
+
+    cache.revalidate('1', loader)
+    cache.revalidate('1', loader)  # already pending, ignored
+    assert cache.get('1')[0].following is False
+    release.set()
+    cache.join()
+
+    relationship, fresh = cache.get('1')
+    assert relationship.following is True
+    assert fresh is True
+    assert calls == ['1']
@@ -0,0 +1,46 @@
+import pytest
+
+import client
+from config import Settings
+
+
+@pytest.fixture
+def stub_settings(stub_server):
+    settings = Settings()
+    settings.headers = {"Authorization": "Bearer mock_token"}
+    settings.base_url = f"http://127.0.0.1:{stub_server.server_port}/"
+    client.close_session()
+    yield settings
+    client.close_session()
+
+
+def test_get_reuses_pooled_connection(stub_server, stub_settings):
+    url = f"{stub_settings.base_url}api/v1/timelines/home"
+    for _ in range(3):
+        response = client.get(url, stub_settings, params={"limit": 10})
+        assert response.status_code == 200
+
+    assert len(stub_server.requests) == 3
+    # keep-alive: every request arrived over the same client socket
+    assert len({port for _, _, port, _ in stub_server.requests}) == 1
+
+
+def test_get_decodes_gzip_response(stub_server, stub_settings):
+    response = client.get(f"{stub_settings.base_url}api/v1/timelines/home", stub_settings)
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.json() == stub_server.payload
+
+
+def test_post_sends_auth_header(stub_server, stub_settings):
+    response = client.post(f"{stub_settings.base_url}api/v1/statuses/1/favourite", stub_settings)
+
+    assert response.status_code == 200
+    method, path, _, headers = stub_server.requests[0]
+    assert method == 'POST'
+    assert path == '/api/v1/statuses/1/favourite'
+    assert headers['Authorization'] == 'Bearer mock_token'
+
+
+def test_get_session_is_shared(stub_settings):
+    assert client.get_session(stub_settings) is client.get_session(stub_settings)
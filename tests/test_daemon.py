@@ -0,0 +1,99 @@
+from datetime import datetime, time, timedelta
+
+import pytest
+
+from daemon import Schedule, SessionScheduler, ShutdownRequested, parse_schedule
+
+
+class FakeNow:
+    def __init__(self, start):
+        self.current = start
+
+    def __call__(self):
+        return self.current
+
+    def waiter(self, scheduler):
+        '''stand in for Event.wait that moves the clock instead of blocking'''
+        def wait(timeout):
+            if not scheduler.stopping.is_set():
+                self.current += timedelta(seconds=timeout)
+            return scheduler.stopping.is_set()
+        return wait
+
+
+def make_schedule(start='08:00', end='22:00', interval=60):
+    return Schedule('home', timedelta(minutes=interval), time.fromisoformat(start), time.fromisoformat(end))
+
+
+def test_schedule_inside_window_runs_now():
+    schedule = make_schedule()
+    now = datetime(2026, 10, 17, 12, 0)
+    schedule.schedule_from(now)
+    assert schedule.next_run == now
+
+
+def test_schedule_outside_window_waits_for_next_start():
+    schedule = make_schedule()
+    schedule.schedule_from(datetime(2026, 10, 17, 23, 30))
+    assert schedule.next_run == datetime(2026, 10, 18, 8, 0)
+    schedule.schedule_from(datetime(2026, 10, 17, 6, 0))
+    assert schedule.next_run == datetime(2026, 10, 17, 8, 0)
+
+
+def test_schedule_window_wrapping_midnight():
+    schedule = make_schedule('22:00', '02:00')
+    assert schedule.in_window(datetime(2026, 10, 17, 23, 0))
+    assert schedule.in_window(datetime(2026, 10, 18, 1, 0))
+    assert not schedule.in_window(datetime(2026, 10, 17, 12, 0))
+
+
+def test_parse_schedule_defaults():
+    schedules = parse_schedule({'tag': {'interval': 30}}, datetime(2026, 10, 17, 12, 0))
+    assert schedules[0].interval == timedelta(minutes=30)
+    assert schedules[0].engine == 'sync'
+    assert schedules[0].next_run == datetime(2026, 10, 17, 12, 0)
+
+
+def test_scheduler_runs_due_sessions_and_reschedules():
+    now = FakeNow(datetime(2026, 10, 17, 12, 0))
+    runs = []
+    schedules = parse_schedule({
+        'home': {'interval': 60},
+        'notifications': {'interval': 90, 'engine': 'async'},
+    }, now())
+
+    def run_session(timeline_type, engine):
+        runs.append((timeline_type, engine))
+        now.current += timedelta(minutes=1)
+        if len(runs) == 3:
+            scheduler.stop()
+
+    scheduler = SessionScheduler(schedules, run_session, now=now)
+    scheduler.stopping.wait = now.waiter(scheduler)
+    assert scheduler.run() == 3
+    assert runs == [('home', 'sync'), ('notifications', 'async'), ('home', 'sync')]
+    # second home session started at 13:01 when it came due and ran for a minute
+    assert schedules[0].next_run == datetime(2026, 10, 17, 14, 2)
+
+
+def test_scheduler_sleep_raises_on_shutdown():
+    scheduler = SessionScheduler([], lambda t, e: 0)
+    scheduler.stop()
+    with pytest.raises(ShutdownRequested):
+        scheduler.sleep(60)
+
+
+def test_scheduler_survives_failed_session():
+    now = FakeNow(datetime(2026, 10, 17, 12, 0))
+    calls = []
+
+    def run_session(timeline_type, engine):
+        calls.append(timeline_type)
+        if len(calls) == 2:
+            scheduler.stop()
+        raise RuntimeError('instance down')
+
+    scheduler = SessionScheduler(parse_schedule({'home': {'interval': 1}}, now()), run_session, now=now)
+    scheduler.stopping.wait = now.waiter(scheduler)
+    assert scheduler.run() == 0
+    assert calls == ['home', 'home']
@@ -0,0 +1,204 @@
+import sqlite3
+
+import pytest
+
+import dal
+from conftest import make_account, make_relationship
+from migrations import MIGRATIONS, apply_migrations
+
+
+def test_connection_is_reused(test_db):
+    assert dal.get_connection() is dal.get_connection()
+
+
+def test_connection_pragmas(test_db):
+    conn = dal.get_connection()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    # NORMAL == 1
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+
+
+def test_connection_reopens_when_path_changes(tmp_path, monkeypatch):
+    first = dal.get_connection()
+    monkeypatch.setattr("dal.DB_PATH", str(tmp_path / "other.db"))
+    assert dal.get_connection() is not first
+
+
+def test_transaction_commits_nested_units_once(test_db):
+    dal.create_tables()
+    with dal.transaction() as conn:
+        dal.add_to_ignore('1')
+        dal.add_to_ignore('2')
+        assert conn.in_transaction
+    assert not dal.get_connection().in_transaction
+    with dal.create_connection() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM ignore_account')
+        assert cursor.fetchone()[0] == 2
+
+
+def test_transaction_rolls_back_on_error(test_db):
+    dal.create_tables()
+    with pytest.raises(RuntimeError):
+        with dal.transaction():
+            dal.add_to_ignore('1')
+            raise RuntimeError('boom')
+    with dal.create_connection() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM ignore_account')
+        assert cursor.fetchone()[0] == 0
+
+
+def test_reads_do_not_wait_for_another_writer(test_db, monkeypatch):
+    dal.create_tables()
+    dal.save_sync_state('sync:followers', '5')
+    monkeypatch.setattr('dal.BUSY_TIMEOUT', 0)
+    dal.close_connection()
+    writer = sqlite3.connect(test_db, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        assert dal.get_sync_state('sync:followers') == '5'
+        with pytest.raises(sqlite3.OperationalError):
+            dal.save_sync_state('sync:followers', '6')
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_save_relationships_counts_inserts_and_updates(test_db):
+    dal.create_tables()
+    assert dal.save_relationships([make_relationship('1'), make_relationship('2')]) == (2, 0)
+    assert dal.save_relationships([make_relationship('2', following=True), make_relationship('3')]) == (1, 1)
+
+    record = dal.get_relationship_record('2')
+    assert record.following is True
+    assert record.showing_reblogs is True
+    assert record.muting_notifications is None
+
+
+def test_save_relationships_empty(test_db):
+    dal.create_tables()
+    assert dal.save_relationships([]) == (0, 0)
+
+
+def test_upsert_looks_up_existing_ids_by_key(test_db):
+    dal.create_tables()
+    dal.save_relationships([make_relationship('1')])
+    statements = traced_statements(dal.save_relationships, [make_relationship('1'), make_relationship('2')])
+    lookup = [s for s in statements if 'COUNT(*)' in s]
+    assert len(lookup) == 1
+    assert 'USING COVERING INDEX sqlite_autoindex_relationships_1' in query_plan(lookup[0])
+
+
+def test_save_accounts_upserts_and_dedupes(test_db):
+    dal.create_tables()
+    accounts = (make_account(str(i)) for i in range(100))
+    assert dal.save_accounts(accounts) == (100, 0)
+    assert dal.save_accounts([make_account('5', 1), make_account('5', 42), make_account('200')]) == (1, 1)
+    with dal.create_connection() as cursor:
+        cursor.execute("SELECT followers_count FROM account WHERE id = '5'")
+        assert cursor.fetchone()[0] == 42
+
+
+def query_plan(statement):
+    with dal.create_connection() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {statement}')
+        return ' | '.join(row[3] for row in cursor.fetchall())
+
+
+def traced_statements(func, *args):
+    statements = []
+    dal.trace_callback = statements.append
+    dal.close_connection()
+    try:
+        func(*args)
+    finally:
+        dal.trace_callback = None
+        dal.close_connection()
+    return statements
+
+
+def test_create_tables_applies_migrations_once(test_db):
+    dal.create_tables()
+    dal.create_tables()
+    with dal.create_connection() as cursor:
+        cursor.execute('SELECT version FROM schema_version ORDER BY version')
+        assert [row[0] for row in cursor.fetchall()] == [version for version, _, _ in MIGRATIONS]
+
+
+def test_legacy_tables_are_copied(test_db):
+    with dal.create_connection() as cursor:
+        cursor.execute('CREATE TABLE following (id TEXT, username TEXT, acct TEXT, display_name TEXT, '
+                       'followers_count INTEGER, following_count INTEGER, created_at DATETIME, last_updated DATETIME)')
+        cursor.execute('CREATE TABLE followers (id TEXT, username TEXT, last_updated DATETIME)')
+        cursor.execute("INSERT INTO following VALUES ('1', 'one', 'one', 'One', 5, 6, '2024-01-01', '2024-01-01')")
+        cursor.execute("INSERT INTO followers VALUES ('2', 'two', '2024-01-01')")
+    dal.create_tables()
+    assert dal.get_relationship_record('1').following is True
+    assert dal.get_relationship_record('2').followed_by is True
+
+
+def test_legacy_tables_do_not_overwrite_current_rows(test_db):
+    dal.create_tables()
+    dal.save_accounts([make_account('1', followers_count=50)])
+    dal.save_relationships([make_relationship('1', following=True, followed_by=True)])
+    with dal.create_connection() as cursor:
+        cursor.execute('DELETE FROM schema_version')
+        cursor.execute('CREATE TABLE following (id TEXT, username TEXT, acct TEXT, display_name TEXT, '
+                       'followers_count INTEGER, following_count INTEGER, created_at DATETIME, last_updated DATETIME)')
+        cursor.execute('CREATE TABLE followers (id TEXT, username TEXT, last_updated DATETIME)')
+        cursor.execute("INSERT INTO followers VALUES ('1', 'user1', '2024-01-01')")
+        cursor.execute("INSERT INTO following VALUES ('3', 'three', 'three', 'Three', 5, 6, '2024-01-01', '2024-01-01')")
+        cursor.execute("INSERT INTO followers VALUES ('3', 'three', '2024-01-01')")
+    with dal.create_connection() as cursor:
+        apply_migrations(cursor, MIGRATIONS[:1])
+
+    current = dal.get_relationship_record('1')
+    assert (current.following, current.followed_by) == (True, True)
+    assert dal.load_accounts(['1'])['1'].followers_count == 50
+    mutual = dal.get_relationship_record('3')
+    assert (mutual.following, mutual.followed_by) == (True, True)
+    assert dal.load_accounts(['3'])['3'].followers_count == 5
+
+
+def test_follow_count_index_is_dropped(test_db):
+    dal.create_tables()
+    with dal.create_connection() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_relationships_%'")
+        assert sorted(row[0] for row in cursor.fetchall()) == ['idx_relationships_followed_at', 'idx_relationships_followed_by']
+
+
+def test_count_todays_records_uses_index(test_db):
+    dal.create_tables()
+    statement = [s for s in traced_statements(dal.count_todays_records) if 'COUNT(*)' in s][0]
+    assert 'USING COVERING INDEX idx_relationships_followed_at' in query_plan(statement)
+
+
+def test_count_todays_records_counts_last_week(test_db):
+    dal.create_tables()
+    dal.save_relationships([make_relationship('1', following=True), make_relationship('2', following=True)])
+    dal.mark_followed('1')
+    dal.mark_followed('2')
+    with dal.create_connection() as cursor:
+        cursor.execute("UPDATE relationships SET followed_at = DATETIME('now', '-30 days') WHERE id = '2'")
+    assert dal.count_todays_records() == 1
+
+
+def test_synced_following_is_not_counted_as_follows(test_db):
+    dal.create_tables()
+    dal.mark_relationships([str(i) for i in range(100)], 'following')
+    assert dal.count_todays_records() == 0
+
+
+def test_load_followers_uses_index(test_db):
+    dal.create_tables()
+    statement = [s for s in traced_statements(dal.load_followers) if 'followed_by' in s][0]
+    plan = query_plan(statement)
+    assert 'idx_relationships_followed_by' in plan
+    assert 'LIST SUBQUERY' not in plan
+
+
+def test_load_followers_skips_ignored(test_db):
+    dal.create_tables()
+    dal.save_accounts([make_account('1'), make_account('2')])
+    dal.mark_relationships(['1', '2'], 'followed_by')
+    dal.add_to_ignore('2')
+    assert dal.load_followers() == [('1', 'user1')]
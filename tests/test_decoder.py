@@ -0,0 +1,96 @@
+import dataclasses
+import json
+from unittest.mock import Mock
+
+import pytest
+
+import decoder
+from config import PixelFedBotException
+from conftest import account_json
+from models import map_account
+
+
+# api fields the decoder drops
+PROFILE = {"note": "<p>long bio</p>", "avatar": "https://example.com/a.jpg", "fields": [{"name": "site", "value": "x"}]}
+
+
+def status_json(id="1"):
+    return {
+        "id": id, "favourited": False, "content": "<p>a post</p>", "created_at": "2024-01-01T00:00:00Z",
+        "media_attachments": [{"id": "9", "url": "https://example.com/p.jpg", "meta": {"width": 1080}}],
+        "tags": [{"name": "pnw"}], "account": account_json(**PROFILE),
+    }
+
+
+def response(payload):
+    return Mock(content=json.dumps(payload).encode())
+
+
+def test_decode_statuses_keeps_only_used_fields():
+    assert decoder.decode(response([status_json()])) == [{
+        "id": "1", "favourited": False,
+        "account": {
+            "id": "2", "username": "user2", "acct": "user2", "display_name": "User 2",
+            "followers_count": 10, "following_count": 20, "statuses_count": 3,
+        },
+    }]
+
+
+def test_decode_notifications():
+    notification = {"id": "5", "type": "favourite", "created_at": "2024-01-01", "account": account_json(**PROFILE), "status": status_json()}
+    decoded = decoder.decode(response([notification]), "notifications")[0]
+    assert set(decoded) == {"id", "type", "account", "status"}
+    assert set(decoded["status"]) == {"id", "favourited", "account"}
+
+
+def test_decode_single_account_and_passthrough():
+    assert "note" not in decoder.decode(response(account_json(**PROFILE)), "account")
+    relationships = [{"id": "2", "following": True, "note": ""}]
+    assert decoder.decode(response(relationships), "relationship") == relationships
+    # error bodies and other non list payloads of a timeline come back untouched
+    assert decoder.decode(response({"error": "nope"})) == {"error": "nope"}
+
+
+def test_loads_falls_back_to_stdlib(monkeypatch):
+    monkeypatch.setattr(decoder, "orjson", None)
+    assert decoder.loads(b'[{"id": "1"}]') == [{"id": "1"}]
+
+
+def test_map_account_raises_on_malformed_payload():
+    with pytest.raises(PixelFedBotException, match="username"):
+        map_account({"id": "1"})
+    with pytest.raises(PixelFedBotException):
+        map_account({})
+
+
+def test_models_are_frozen_and_slotted():
+    account = map_account(account_json())
+    assert not hasattr(account, "__dict__")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        account.followers_count = 1
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64, 100000])
+def test_iter_json_array_across_chunk_boundaries(size):
+    payload = [status_json("1"), {"id": "2", "n": 1.5e3, "s": "café \\\" ]"}, 12, None, [1, [2]]]
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    chunks = (body[i:i + size] for i in range(0, len(body), size))
+
+    assert list(decoder.iter_json_array(chunks)) == payload
+
+
+def test_iter_json_array_ignores_non_array_and_rejects_truncated():
+    assert list(decoder.iter_json_array([b'{"error": "nope"}'])) == []
+    assert list(decoder.iter_json_array([b" [ ] "])) == []
+    with pytest.raises(ValueError):
+        list(decoder.iter_json_array([b'[{"id": "1"}, {"id"']))
+
+
+def test_iter_items_trims_each_item():
+    body = json.dumps([status_json("1"), status_json("2")]).encode()
+    streamed = Mock(iter_content=lambda chunk_size: iter([body[:50], body[50:]]))
+
+    items = list(decoder.iter_items(streamed, "home"))
+
+    assert [item["id"] for item in items] == ["1", "2"]
+    assert "content" not in items[0] and "note" not in items[0]["account"]
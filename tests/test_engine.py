@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+import dal
+import main
+from engine import gather_bounded, run_bounded
+
+
+def test_run_bounded_keeps_order_and_limit():
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def work(item):
+        with lock:
+            in_flight.append(item)
+            peak.append(len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.remove(item)
+        return item * 2
+
+    assert run_bounded(work, range(10), limit=3) == [i * 2 for i in range(10)]
+    assert max(peak) <= 3
+
+
+def test_gather_bounded_runs_concurrently():
+    start = time.perf_counter()
+    asyncio.run(gather_bounded(lambda _: time.sleep(0.05), range(4), limit=4))
+    assert time.perf_counter() - start < 0.15
+
+
+def test_prefetch_session_fetches_timelines_and_statuses(mocker, mock_settings):
+    notifications = [{'type': 'favourite', 'account': {'id': '7'}}]
+    mock_get_timeline = mocker.patch(
+        "main.fetch_new_timeline",
+        side_effect=lambda url_args, settings, pace: (notifications if url_args[1] == 'notifications' else [], None)
+    )
+    mock_get_status = mocker.patch("main.get_status_by_id", side_effect=lambda id, limit, follower, pace: [{'id': id}])
+    mocker.patch("main.get_random_followers", return_value=[('9', 'follower9')])
+
+    timelines, statuses, followers = asyncio.run(main.prefetch_session('home'))
+
+    assert [url_args[1] for url_args, _, _ in timelines][0] == 'home'
+    assert len(timelines) == len(main.timeline_types)
+    assert all(call.kwargs['pace'] is False for call in mock_get_timeline.call_args_list)
+    assert statuses == {'7': [{'id': '7'}], '9': [{'id': '9'}]}
+    assert followers == [('9', 'follower9')]
+    assert mock_get_status.call_count == 2
+
+
+def test_async_session_only_advances_the_marks_of_handled_timelines(mocker, mock_settings):
+    dal.create_tables()
+    mock_settings.likes_per_session = 1
+    mocker.patch(
+        "main.fetch_new_timeline",
+        side_effect=lambda url_args, settings, pace: ([{'id': '5', 'type': 'mention'}], (f'since:{url_args[1]}', None, '5'))
+    )
+    mocker.patch("main.get_random_followers", return_value=[])
+    mocker.patch("main.check_follow_count", return_value=False)
+    handle = mocker.patch("main.handle_timeline", return_value=1)
+
+    assert main._run_async_session('home') == 1
+
+    handle.assert_called_once()
+    assert dal.get_sync_state('since:home') == '5'
+    assert [t for t in main.timeline_types if dal.get_sync_state(f'since:{t}')] == ['home']
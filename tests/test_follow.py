@@ -0,0 +1,207 @@
+from dataclasses import replace
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+import dal
+from cache import get_relationship_cache
+from config import PixelFedBotException
+from conftest import account_json, page_response
+from follow import (
+    follow_candidates,
+    follow_user,
+    get_account_details,
+    prefetch_accounts,
+    resolve_relationships,
+    sync_relationship_list
+)
+from metrics import get_metrics
+from models import map_account, map_relationship
+
+
+def test_sync_relationship_list_streams_pages_into_db(mocker, mock_settings):
+    dal.create_tables()
+    pages = [([account_json("3"), account_json("2")], "2"), ([account_json("1")], None)]
+    mocker.patch("follow.paginate", return_value=iter(pages))
+
+    assert sync_relationship_list(mock_settings, "followers") == 3
+    assert sorted(id for id, _ in dal.load_followers()) == ["1", "2", "3"]
+    assert dal.get_sync_state("sync:followers") is None
+    assert dal.get_sync_state("synced:followers") is not None
+    # the first complete sync finds followers rather than gaining them
+    assert dal.sum_daily_stats("9999-12-31") == {"followers_found": 3}
+
+
+def test_sync_relationship_list_resumes_from_saved_cursor(mocker, mock_settings):
+    dal.create_tables()
+
+    def interrupted(url, settings, max_id, limit, kind):
+        yield [account_json("3")], "3"
+        raise ConnectionError("network down")
+
+    mocker.patch("follow.paginate", side_effect=interrupted)
+    with pytest.raises(ConnectionError):
+        sync_relationship_list(mock_settings, "following")
+    assert dal.get_sync_state("sync:following") == "3"
+    assert dal.get_relationship_record("3").following is True
+
+    resumed = mocker.patch("follow.paginate", return_value=iter([([account_json("2")], None)]))
+    assert sync_relationship_list(mock_settings, "following") == 1
+    assert resumed.call_args.kwargs["max_id"] == "3"
+    assert dal.get_sync_state("sync:following") is None
+
+
+def test_sync_relationship_list_keeps_its_cursor_when_a_page_fails(mocker, mock_settings):
+    dal.create_tables()
+    mocker.patch("timelines.throttle")
+    mocker.patch("client.get", side_effect=[
+        page_response([account_json("3"), account_json("2")], next_max_id="2"), Mock(status_code=429)
+    ])
+
+    with pytest.raises(PixelFedBotException, match="429"):
+        sync_relationship_list(mock_settings, "followers")
+    assert dal.get_sync_state("sync:followers") == "2"
+    assert dal.get_sync_state("synced:followers") is None
+
+    resumed = mocker.patch("client.get", side_effect=[page_response([account_json("1")], prev_only=True)])
+    assert sync_relationship_list(mock_settings, "followers") == 1
+    assert resumed.call_args.kwargs["params"]["max_id"] == "2"
+    assert dal.get_sync_state("sync:followers") is None
+    assert dal.get_sync_state("synced:followers") is not None
+    assert sorted(id for id, _ in dal.load_followers()) == ["1", "2", "3"]
+
+
+def test_sync_relationship_list_unmarks_accounts_missing_from_a_complete_list(mocker, mock_settings):
+    dal.create_tables()
+    mocker.patch("follow.paginate", return_value=iter([([account_json("1"), account_json("2"), account_json("3")], None)]))
+    sync_relationship_list(mock_settings, "followers")
+
+    def interrupted(url, settings, max_id, limit, kind):
+        yield [account_json("1")], "1"
+        raise ConnectionError("network down")
+
+    mocker.patch("follow.paginate", side_effect=interrupted)
+    with pytest.raises(ConnectionError):
+        sync_relationship_list(mock_settings, "followers")
+    # the resumed sync still knows about the pages read before the interruption
+    mocker.patch("follow.paginate", return_value=iter([([account_json("4")], None)]))
+    sync_relationship_list(mock_settings, "followers")
+
+    assert sorted(id for id, _ in dal.load_followers()) == ["1", "4"]
+    assert dal.get_relationship_record("2").followed_by is False
+    assert dal.sum_daily_stats("9999-12-31") == {"followers_found": 3, "followers_gained": 1, "followers_lost": 2}
+
+
+def test_get_account_details_reads_through_account_table(mocker, mock_settings):
+    dal.create_tables()
+    fetch = mocker.patch("follow.get_timeline", return_value=account_json("5"))
+
+    first = get_account_details("5", mock_settings)
+    second = get_account_details("5", mock_settings)
+
+    assert fetch.call_count == 1
+    assert (second.followers_count, second.following_count) == (first.followers_count, first.following_count)
+
+
+def test_get_account_details_refreshes_stale_stats(mocker, mock_settings):
+    dal.create_tables()
+    stale = replace(map_account(account_json("5")), last_updated=datetime.now() - timedelta(seconds=mock_settings.account_max_age + 60))
+    dal.save_accounts([stale])
+    fetch = mocker.patch("follow.get_timeline", return_value={**account_json("5"), "followers_count": 99})
+
+    assert get_account_details("5", mock_settings).followers_count == 99
+    assert fetch.call_count == 1
+    assert dal.load_accounts(["5"])["5"].followers_count == 99
+
+
+def test_prefetch_accounts_only_fetches_missing(mocker, mock_settings):
+    dal.create_tables()
+    dal.save_accounts([map_account(account_json("1"))])
+    fetch = mocker.patch("follow.get_timeline", side_effect=lambda url, settings, timeline_type, pace: account_json(url.rsplit("/", 1)[1]))
+
+    accounts = prefetch_accounts(["1", "2", "3", "2"], mock_settings, pace=False)
+
+    assert sorted(accounts) == ["1", "2", "3"]
+    assert fetch.call_count == 2
+    assert sorted(dal.load_accounts(["1", "2", "3"])) == ["1", "2", "3"]
+
+
+def relationship_json(id, following=False):
+    return {
+        "id": id, "following": following, "followed_by": False, "blocking": False, "muting": False,
+        "muting_notifications": False, "requested": False, "domain_blocking": False,
+        "showing_reblogs": True, "endorsed": False, "note": ""
+    }
+
+
+def test_resolve_relationships_batches_uncached_ids(mocker, mock_settings):
+    dal.create_tables()
+    mock_settings.relationship_chunk_size = 2
+    get_relationship_cache(mock_settings).put(map_relationship(relationship_json("1", following=True)))
+    fetch = mocker.patch(
+        "follow.get_timeline",
+        side_effect=lambda url, settings, timeline_type, pace: [relationship_json(i.split("=")[1]) for i in url.split("?")[1].split("&")]
+    )
+
+    resolved = resolve_relationships(["1", "2", "3", "4", "2"], mock_settings, pace=False)
+
+    assert sorted(resolved) == ["1", "2", "3", "4"]
+    assert resolved["1"].following is True
+    assert fetch.call_count == 2
+    assert fetch.call_args_list[0].kwargs["url"].endswith("relationships?id[]=2&id[]=3")
+    assert dal.get_relationship_record("4") is not None
+    assert get_relationship_cache(mock_settings).get("3")[1] is True
+
+
+def status_json(account):
+    return {"id": f"s{account['id']}", "favourited": False, "account": account}
+
+
+def test_follow_candidates_rejects_on_embedded_counts_without_requests(mocker, mock_settings):
+    dal.create_tables()
+    get_relationship_cache(mock_settings).ignore("4")
+    fetch = mocker.patch("follow.get_timeline")
+    page = [
+        status_json({**account_json("1"), "followers_count": 50}),
+        status_json({**account_json("2"), "followers_count": 5}),
+        status_json({**account_json("3"), "followers_count": 50, "following_count": 500}),
+        status_json({**account_json("4"), "followers_count": 50}),
+        status_json({"id": "5"}),
+    ]
+
+    assert follow_candidates(["1", "2", "3", "4", "5"], mock_settings, page) == ["1", "5"]
+    fetch.assert_not_called()
+    assert get_metrics().summary()["counters"]["pixelfed_follow_prefilter_total"] == {
+        '{result="counts"}': 2, '{result="ignored"}': 1, '{result="passed"}': 1, '{result="unknown"}': 1
+    }
+
+
+def test_follow_user_uses_embedded_account_instead_of_fetching_it(mocker, mock_settings):
+    dal.create_tables()
+    account = {**account_json("1"), "followers_count": 50}
+    fetch = mocker.patch("follow.get_timeline", return_value=[relationship_json("1")])
+    post = mocker.patch("follow.post_timeline")
+    post.return_value.status_code = 200
+    post.return_value.json.return_value = relationship_json("1", following=True)
+
+    follow_user("1", mock_settings, [status_json(account)])
+
+    # only the relationship lookup went out before the follow
+    assert [c.kwargs["timeline_type"] for c in fetch.call_args_list] == ["relationship"]
+    post.assert_called_once()
+    assert dal.get_relationship_record("1").following is True
+    assert dal.load_accounts(["1"])["1"].followers_count == 50
+    assert dal.count_todays_records() == 1
+    assert dal.sum_daily_stats("9999-12-31") == {"follows": 1}
+
+
+def test_follow_user_skips_rejected_account_without_requests(mocker, mock_settings):
+    dal.create_tables()
+    fetch = mocker.patch("follow.get_timeline")
+    post = mocker.patch("follow.post_timeline")
+
+    follow_user("2", mock_settings, [status_json({**account_json("2"), "followers_count": 5})])
+
+    fetch.assert_not_called()
+    post.assert_not_called()
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+from config import Settings
+from logconfig import (
+    ContextFilter,
+    JsonFormatter,
+    SamplingFilter,
+    action_id,
+    action_scope,
+    configure_logging,
+    session_scope,
+    stop_logging,
+)
+from metrics import instrument
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    stop_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    logging.getLogger('dal').setLevel(logging.NOTSET)
+
+
+def make_record(name='dal', level=logging.INFO, msg='saved %s rows', args=(3,)):
+    return logging.LogRecord(name, level, 'dal.py', 10, msg, args, None)
+
+
+def test_json_formatter_includes_session_and_action():
+    record = make_record()
+    with session_scope('home') as session, action_scope('fave_post'):
+        ContextFilter().filter(record)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['message'] == 'saved 3 rows'
+    assert entry['session'] == session
+    assert session.startswith('home-')
+    assert entry['action_name'] == 'fave_post'
+    assert entry['location'] == 'dal.py:10'
+
+
+def test_action_scope_restores_outer_action():
+    with action_scope('outer'):
+        outer = action_id.get()
+        with action_scope('inner'):
+            assert action_id.get() != outer
+        assert action_id.get() == outer
+    assert action_id.get() is None
+
+
+def test_instrumented_calls_get_an_action_id():
+    @instrument
+    def fetch():
+        return action_id.get()
+
+    assert fetch() is not None
+    assert fetch() != fetch()
+
+
+def test_sampling_filter_only_drops_chatty_info():
+    rolls = iter([0.5, 0.05])
+    sampling = SamplingFilter({'dal': 0.1}, rand=lambda: next(rolls))
+    assert sampling.filter(make_record()) is False
+    assert sampling.filter(make_record()) is True
+    assert sampling.filter(make_record(level=logging.WARNING)) is True
+    assert sampling.filter(make_record(name='follow')) is True
+
+
+def test_configure_logging_writes_json_lines_through_queue(tmp_path, root_logger):
+    settings = Settings()
+    settings.app_log = str(tmp_path / 'bot.log')
+    settings.log_format = 'json'
+    settings.log_levels = {'dal': 'WARNING'}
+    configure_logging(settings, stream=False)
+    assert [type(h).__name__ for h in root_logger.handlers] == ['DeferredQueueHandler']
+
+    with session_scope('tag'):
+        logging.getLogger('follow').info('following user id: %s', 42)
+        logging.getLogger('dal').info('dropped by level')
+    stop_logging()
+
+    lines = [json.loads(line) for line in (tmp_path / 'bot.log').read_text().splitlines()]
+    assert [line['message'] for line in lines] == ['following user id: 42']
+    assert lines[0]['session'].startswith('tag-')
+
+
+def test_tracebacks_are_formatted_by_the_listener(tmp_path, root_logger):
+    settings = Settings()
+    settings.app_log = str(tmp_path / 'bot.log')
+    settings.log_format = 'json'
+    configure_logging(settings, stream=False)
+
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logging.getLogger('follow').error('follow failed', exc_info=True)
+    stop_logging()
+
+    line = json.loads((tmp_path / 'bot.log').read_text())
+    assert line['message'] == 'follow failed'
+    assert 'ValueError: boom' in line['exc']
+
+
+def test_queued_records_are_written_before_exit(tmp_path):
+    log_file = tmp_path / 'bot.log'
+    code = (
+        'import logging, sys\n'
+        'from config import Settings\n'
+        'from logconfig import configure_logging\n'
+        'settings = Settings()\n'
+        f'settings.app_log = {str(log_file)!r}\n'
+        'configure_logging(settings, stream=False)\n'
+        'for i in range(2000):\n'
+        '    logging.getLogger("dal").info("line %s", i)\n'
+        'sys.exit(0)\n'
+    )
+    src = os.path.join(os.path.dirname(__file__), '..', 'src')
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=dict(os.environ, PYTHONPATH=src))
+
+    assert result.returncode == 0
+    assert len(log_file.read_text().splitlines()) == 2000
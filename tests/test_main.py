@@ -1,7 +1,10 @@
 from unittest.mock import patch, Mock
 
+from dal import create_tables
+
 from main import (
     parse_timeline_for_favorites,
+    take_favorites,
     filter_notification_faves,
     settings,
     get_status_by_id
@@ -67,6 +70,7 @@ def test_filter_notification_faves_negative_limit(notification_sample_data):
 
 
 def test_parse_timeline_for_favorites_no_limit(mock_settings, parse_timeline_for_favorites_sample_data, mock_logger):
+    create_tables()
     # Test without a limit
     result = parse_timeline_for_favorites(parse_timeline_for_favorites_sample_data)
     assert len(result) == 2
@@ -74,10 +78,11 @@ def test_parse_timeline_for_favorites_no_limit(mock_settings, parse_timeline_for
     assert result[1]["account"]["id"] == 3
 
     # Assert logging was called correctly
-    mock_logger.assert_any_call("found 2 posts to favorite from list of 4")
+    mock_logger.assert_any_call("found %s posts to favorite from list of %s", 2, 4)
 
 
 def test_parse_timeline_for_favorites_with_limit(mock_settings, parse_timeline_for_favorites_sample_data, mock_logger):
+    create_tables()
     # Test with a limit
     result = parse_timeline_for_favorites(parse_timeline_for_favorites_sample_data, limit=1)
 
@@ -86,8 +91,8 @@ def test_parse_timeline_for_favorites_with_limit(mock_settings, parse_timeline_f
     assert result[0]["account"]["id"] == 1
 
     # Assert logging was called correctly
-    mock_logger.assert_any_call("found 2 posts to favorite from list of 4")
-    mock_logger.assert_any_call("Limiting results to 1 posts")
+    mock_logger.assert_any_call("found %s posts to favorite from list of %s", 2, 4)
+    mock_logger.assert_any_call("Limiting results to %s posts", 1)
 
 
 def test_parse_timeline_for_favorites_all_favorited(mock_settings, mock_logger):
@@ -100,7 +105,7 @@ def test_parse_timeline_for_favorites_all_favorited(mock_settings, mock_logger):
 
     # Assert no results
     assert len(result) == 0
-    mock_logger.assert_any_call("No posts found: 0")
+    mock_logger.assert_any_call("No posts found: %s", 0)
 
 
 def test_parse_timeline_for_favorites_empty_input(mock_settings, mock_logger):
@@ -108,4 +113,16 @@ def test_parse_timeline_for_favorites_empty_input(mock_settings, mock_logger):
     result = parse_timeline_for_favorites([])
 
     assert len(result) == 0
-    mock_logger.assert_any_call("No posts found: 0")
+    mock_logger.assert_any_call("No posts found: %s", 0)
+
+
+def test_take_favorites_stops_reading_once_limit_is_reached(mock_settings, parse_timeline_for_favorites_sample_data, mock_logger):
+    create_tables()
+    statuses = iter([dict(status, id=str(i)) for i, status in enumerate(parse_timeline_for_favorites_sample_data)])
+
+    result = take_favorites(statuses, limit=1)
+
+    assert [status["account"]["id"] for status in result] == [1]
+    # the rest of the stream was never pulled
+    assert next(statuses)["account"]["id"] == 2
+    mock_logger.assert_any_call("found %s posts to favorite after reading %s", 1, 1)
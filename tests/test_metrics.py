@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import client
+import dal
+import metrics
+from config import Settings
+from metrics import Histogram, Metrics, endpoint, get_metrics, instrument
+
+
+def test_histogram_buckets():
+    h = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 5):
+        h.observe(value)
+    assert h.counts == [1, 2]
+    assert h.cumulative() == [1, 3]
+    assert h.count == 4
+    assert h.max == 5
+
+
+def test_render_prometheus():
+    m = Metrics()
+    m.inc('pixelfed_http_requests_total', method='GET', endpoint='timelines/home', status=200)
+    m.inc('pixelfed_http_requests_total', method='GET', endpoint='timelines/home', status=200)
+    m.observe('pixelfed_http_request_seconds', 0.02, method='GET', endpoint='timelines/home')
+    text = m.render_prometheus()
+    assert '# TYPE pixelfed_http_requests_total counter' in text
+    assert 'pixelfed_http_requests_total{endpoint="timelines/home",method="GET",status="200"} 2' in text
+    assert 'pixelfed_http_request_seconds_bucket{endpoint="timelines/home",method="GET",le="0.025"} 1' in text
+    assert 'pixelfed_http_request_seconds_bucket{endpoint="timelines/home",method="GET",le="+Inf"} 1' in text
+    assert 'pixelfed_http_request_seconds_count{endpoint="timelines/home",method="GET"} 1' in text
+
+
+def test_summary_splits_sleeping_and_working():
+    m = Metrics()
+    m.observe('pixelfed_session_seconds', 10, timeline='home')
+    m.inc('pixelfed_pacing_sleep_seconds_total', 7.5, action='read', sleeper='session')
+    m.inc('pixelfed_pacing_sleep_seconds_total', 4, action='read', sleeper='prefetch')
+    assert m.summary()['time'] == {'session': 10, 'sleeping': 7.5, 'working': 2.5}
+
+
+def test_export_writes_configured_files(tmp_path):
+    settings = Settings()
+    settings.metrics_textfile = str(tmp_path / 'bot.prom')
+    settings.metrics_json = str(tmp_path / 'bot.json')
+    m = Metrics()
+    m.inc('pixelfed_db_queries_total', 3)
+    m.export(settings)
+    assert 'pixelfed_db_queries_total 3' in (tmp_path / 'bot.prom').read_text()
+    assert json.loads((tmp_path / 'bot.json').read_text())['counters']['pixelfed_db_queries_total'] == {'total': 3}
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://pixelfed.social/api/v1/accounts/123456/statuses', 'accounts/{id}/statuses'),
+    ('https://pixelfed.social/api/v1/statuses/99/favourite', 'statuses/{id}/favourite'),
+    ('https://pixelfed.social/api/v1/timelines/tag/pnw', 'timelines/tag/pnw'),
+    ('https://pixelfed.social/api/v1/accounts/relationships?id[]=1&id[]=2', 'accounts/relationships'),
+])
+def test_endpoint_collapses_ids(url, expected):
+    assert endpoint(url, Settings()) == expected
+
+
+def test_instrument_records_operation_time():
+    @instrument
+    def fetch_something():
+        return 42
+
+    assert fetch_something() == 42
+    summary = get_metrics().summary()
+    assert summary['histograms']['pixelfed_operation_seconds']['{operation="fetch_something"}']['count'] == 1
+
+
+def test_client_records_status_and_bytes(stub_server):
+    settings = Settings()
+    settings.headers = {}
+    settings.base_url = f"http://127.0.0.1:{stub_server.server_port}/"
+    client.close_session()
+    try:
+        client.get(f"{settings.base_url}api/v1/accounts/5/statuses", settings)
+    finally:
+        client.close_session()
+    counters = get_metrics().summary()['counters']
+    assert counters['pixelfed_http_requests_total'] == {'{endpoint="accounts/{id}/statuses",method="GET",status="200"}': 1}
+    assert counters['pixelfed_http_response_bytes_total']['{endpoint="accounts/{id}/statuses"}'] > 0
+
+
+def test_db_queries_and_transactions_are_recorded(test_db):
+    dal.create_tables()
+    metrics.reset()
+    dal.add_to_ignore('1')
+    summary = get_metrics().summary()
+    # the INSERT, not the BEGIN IMMEDIATE and COMMIT around it
+    assert summary['counters']['pixelfed_db_queries_total']['total'] == 1
+    assert summary['histograms']['pixelfed_db_transaction_seconds']['{caller="add_to_ignore"}']['count'] == 1
@@ -0,0 +1,86 @@
+from unittest.mock import Mock
+
+import pytest
+
+from conftest import FakeClock
+from pacing import Pacer, TokenBucket
+
+
+PROFILES = {
+    'read': {'rate': 1.0, 'burst': 2, 'jitter': 'none'},
+    'favourite': {'rate': 0.1, 'burst': 1, 'jitter': 'uniform', 'low': 3, 'high': 3},
+}
+
+
+def make_pacer(clock, **kwargs):
+    return Pacer(PROFILES, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def rate_limited_response(remaining, reset=None):
+    response = Mock()
+    response.headers = {'X-RateLimit-Remaining': str(remaining)}
+    if reset is not None:
+        response.headers['X-RateLimit-Reset'] = str(reset)
+    return response
+
+
+def test_token_bucket_allows_burst_then_waits():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, burst=2, clock=clock)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 1.0
+    clock.now = 5
+    assert bucket.reserve() == 0
+
+
+def test_reads_are_not_slowed_within_burst():
+    clock = FakeClock()
+    pacer = make_pacer(clock)
+    assert pacer.wait('read').delay == 0
+    assert pacer.wait('read').delay == 0
+    assert clock.now == 0
+
+
+def test_write_uses_largest_of_jitter_and_bucket():
+    clock = FakeClock()
+    pacer = make_pacer(clock)
+    first = pacer.wait('favourite')
+    assert (first.delay, first.reason) == (3, 'jitter')
+    second = pacer.wait('favourite')
+    assert second.reason == 'token bucket'
+    assert second.delay == pytest.approx(7)
+    assert pacer.summary()['favourite'] == {'count': 2, 'slept': 10.0}
+    assert len(pacer.decisions) == 2
+
+
+def test_waits_for_reset_when_rate_limit_exhausted():
+    clock = FakeClock()
+    pacer = make_pacer(clock, rate_limit_floor=5)
+    pacer.observe(rate_limited_response(remaining=3, reset=30))
+    decision = pacer.wait('read')
+    assert decision.delay == 30
+    assert decision.reason.startswith('rate limit remaining 3')
+
+
+def test_spreads_remaining_budget_over_window():
+    clock = FakeClock()
+    pacer = make_pacer(clock, rate_limit_floor=0)
+    pacer.observe(rate_limited_response(remaining=10, reset=20))
+    assert pacer.wait('read').delay == 2
+
+
+def test_backs_off_without_reset_header():
+    clock = FakeClock()
+    pacer = make_pacer(clock, rate_limit_floor=5, rate_limit_backoff=60)
+    pacer.observe(rate_limited_response(remaining=0))
+    assert pacer.wait('read').delay == 60
+
+
+def test_ignores_responses_without_rate_limit_headers():
+    clock = FakeClock()
+    pacer = make_pacer(clock)
+    response = Mock()
+    response.headers = {}
+    pacer.observe(response)
+    assert pacer.remaining is None
@@ -0,0 +1,100 @@
+import threading
+import time
+from contextvars import ContextVar
+
+import pytest
+
+from conftest import FakeClock
+from metrics import get_metrics
+from pacing import Pacer
+from prefetch import Prefetcher
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_fetches_ahead_no_further_than_depth():
+    fetched = []
+    prefetcher = Prefetcher('test', lambda: fetched.append(len(fetched)) or fetched[-1], depth=2).start()
+    try:
+        wait_until(lambda: len(fetched) == 2)
+        time.sleep(0.05)
+        assert len(fetched) == 2
+
+        assert [prefetcher.get(timeout=1), prefetcher.get(timeout=1)] == [0, 1]
+        wait_until(lambda: len(fetched) == 4)
+    finally:
+        prefetcher.close(timeout=1)
+    assert get_metrics().summary()['counters']['pixelfed_prefetch_total'] == {'{outcome="ready",source="test"}': 2}
+
+
+def test_stale_results_are_dropped():
+    clock = FakeClock()
+    count = iter(range(100))
+    prefetcher = Prefetcher('test', lambda: next(count), max_age=60, clock=clock).start()
+    try:
+        wait_until(lambda: not prefetcher._queue.empty())
+        clock.now += 61
+        # 0 went stale, the worker refills with a result fetched at the current time
+        assert prefetcher.get(timeout=1) == 1
+    finally:
+        prefetcher.close(timeout=1)
+
+
+def test_fetch_errors_are_raised_on_get():
+    def fail():
+        raise RuntimeError('boom')
+
+    prefetcher = Prefetcher('test', fail).start()
+    with pytest.raises(RuntimeError):
+        prefetcher.get(timeout=1)
+    prefetcher.close(timeout=1)
+
+
+def test_close_during_pacing_skips_the_fetch():
+    pacing = threading.Event()
+    release = threading.Event()
+    fetched = []
+
+    def pace():
+        pacing.set()
+        release.wait(1)
+
+    prefetcher = Prefetcher('test', lambda: fetched.append(1), pace=pace).start()
+    pacing.wait(1)
+    prefetcher.close()
+    release.set()
+    prefetcher._thread.join(1)
+
+    assert not prefetcher._thread.is_alive()
+    assert fetched == []
+
+
+def test_worker_runs_in_the_callers_context():
+    var = ContextVar('var', default=None)
+    var.set('session')
+    prefetcher = Prefetcher('test', var.get).start()
+    try:
+        assert prefetcher.get(timeout=1) == 'session'
+    finally:
+        prefetcher.close(timeout=1)
+
+
+def test_worker_pacing_is_counted_apart_from_the_session():
+    profiles = {'read': {'rate': 1.0, 'burst': 1, 'jitter': 'uniform', 'low': 2, 'high': 2}}
+    pacer = Pacer(profiles, sleep=lambda seconds: None)
+    pacer.wait('read')
+    prefetcher = Prefetcher('test', lambda: 1, pace=lambda: pacer.wait('read')).start()
+    try:
+        assert prefetcher.get(timeout=1) == 1
+    finally:
+        prefetcher.close(timeout=1)
+
+    counters = get_metrics().summary()['counters']['pixelfed_pacing_sleep_seconds_total']
+    assert counters['{action="read",sleeper="session"}'] == 2
+    assert counters['{action="read",sleeper="prefetch"}'] >= 2
+    assert get_metrics().summary()['time']['sleeping'] == 2
@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import timedelta
+
+import dal
+from conftest import make_relationship as relationship
+from report import build_report, render, today
+
+
+def stats():
+    with dal.create_connection() as cursor:
+        cursor.execute('SELECT metric, dimension, count FROM daily_stats ORDER BY metric, dimension')
+        return {(metric, dimension): count for metric, dimension, count in cursor.fetchall()}
+
+
+def test_relationship_changes_are_counted_by_triggers(test_db):
+    dal.create_tables()
+    # 1 we followed, 2 already follows us, 3 is unfollowed, re-saving unchanged rows counts nothing
+    dal.save_relationships([relationship('1', following=True), relationship('2', followed_by=True)])
+    dal.mark_followed('1')
+    dal.save_relationships([relationship('1', following=True, followed_by=True), relationship('2')])
+    dal.save_relationships([relationship('3', following=True)])
+    dal.save_relationships([relationship('3')])
+
+    assert stats() == {
+        ('unfollows', ''): 1, ('follow_backs', ''): 1, ('followers_found', ''): 2, ('followers_lost', ''): 1,
+    }
+
+
+def test_syncs_count_growth_only_after_a_complete_followers_sync(test_db):
+    dal.create_tables()
+    dal.mark_relationships([str(i) for i in range(100)], 'following')
+    dal.mark_relationships([str(i) for i in range(50, 300)], 'followed_by')
+    assert stats() == {('followers_found', ''): 250}
+
+    dal.save_sync_state('synced:followers', '2024-01-01T00:00:00')
+    dal.mark_relationships(['1', '300'], 'followed_by')
+    assert stats() == {('followers_found', ''): 250, ('followers_gained', ''): 2}
+
+
+def test_existing_relationships_are_backfilled_once(test_db):
+    with dal.create_connection() as cursor:
+        cursor.execute('CREATE TABLE followers (id TEXT, username TEXT, last_updated DATETIME)')
+        cursor.execute('CREATE TABLE following (id TEXT, username TEXT, acct TEXT, display_name TEXT, '
+                       'followers_count INTEGER, following_count INTEGER, created_at DATETIME, last_updated DATETIME)')
+        cursor.execute("INSERT INTO followers VALUES ('2', 'two', '2024-01-01 10:00:00'), ('3', 'three', '2024-01-02')")
+    dal.create_tables()
+    dal.create_tables()
+
+    assert dal.load_daily_stats('2024-01-01', '2024-01-02') == [
+        ('2024-01-01', 'followers_found', '', 1), ('2024-01-02', 'followers_found', '', 1)
+    ]
+
+
+def test_build_report_reads_summary_rows(test_db):
+    dal.create_tables()
+    day = today()
+    with dal.create_connection() as cursor:
+        cursor.executemany('INSERT INTO daily_stats VALUES (?, ?, ?, ?)', [
+            ((day - timedelta(days=30)).isoformat(), 'followers_found', '', 10),
+            ((day - timedelta(days=2)).isoformat(), 'likes', 'home', 4),
+            ((day - timedelta(days=2)).isoformat(), 'follows', '', 2),
+            (day.isoformat(), 'likes', 'tag', 3),
+            (day.isoformat(), 'follow_backs', '', 1),
+            (day.isoformat(), 'followers_gained', '', 1),
+            (day.isoformat(), 'followers_lost', '', 3),
+        ])
+    dal.bump_daily_stat('likes', 'tag', 2)
+
+    report = build_report(days=3)
+
+    assert [entry['day'] for entry in report['days']] == [(day - timedelta(days=n)).isoformat() for n in (2, 1, 0)]
+    assert report['days'][0]['likes'] == {'home': 4} and report['days'][1]['likes_total'] == 0
+    assert report['days'][2]['likes'] == {'tag': 5}
+    assert [entry['followers'] for entry in report['days']] == [10, 10, 8]
+    assert report['totals']['likes'] == {'home': 4, 'tag': 5}
+    assert report['totals']['follow_back_rate'] == 0.5
+    assert report['followers'] == 8
+
+
+def test_render_text_and_json(test_db):
+    dal.create_tables()
+    dal.bump_daily_stat('likes', 'home', 3)
+    report = build_report(days=2)
+
+    text = render(report)
+    header, *_, total, rate = text.splitlines()
+    assert header.split() == ['day', 'likes', 'likes:home', 'follows', 'follow_backs', 'unfollows',
+                              '+followers', '-followers', 'net', 'found', 'followers']
+    assert total.split() == ['total', '3', '3', '0', '0', '0', '0', '0', '0', '0', '0']
+    assert rate == 'follow back rate: -'
+    assert json.loads(render(report, 'json')) == report
+
+
+def test_report_cli(tmp_path):
+    src = os.path.join(os.path.dirname(__file__), '..', 'src')
+    env = dict(os.environ, PYTHONPATH=src, APP_LOG=str(tmp_path / 'pixelbot.log'))
+
+    result = subprocess.run([sys.executable, os.path.join(src, 'main.py'), '-t', 'home', '--report', 'json', '--days', '2'],
+                            cwd=tmp_path, env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert len(json.loads(result.stdout)['days']) == 2
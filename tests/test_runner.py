@@ -0,0 +1,109 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+import client
+import dal
+import main
+import pacing
+from config import PixelFedBotException, Settings, SettingsProxy, active_settings, use_settings
+from mock_server import MockPixelfedServer
+from runner import load_profiles, run_accounts
+
+
+def write_profiles(tmp_path, profiles):
+    path = tmp_path / 'accounts.json'
+    path.write_text(json.dumps(profiles))
+    return str(path)
+
+
+def test_load_profiles_overrides_settings(tmp_path):
+    path = write_profiles(tmp_path, [
+        {'name': 'runner', 'token': 'a', 'account_id': '1', 'likes_per_session': 3},
+        {'name': 'birds', 'token': 'b', 'account_id': '2', 'db_path': str(tmp_path / 'birds.db')},
+    ])
+    runner, birds = load_profiles(path)
+    assert runner.likes_per_session == 3
+    assert runner.db_path == 'runner.db'
+    assert runner.headers == {'Authorization': 'Bearer a'}
+    assert birds.db_path == str(tmp_path / 'birds.db')
+    assert birds.likes_per_session == Settings().likes_per_session
+
+
+@pytest.mark.parametrize('profiles', [
+    [{'name': 'a', 'likes_per_sesion': 3}],
+    [{'token': 'a'}],
+    [{'name': 'a'}, {'name': 'a'}],
+    [{'name': 'a', 'db_path': 'x.db'}, {'name': 'b', 'db_path': 'x.db'}],
+    [],
+])
+def test_load_profiles_rejects_bad_profiles(tmp_path, profiles):
+    with pytest.raises(PixelFedBotException):
+        load_profiles(write_profiles(tmp_path, profiles))
+
+
+def test_settings_proxy_follows_context():
+    default, other = Settings(), Settings()
+    other.name = 'other'
+    proxy = SettingsProxy(default)
+    assert proxy.name == 'default'
+    with use_settings(other):
+        assert proxy.name == 'other'
+        proxy.likes_per_session = 1
+    assert active_settings() is None
+    assert other.likes_per_session == 1
+    assert default.likes_per_session == Settings().likes_per_session
+
+
+def test_use_database_is_per_context(tmp_path):
+    seen = {}
+
+    def worker(name):
+        with dal.use_database(str(tmp_path / f'{name}.db')):
+            seen[name] = dal.current_db_path()
+            dal.create_tables()
+            dal.add_to_ignore(name)
+            dal.close_connection()
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {'a': str(tmp_path / 'a.db'), 'b': str(tmp_path / 'b.db')}
+    for name in ('a', 'b'):
+        with sqlite3.connect(tmp_path / f'{name}.db') as conn:
+            assert conn.execute('SELECT id FROM ignore_account').fetchall() == [(name,)]
+
+
+def test_run_accounts_keeps_accounts_apart(tmp_path, monkeypatch):
+    server = MockPixelfedServer().start()
+    monkeypatch.setattr('main.settings', SettingsProxy(Settings()))
+    profiles = load_profiles(write_profiles(tmp_path, [
+        {'name': name, 'token': name, 'account_id': id, 'base_url': server.base_url,
+         'likes_per_session': 3, 'db_path': str(tmp_path / f'{name}.db')}
+        for name, id in (('runner', '1'), ('birds', '2'))
+    ]))
+    for profile in profiles:
+        profile.metrics_json = str(tmp_path / 'metrics.json')
+        pacing.set_pacer(profile, pacing.Pacer(profile.pacing, 0, 0, sleep=lambda seconds: None))
+    client.close_session()
+    try:
+        results = run_accounts(profiles, main.run_scheduled_session, 'home')
+        sessions = dict(client._sessions)
+        adapters = {id(session.get_adapter(server.base_url)) for session in sessions.values()}
+    finally:
+        client.close_session()
+        server.stop()
+
+    assert results == {'runner': 3, 'birds': 3}
+    # account sessions leave the export to the caller
+    assert not (tmp_path / 'metrics.json').exists()
+    assert server.counts['favourite'] == 6
+    assert len(sessions) == 2
+    assert len(adapters) == 1
+    for profile in profiles:
+        with sqlite3.connect(profile.db_path) as conn:
+            assert conn.execute('SELECT value FROM sync_state').fetchall()
@@ -0,0 +1,72 @@
+import random
+from collections import Counter
+
+import dal
+from config import Settings
+from conftest import FakeClock, make_account
+from sampling import DAY, FollowerSampler
+
+NOW = 1_700_000_000.0
+
+
+def add_followers(ids):
+    dal.create_tables()
+    dal.save_accounts([make_account(id) for id in ids])
+    dal.mark_relationships(ids, 'followed_by')
+
+
+def test_sample_returns_distinct_followers(test_db):
+    add_followers([str(i) for i in range(50)])
+    sampled = FollowerSampler(Settings()).sample(10)
+    assert len(sampled) == 10
+    assert len({id for id, _ in sampled}) == 10
+    assert all(username == f'user{id}' for id, username in sampled)
+
+
+def test_sample_without_followers(test_db):
+    dal.create_tables()
+    assert FollowerSampler(Settings()).sample(5) == []
+
+
+def test_sample_skips_ignored(test_db):
+    add_followers(['1', '2'])
+    dal.add_to_ignore('2')
+    assert FollowerSampler(Settings()).sample(5) == [('1', 'user1')]
+
+
+def test_recent_interaction_is_in_cooldown(test_db):
+    add_followers(['1', '2'])
+    clock = FakeClock(NOW)
+    sampler = FollowerSampler(Settings(), clock=clock)
+    sampler.record_interaction('1')
+    assert sampler.sample(5) == [('2', 'user2')]
+
+    # the interaction is persisted, a fresh sampler keeps the cooldown
+    assert FollowerSampler(Settings(), clock=clock).sample(5) == [('2', 'user2')]
+
+    clock.now += Settings().follower_cooldown + 1
+    assert len(sampler.sample(5)) == 2
+
+
+def test_long_idle_followers_are_favoured(test_db):
+    add_followers(['1', '2'])
+    clock = FakeClock(NOW)
+    dal.record_interaction('1', clock.now - 20 * DAY)
+    dal.record_interaction('2', clock.now - 4 * DAY)
+    sampler = FollowerSampler(Settings(), clock=clock)
+    assert sampler.weight(None, clock.now - 20 * DAY, clock.now) > sampler.weight(None, clock.now - 4 * DAY, clock.now)
+
+    random.seed(3)
+    picks = Counter(sampler.sample(1)[0][0] for _ in range(500))
+    assert picks['1'] > picks['2']
+
+
+def test_sample_reloads_after_refresh(test_db):
+    add_followers(['1'])
+    clock = FakeClock(NOW)
+    sampler = FollowerSampler(Settings(), clock=clock)
+    assert len(sampler.sample(5)) == 1
+    add_followers(['2'])
+    assert len(sampler.sample(5)) == 1
+    clock.now += Settings().follower_sample_refresh + 1
+    assert len(sampler.sample(5)) == 2
@@ -0,0 +1,98 @@
+import dal
+from cache import get_relationship_cache
+from config import Settings
+from conftest import FakeClock, account_json, make_account, make_relationship as relationship
+from scoring import FollowScorer, bucket
+
+
+def test_bucket():
+    assert bucket(50, 60) == 'r2:s0'
+    assert bucket(5000, 100) == 'r0:s3'
+    assert bucket(0, 10) == 'r3:s0'
+    assert bucket(None, 10) == 'unknown'
+
+
+def test_earlier_follows_are_counted_once_and_follow_backs_credited(test_db):
+    dal.create_tables()
+    dal.save_accounts([make_account('1'), make_account('2')])
+    dal.save_relationships([relationship('1', following=True, followed_by=True), relationship('2', following=True)])
+    scorer = FollowScorer(Settings())
+
+    scorer.load()
+    scorer.load()
+    key = bucket(make_account('1').followers_count, make_account('1').following_count)
+    assert scorer.outcomes == {key: (2, 1)}
+
+    # a follow back synced later lands in the same bucket through the trigger
+    dal.mark_relationships(['2'], 'followed_by')
+    assert dal.load_follow_outcomes() == {key: (2, 2)}
+
+
+def test_follow_back_rate_is_pulled_toward_overall_rate(test_db):
+    dal.create_tables()
+    settings = Settings()
+    settings.score_prior_weight = 10
+    scorer = FollowScorer(settings)
+    scorer.outcomes = {'r2:s0': (10, 8), 'r0:s3': (30, 0)}
+    scorer.overall_rate = 0.2
+
+    assert scorer.follow_back_rate('r2:s0') == (8 + 2) / 20
+    assert scorer.follow_back_rate('r0:s3') == 2 / 40
+    assert scorer.follow_back_rate('r1:s1') == 0.2
+
+
+def test_take_ranks_by_rate_source_recency_and_cost(test_db):
+    dal.create_tables()
+    settings = Settings()
+    settings.score_refresh = float('inf')
+    settings.score_source_weights = {'notifications': 1.5}
+    clock = FakeClock()
+    scorer = FollowScorer(settings, clock=clock)
+    scorer.load()
+    scorer.outcomes = {bucket(50, 60): (20, 15), bucket(5000, 100): (20, 0)}
+    scorer.offer([account_json('old', 50, 60)], 'home')
+    clock.now += settings.score_half_life * 2
+    scorer.offer([account_json('big', 5000, 100), account_json('fresh', 50, 60), {'id': 'bare'}], 'home')
+    scorer.offer([account_json('fan', 50, 60)], 'notifications')
+    # a cached relationship saves the lookup
+    get_relationship_cache(settings).put(relationship('fresh'))
+
+    assert [c.id for c in scorer.take(5)] == ['fresh', 'fan', 'old', 'bare', 'big']
+    assert scorer.take(1) == []
+
+
+def test_offer_keeps_the_best_source_per_account(test_db):
+    settings = Settings()
+    settings.score_source_weights = {'notifications': 2.0}
+    scorer = FollowScorer(settings)
+    scorer.offer([account_json('1', 50, 60)], 'notifications')
+    scorer.offer([account_json('1', 50, 60), account_json('2', 50, 60)], 'home')
+
+    assert scorer.pool['1'].source == 'notifications'
+    assert scorer.pool['2'].source == 'home'
+
+
+def test_take_drops_expired_followed_and_ignored(test_db):
+    dal.create_tables()
+    settings = Settings()
+    clock = FakeClock()
+    scorer = FollowScorer(settings, clock=clock)
+    scorer.offer([account_json('expired', 50, 60)], 'home')
+    clock.now += settings.score_max_age + 1
+    scorer.offer([account_json('1', 50, 60), account_json('2', 50, 60), account_json('3', 50, 60)], 'home')
+    get_relationship_cache(settings).put(relationship('1', following=True))
+    get_relationship_cache(settings).ignore('2')
+
+    assert [c.id for c in scorer.take(5)] == ['3']
+
+
+def test_record_follow_counts_the_attempt(test_db):
+    dal.create_tables()
+    dal.save_relationships([relationship('1', following=True)])
+    scorer = FollowScorer(Settings())
+    scorer.load()
+
+    scorer.record_follow('1', 50, 60)
+
+    assert scorer.outcomes[bucket(50, 60)] == (1, 0)
+    assert dal.load_follow_outcomes() == {bucket(50, 60): (1, 0)}
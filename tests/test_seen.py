@@ -0,0 +1,63 @@
+import dal
+import main
+from seen import BloomFilter, SeenIndex
+
+
+def test_bloom_filter_has_no_false_negatives(tmp_path):
+    bloom = BloomFilter(str(tmp_path / 'ids.bloom'), capacity=1000, error_rate=0.01)
+    ids = [str(i) for i in range(1000)]
+    for id in ids:
+        bloom.add(id)
+    assert all(id in bloom for id in ids)
+    false_positives = sum(str(i) in bloom for i in range(100000, 110000))
+    assert false_positives < 300
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_persists_across_reopen(tmp_path):
+    path = str(tmp_path / 'ids.bloom')
+    bloom = BloomFilter(path, capacity=100, error_rate=0.01)
+    bloom.add('42')
+    bloom.close()
+
+    reopened = BloomFilter(path, capacity=100, error_rate=0.01)
+    assert '42' in reopened
+    assert reopened.count == 1
+
+
+def test_seen_index_confirms_maybe_against_db(tmp_path, test_db):
+    dal.create_tables()
+    index = SeenIndex(str(tmp_path / 'seen'), capacity=100, error_rate=0.01)
+    index.mark_seen(['1', '2'])
+    assert index.is_seen('1')
+    assert not index.is_seen('3')
+
+    # simulate a bloom false positive: in the filter but never recorded
+    index.current.add('99')
+    assert not index.is_seen('99')
+
+
+def test_seen_index_rotation_bounds_generations(tmp_path, test_db):
+    dal.create_tables()
+    index = SeenIndex(str(tmp_path / 'seen'), capacity=3, error_rate=0.01)
+    index.mark_seen(['1', '2', '3'])
+    assert index.previous is not None
+    assert index.is_seen('1')
+
+    index.mark_seen(['4', '5', '6'])
+    assert index.is_seen('4')
+    assert not index.is_seen('1')
+    assert dal.find_seen_status(['1', '4']) == {'4'}
+
+
+def test_parse_timeline_for_favorites_skips_seen_statuses(mock_settings, test_db):
+    dal.create_tables()
+    data = [
+        {"id": "1", "favourited": False, "account": {"id": "10"}},
+        {"id": "2", "favourited": True, "account": {"id": "11"}},
+        {"id": "3", "favourited": False, "account": {"id": "12"}},
+    ]
+    assert [d["id"] for d in main.parse_timeline_for_favorites(data, limit=1)] == ["1"]
+    # 1 was picked and 2 rejected, 3 is still eligible
+    assert [d["id"] for d in main.parse_timeline_for_favorites(data)] == ["3"]
+    assert main.parse_timeline_for_favorites(data) == []
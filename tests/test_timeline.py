@@ -1,11 +1,18 @@
-import requests
+import json
 from unittest.mock import Mock
 
+import pytest
+
+import client
+import dal
+from config import PixelFedBotException
+from conftest import page_response
 from main import (
     get_timeline_url,
     get_timeline,
     settings
 )
+from timelines import advance_high_water_mark, fetch_new_timeline, get_new_timeline, paginate, stream_new_timeline
 
 
 def test_get_timeline_url_global(mock_settings):
@@ -13,7 +20,7 @@ def test_get_timeline_url_global(mock_settings):
     Test the function for the 'global' timeline type.
     """
     url, timeline_type = get_timeline_url("global", mock_settings)
-    assert url == "https://example.com/v1/timelines/public?min_id=1&limit=6&_pe=1&remote=true"
+    assert url == "https://example.com/v1/timelines/public?limit=6&_pe=1&remote=true"
     assert timeline_type == "global"
 
 
@@ -35,6 +42,16 @@ def test_get_timeline_url_followers(mock_settings):
     assert timeline_type == "followers"
 
 
+def test_get_timeline_url_relationships_many_ids(mock_settings):
+    """
+    Test that 'relationships' builds one id[] parameter per account id.
+    """
+    url, _ = get_timeline_url("relationships", mock_settings, "7")
+    assert url == "https://example.com/v1/accounts/relationships?id[]=7"
+    url, _ = get_timeline_url("relationships", mock_settings, ["7", "8", "9"])
+    assert url == "https://example.com/v1/accounts/relationships?id[]=7&id[]=8&id[]=9"
+
+
 def test_get_timeline_url_tags(mock_settings):
     """
     Test the function for the 'tags' timeline type.
@@ -57,12 +74,12 @@ def test_get_timeline_success(mocker, mock_settings, mock_logger, mock_headers):
     """
     Test that the function returns the correct JSON response when the request is successful.
     """
-    # Mock the requests.get call
+    # Mock the client.get call
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.json.return_value = {"data": "timeline_data"}
-    mocker.patch("requests.get", return_value=mock_response)
-    mocker.patch("timelines.random_time", return_value=0)
+    mock_response.content = b'{"data": "timeline_data"}'
+    mocker.patch("client.get", return_value=mock_response)
+    mocker.patch("timelines.throttle")
 
     # Call the function
     url = "https://example.com/api/timeline"
@@ -70,9 +87,9 @@ def test_get_timeline_success(mocker, mock_settings, mock_logger, mock_headers):
 
     # Assertions
     assert result == {"data": "timeline_data"}
-    requests.get.assert_called_once_with(
+    client.get.assert_called_once_with(
         url,
-        headers=mock_headers,
+        settings,
         params={"limit": 10}
     )
 
@@ -81,12 +98,12 @@ def test_get_timeline_custom_limit(mocker, mock_settings, mock_logger, mock_head
     """
     Test that the function respects the custom limit parameter.
     """
-    # Mock the requests.get call
+    # Mock the client.get call
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.json.return_value = {"data": "timeline_data"}
-    mocker.patch("requests.get", return_value=mock_response)
-    mocker.patch("timelines.random_time", return_value=0)
+    mock_response.content = b'{"data": "timeline_data"}'
+    mocker.patch("client.get", return_value=mock_response)
+    mocker.patch("timelines.throttle")
 
     # Call the function with a custom limit
     url = "https://example.com/api/timeline"
@@ -94,9 +111,9 @@ def test_get_timeline_custom_limit(mocker, mock_settings, mock_logger, mock_head
 
     # Assertions
     assert result == {"data": "timeline_data"}
-    requests.get.assert_called_once_with(
+    client.get.assert_called_once_with(
         url,
-        headers=mock_headers,
+        settings,
         params={"limit": 5}
     )
 
@@ -105,11 +122,11 @@ def test_get_timeline_failure(mocker, mock_settings, mock_logger, mock_headers):
     """
     Test that the function returns an empty dictionary when the request fails.
     """
-    # Mock the requests.get call to simulate a failure
+    # Mock the client.get call to simulate a failure
     mock_response = Mock()
     mock_response.status_code = 404
-    mocker.patch("requests.get", return_value=mock_response)
-    mocker.patch("timelines.random_time", return_value=0)
+    mocker.patch("client.get", return_value=mock_response)
+    mocker.patch("timelines.throttle")
     # headers = mock_headers
     # Call the function
     url = "https://example.com/api/timeline"
@@ -117,8 +134,113 @@ def test_get_timeline_failure(mocker, mock_settings, mock_logger, mock_headers):
 
     # Assertions
     assert result == {}
-    requests.get.assert_called_once_with(
+    client.get.assert_called_once_with(
         url,
-        headers=mock_headers,
+        settings,
         params={"limit": 10}
     )
+
+
+def test_paginate_follows_link_header(mocker, mock_settings):
+    mocker.patch("client.get", side_effect=[
+        page_response([{"id": "30"}, {"id": "20"}], next_max_id="15"),
+        page_response([{"id": "10"}], prev_only=True),
+    ])
+    url = "https://example.com/v1/accounts/4/followers"
+
+    pages = list(paginate(url, mock_settings, limit=2, pace=False))
+
+    assert pages == [([{"id": "30"}, {"id": "20"}], "15"), ([{"id": "10"}], None)]
+    assert client.get.call_args_list[1].kwargs["params"] == {"limit": 2, "max_id": "15"}
+
+
+def test_paginate_stops_on_empty_page(mocker, mock_settings):
+    mocker.patch("client.get", side_effect=[page_response([{"id": "3"}]), page_response([])])
+
+    pages = list(paginate("https://example.com/v1/accounts/4/following", mock_settings, pace=False))
+
+    assert pages == [([{"id": "3"}], "3")]
+
+
+def test_paginate_raises_on_a_failed_page(mocker, mock_settings):
+    failed = Mock(status_code=429)
+    mocker.patch("client.get", side_effect=[page_response([{"id": "3"}], next_max_id="3"), failed])
+
+    pages = paginate("https://example.com/v1/accounts/4/following", mock_settings, pace=False)
+
+    assert next(pages) == ([{"id": "3"}], "3")
+    with pytest.raises(PixelFedBotException, match="status code: 429"):
+        next(pages)
+    failed.close.assert_called_once()
+
+
+def timeline_response(statuses):
+    response = Mock()
+    response.status_code = 200
+    response.content = json.dumps(statuses).encode()
+    # split mid item, the decoder has to carry the partial object over
+    response.iter_content = lambda chunk_size: (response.content[i:i + 7] for i in range(0, len(response.content), 7))
+    return response
+
+
+def test_get_new_timeline_sends_and_advances_high_water_mark(mocker, mock_settings, test_db):
+    dal.create_tables()
+    mocker.patch("timelines.throttle")
+    mocker.patch("client.get", side_effect=[
+        timeline_response([{"id": "998"}, {"id": "1001"}, {"id": "999"}]),
+        timeline_response([]),
+    ])
+    url_args = ("https://example.com/v1/timelines/home", "home")
+
+    assert len(get_new_timeline(url_args, mock_settings)) == 3
+    assert dal.get_sync_state("since:home") == "1001"
+
+    assert get_new_timeline(url_args, mock_settings) == []
+    assert client.get.call_args.kwargs["params"] == {"limit": 10, "since_id": "1001"}
+    assert dal.get_sync_state("since:home") == "1001"
+
+
+def test_fetch_new_timeline_leaves_the_mark_to_the_consumer(mocker, mock_settings, test_db):
+    dal.create_tables()
+    mocker.patch("timelines.throttle")
+    mocker.patch("client.get", return_value=timeline_response([{"id": "7"}, {"id": "9"}]))
+    url_args = ("https://example.com/v1/timelines/home", "home")
+
+    server_response, mark = fetch_new_timeline(url_args, mock_settings)
+    assert len(server_response) == 2
+    assert dal.get_sync_state("since:home") is None
+
+    advance_high_water_mark(*mark)
+    assert dal.get_sync_state("since:home") == "9"
+
+
+def test_get_new_timeline_keys_tags_and_uses_min_id_for_global(mocker, mock_settings, test_db):
+    dal.create_tables()
+    mocker.patch("timelines.throttle")
+    mocker.patch("client.get", return_value=timeline_response([{"id": "5"}]))
+
+    get_new_timeline(("https://example.com/v1/timelines/tag/pnw", "pnw"), mock_settings)
+    assert dal.get_sync_state("since:tag:pnw") == "5"
+
+    dal.save_sync_state("since:global", "3")
+    get_new_timeline(get_timeline_url("global", mock_settings), mock_settings)
+    assert client.get.call_args.kwargs["params"]["min_id"] == "3"
+    assert dal.get_sync_state("since:global") == "5"
+
+
+def test_stream_new_timeline_stops_early_and_advances_to_newest_read(mocker, mock_settings, test_db):
+    dal.create_tables()
+    mocker.patch("timelines.throttle")
+    response = timeline_response([{"id": "1003"}, {"id": "1002"}, {"id": "1001"}])
+    response.close = Mock()
+    mocker.patch("client.get", return_value=response)
+    url_args = ("https://example.com/v1/timelines/home", "home")
+
+    stream = stream_new_timeline(url_args, mock_settings)
+    first = next(stream)
+    stream.close()
+
+    assert first == {"id": "1003"}
+    assert client.get.call_args.kwargs["stream"] is True
+    response.close.assert_called_once()
+    assert dal.get_sync_state("since:home") == "1003"